@@ -1,29 +1,127 @@
 import json
+import queue
+import time
 import traceback
 import uuid
+from functools import wraps
+from threading import BoundedSemaphore
 
-from flask import Flask, request, render_template, redirect, url_for
+from flask import Flask, Response, request, render_template, redirect, url_for, send_from_directory, g, stream_with_context, make_response, template_rendered
 
-from config import BASE_URL, AUTO_SPEND, SPOOLMAN_BASE_URL, EXTERNAL_SPOOL_AMS_ID, EXTERNAL_SPOOL_ID, PRINTER_NAME
+from config import BASE_URL, AUTO_SPEND, SPOOLMAN_BASE_URL, EXTERNAL_SPOOL_AMS_ID, EXTERNAL_SPOOL_ID, SPOOLMAN_WEBSOCKET, EVENT_STREAMS_MAX
 from filament import generate_filament_brand_code, generate_filament_temperatures
-from frontend_utils import color_is_dark
+from frontend_utils import color_is_dark, FragmentCache
+from markupsafe import Markup
 from messages import AMS_FILAMENT_SETTING
-from mqtt_bambulab import fetchSpools, getLastAMSConfig, publish, getMqttClient, setActiveTray, isMqttClientConnected, init_mqtt, getPrinterModel
-from spoolman_client import patchExtraTags, getSpoolById, consumeSpool
-from spoolman_service import augmentTrayDataWithSpoolMan, trayUid, getSettings
-from print_history import get_prints_with_filament, update_filament_spool, get_filament_for_slot
+from mqtt_bambulab import fetchSpools, getLastAMSConfig, publish, getMqttClient, setActiveTray, isMqttClientConnected, init_mqtt, getPrinterModel, getPrinter, getPrinters
+from spoolman_client import getSpoolById
+from spoolman_service import augmentTrayDataWithSpoolMan, trayUid, getSettings, patchExtraTags, consumeSpool, SPOOL_INDEX, startSpoolCacheRefresher, waitForWrites, getSpoolCacheVersion
+from printer_events import PRINTER_EVENTS
+from print_history import get_prints_with_filament, update_filament_spool, get_filament_for_slot, get_print, get_revision, get_spool_usage, get_monthly_spend
+from tools_3mf import PRINTS_DIR
 
 init_mqtt()
+startSpoolCacheRefresher()
+
+if SPOOLMAN_WEBSOCKET:
+  from spoolman_events import startSpoolmanEventListener
+  startSpoolmanEventListener()
 
 app = Flask(__name__)
 
+THUMBNAIL_MAX_AGE = 365 * 24 * 60 * 60
+PRINT_HISTORY_PAGE_SIZE = 50
+# Spool lists and tray cards, rendered again only when the spools or the printer's AMS report changed
+FRAGMENT_CACHE = FragmentCache()
+# Part of every ETag: a restarted process doesn't know what the old one sent
+ETAG_SALT = uuid.uuid4().hex[:8]
+EVENT_STREAM_POLL = 1  # seconds between checks of the spool cache for new weights
+EVENT_STREAM_HEARTBEAT = 15  # seconds of silence before a comment keeps proxies from closing the stream
+
+# Pages that show or change the trays of one printer, selected with ?printer=<id>
+PRINTER_ENDPOINTS = {"home", "issue", "fill", "spool_info", "tray_load", "events"}
+
+@app.before_request
+def select_printer():
+  printer_id = request.args.get("printer") or None
+  g.printer = getPrinter(printer_id)
+  if g.printer is None:
+    g.printer = getPrinter()
+    return render_template('error.html', exception=f"Unknown printer {printer_id}")
+
+# Links between the pages of a printer stay on that printer
+@app.url_defaults
+def keep_printer(endpoint, values):
+  printer = g.get("printer")
+  if printer is not None and endpoint in PRINTER_ENDPOINTS and len(getPrinters()) > 1:
+    values.setdefault("printer", printer.id)
+
 @app.context_processor
 def fronted_utilities():
-  return dict(SPOOLMAN_BASE_URL=SPOOLMAN_BASE_URL, AUTO_SPEND=AUTO_SPEND, color_is_dark=color_is_dark, BASE_URL=BASE_URL, EXTERNAL_SPOOL_AMS_ID=EXTERNAL_SPOOL_AMS_ID, EXTERNAL_SPOOL_ID=EXTERNAL_SPOOL_ID, PRINTER_MODEL=getPrinterModel(), PRINTER_NAME=PRINTER_NAME)
+  printer = g.get("printer") or getPrinter()
+  return dict(SPOOLMAN_BASE_URL=SPOOLMAN_BASE_URL, AUTO_SPEND=AUTO_SPEND, color_is_dark=color_is_dark, BASE_URL=BASE_URL, EXTERNAL_SPOOL_AMS_ID=EXTERNAL_SPOOL_AMS_ID, EXTERNAL_SPOOL_ID=EXTERNAL_SPOOL_ID, PRINTER_MODEL=getPrinterModel(printer.id), PRINTER_NAME=printer.name, PRINTER=printer, PRINTERS=getPrinters(), renderTray=renderTray)
+
+def renderFragment(template, key, context, ams=True):
+  """
+  template rendered with the variables context() returns, reused until the
+  spool cache or, unless ams is False, the AMS report of the request's printer
+  changes. key has to tell apart everything else the fragment depends on.
+  """
+  version = (getSpoolCacheVersion(), g.printer.ams_version if ams else None)
+  return Markup(FRAGMENT_CACHE.get((template, g.printer.id) + key, version, lambda: render_template(template, **context())))
+
+# Versions of what the pages are built from, for their ETags
+def spoolsVersion():
+  return getSpoolCacheVersion()
+
+def amsVersion():
+  return g.printer.ams_version
+
+def printStatusVersion():
+  return g.printer.status_version
+
+def printHistoryVersion():
+  return get_revision()
+
+def conditional(*versions, unless=()):
+  """
+  Gives the view's page a weak ETag made from versions, the printer and which
+  printers are connected (the header shows them). A GET whose If-None-Match
+  still matches gets a 304 before the view runs, so it costs no SpoolMan access
+  and at most one read of the print history's revision row in SQLite. Requests
+  with any of the unless arguments change something and always run the view.
+  """
+  def decorator(view):
+    @wraps(view)
+    def conditional_view(*args, **kwargs):
+      if any(request.args.get(name) for name in unless):
+        return view(*args, **kwargs)
+
+      connected = "".join("1" if printer.connected else "0" for printer in getPrinters())
+      etag = "-".join([ETAG_SALT, g.printer.id, connected] + [str(version()) for version in versions])
+
+      if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+      else:
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200 or g.get("error_page"):
+          return response
+
+      response.set_etag(etag, weak=True)
+      response.headers["Cache-Control"] = "no-cache"
+      return response
+    return conditional_view
+  return decorator
+
+# Error pages are sent as 200 too, they must not be revalidated like the page they stand in for
+@template_rendered.connect_via(app)
+def remember_error_page(sender, template, context, **extra):
+  if template.name == "error.html":
+    g.error_page = True
 
 @app.route("/issue")
 def issue():
-  if not isMqttClientConnected():
+  if not isMqttClientConnected(g.printer.id):
     return render_template('error.html', exception="MQTT is disconnected. Is the printer online?")
     
   ams_id = request.args.get("ams")
@@ -33,8 +131,8 @@ def issue():
 
   fix_ams = None
 
-  spool_list = fetchSpools()
-  last_ams_config = getLastAMSConfig()
+  fetchSpools()
+  last_ams_config = getLastAMSConfig(g.printer.id)
   if ams_id == EXTERNAL_SPOOL_AMS_ID:
     fix_ams = last_ams_config.get("vt_tray", {})
   else:
@@ -44,10 +142,9 @@ def issue():
         break
 
   active_spool = None
-  for spool in spool_list:
-    if spool.get("extra") and spool["extra"].get("active_tray") and spool["extra"]["active_tray"] == json.dumps(trayUid(ams_id, tray_id)):
-      active_spool = spool
-      break
+  for spool in SPOOL_INDEX.findByActiveTray(trayUid(ams_id, tray_id, g.printer.id)):
+    active_spool = spool
+    break
 
   #TODO: Determine issue
   #New bambulab spool
@@ -58,8 +155,9 @@ def issue():
   return render_template('issue.html', fix_ams=fix_ams, active_spool=active_spool)
 
 @app.route("/fill")
+@conditional(spoolsVersion, unless=("spool_id",))
 def fill():
-  if not isMqttClientConnected():
+  if not isMqttClientConnected(g.printer.id):
     return render_template('error.html', exception="MQTT is disconnected. Is the printer online?")
     
   ams_id = request.args.get("ams")
@@ -69,56 +167,41 @@ def fill():
 
   spool_id = request.args.get("spool_id")
   if spool_id:
-    spool_data = getSpoolById(spool_id)
-    setActiveTray(spool_id, spool_data["extra"], ams_id, tray_id)
-    setActiveSpool(ams_id, tray_id, spool_data)
+    try:
+      spool_data = getSpoolById(spool_id)
+      waitForWrites(setActiveTray(spool_id, spool_data["extra"], ams_id, tray_id, g.printer.id))
+      setActiveSpool(ams_id, tray_id, spool_data)
+    except Exception as e:
+      traceback.print_exc()
+      return render_template('error.html', exception=str(e))
+
     return redirect(url_for('home', success_message=f"Updated Spool ID {spool_id} to AMS {ams_id}, Tray {tray_id}."))
   else:
     spools = fetchSpools()
-        
-    return render_template('fill.html', spools=spools, ams_id=ams_id, tray_id=tray_id)
+    spool_list = renderFragment('fragments/list_spools.html', ("fill", ams_id, tray_id),
+                                lambda: dict(spools=spools, action_fill=True, ams_id=ams_id, tray_id=tray_id), ams=False)
+
+    return render_template('fill.html', spool_list=spool_list, ams_id=ams_id, tray_id=tray_id)
 
 @app.route("/spool_info")
 def spool_info():
-  if not isMqttClientConnected():
+  if not isMqttClientConnected(g.printer.id):
     return render_template('error.html', exception="MQTT is disconnected. Is the printer online?")
     
   try:
     tag_id = request.args.get("tag_id", "-1")
     spool_id = request.args.get("spool_id", -1)
-    last_ams_config = getLastAMSConfig()
-    ams_data = last_ams_config.get("ams", [])
-    vt_tray_data = last_ams_config.get("vt_tray", {})
-    spool_list = fetchSpools()
-    
-    issue = False
-    #TODO: Fix issue when external spool info is reset via bambulab interface
-    augmentTrayDataWithSpoolMan(spool_list, vt_tray_data, trayUid(EXTERNAL_SPOOL_AMS_ID, EXTERNAL_SPOOL_ID))
-    issue |= vt_tray_data["issue"]
-
-    for ams in ams_data:
-      for tray in ams["tray"]:
-        augmentTrayDataWithSpoolMan(spool_list, tray, trayUid(ams["id"], tray["id"]))
-        issue |= tray["issue"]
+    fetchSpools()
+    ams_data, vt_tray_data, issue = augmentedAmsConfig(g.printer.id)
 
     if not tag_id:
       return render_template('error.html', exception="TAG ID is required as a query parameter (e.g., ?tag_id=RFID123)")
 
-    spools = fetchSpools()
-    current_spool = None
-    for spool in spools:
-      if spool['id'] == int(spool_id):
-        current_spool = spool
-        break
-
-      if not spool.get("extra", {}).get("tag"):
-        continue
-
-      tag = json.loads(spool["extra"]["tag"])
-      if tag != tag_id:
-        continue
-
-      current_spool = spool
+    current_spool = SPOOL_INDEX.get(spool_id)
+    if not current_spool:
+      tagged_spools = SPOOL_INDEX.findByTag(tag_id)
+      if tagged_spools:
+        current_spool = tagged_spools[-1]
 
     if current_spool:
       # TODO: missing current_spool
@@ -132,7 +215,7 @@ def spool_info():
 
 @app.route("/tray_load")
 def tray_load():
-  if not isMqttClientConnected():
+  if not isMqttClientConnected(g.printer.id):
     return render_template('error.html', exception="MQTT is disconnected. Is the printer online?")
   
   tag_id = request.args.get("tag_id")
@@ -146,7 +229,7 @@ def tray_load():
   try:
     # Update Spoolman with the selected tray
     spool_data = getSpoolById(spool_id)
-    setActiveTray(spool_id, spool_data["extra"], ams_id, tray_id)
+    waitForWrites(setActiveTray(spool_id, spool_data["extra"], ams_id, tray_id, g.printer.id))
     setActiveSpool(ams_id, tray_id, spool_data)
 
     return redirect(url_for('home', success_message=f"Updated Spool ID {spool_id} with TAG id {tag_id} to AMS {ams_id}, Tray {tray_id}."))
@@ -155,7 +238,7 @@ def tray_load():
     return render_template('error.html', exception=str(e))
 
 def setActiveSpool(ams_id, tray_id, spool_data):
-  if not isMqttClientConnected():
+  if not isMqttClientConnected(g.printer.id):
     return render_template('error.html', exception="MQTT is disconnected. Is the printer online?")
   
   ams_message = AMS_FILAMENT_SETTING
@@ -196,35 +279,136 @@ def setActiveSpool(ams_id, tray_id, spool_data):
   ams_message["print"]["tray_sub_brands"] = ""
 
   print(ams_message)
-  publish(getMqttClient(), ams_message)
+  publish(getMqttClient(g.printer.id), ams_message, g.printer.id)
 
 @app.route("/")
+@conditional(spoolsVersion, amsVersion, printStatusVersion)
 def home():
-  if not isMqttClientConnected():
+  if not isMqttClientConnected(g.printer.id):
     return render_template('error.html', exception="MQTT is disconnected. Is the printer online?")
     
   try:
-    last_ams_config = getLastAMSConfig()
-    ams_data = last_ams_config.get("ams", [])
-    vt_tray_data = last_ams_config.get("vt_tray", {})
-    spool_list = fetchSpools()
+    fetchSpools()
     success_message = request.args.get("success_message")
-    
-    issue = False
-    #TODO: Fix issue when external spool info is reset via bambulab interface
-    augmentTrayDataWithSpoolMan(spool_list, vt_tray_data, trayUid(EXTERNAL_SPOOL_AMS_ID, EXTERNAL_SPOOL_ID))
-    issue |= vt_tray_data["issue"]
-
-    for ams in ams_data:
-      for tray in ams["tray"]:
-        augmentTrayDataWithSpoolMan(spool_list, tray, trayUid(ams["id"], tray["id"]))
-        issue |= tray["issue"]
+    ams_data, vt_tray_data, issue = augmentedAmsConfig(g.printer.id)
 
     return render_template('index.html', success_message=success_message, ams_data=ams_data, vt_tray_data=vt_tray_data, issue=issue)
   except Exception as e:
     traceback.print_exc()
     return render_template('error.html', exception=str(e))
 
+def augmentedAmsConfig(printer_id):
+  """
+  Copies of the trays of the printer's last AMS report with their SpoolMan spool,
+  and whether any tray has an issue. The stored report stays as the printer sent
+  it, the next report is compared against it.
+  """
+  last_ams_config = getLastAMSConfig(printer_id)
+  vt_tray_data = dict(last_ams_config.get("vt_tray", {}))
+  ams_data = [dict(ams, tray=[dict(tray) for tray in ams["tray"]]) for ams in last_ams_config.get("ams", [])]
+
+  issue = False
+  #TODO: Fix issue when external spool info is reset via bambulab interface
+  augmentTrayDataWithSpoolMan(vt_tray_data, trayUid(EXTERNAL_SPOOL_AMS_ID, EXTERNAL_SPOOL_ID, printer_id))
+  issue |= vt_tray_data["issue"]
+
+  for ams in ams_data:
+    for tray in ams["tray"]:
+      augmentTrayDataWithSpoolMan(tray, trayUid(ams["id"], tray["id"], printer_id))
+      issue |= tray["issue"]
+
+  return ams_data, vt_tray_data, issue
+
+def trayKeys(printer_id):
+  last_ams_config = getLastAMSConfig(printer_id)
+  keys = [(EXTERNAL_SPOOL_AMS_ID, EXTERNAL_SPOOL_ID)]
+  for ams in last_ams_config.get("ams", []):
+    keys.extend((ams["id"], tray["id"]) for tray in ams["tray"])
+  return keys
+
+def trayContext(printer_id, ams_id, tray_id):
+  last_ams_config = getLastAMSConfig(printer_id)
+  if ams_id == EXTERNAL_SPOOL_AMS_ID:
+    tray_data = dict(last_ams_config.get("vt_tray", {}))
+  else:
+    ams = next((ams for ams in last_ams_config.get("ams", []) if ams["id"] == ams_id), {})
+    tray_data = dict(next((tray for tray in ams.get("tray", []) if tray["id"] == tray_id), {}))
+
+  augmentTrayDataWithSpoolMan(tray_data, trayUid(ams_id, tray_id, printer_id))
+  return dict(tray_data=tray_data, ams_id=ams_id, pick_tray=False, tray_id=tray_id)
+
+# The tray card of the index page and the /events stream
+def renderTray(ams_id, tray_id):
+  printer_id = g.printer.id
+  return renderFragment('fragments/tray.html', (ams_id, tray_id), lambda: trayContext(printer_id, ams_id, tray_id))
+
+def serverSentEvent(event, data):
+  return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def printerEventStream(printer_id):
+  """
+  Server-sent events for the index page of a printer: "tray" with the
+  re-rendered tray fragment when a tray or its spool changed, "ams" with the
+  humidity and temperature of an AMS and "stage" with the print's progress.
+  Only fragments that differ from what this stream sent before are sent.
+  """
+  subscription = PRINTER_EVENTS.subscribe(printer_id)
+  sent_trays = {}
+  spool_version = None
+  last_sent = time.monotonic()
+
+  def changedTrays(keys):
+    for ams_id, tray_id in keys:
+      html = renderTray(ams_id, tray_id)
+      element_id = f"tray-{ams_id}-{tray_id}"
+      if sent_trays.get(element_id) != html:
+        sent_trays[element_id] = html
+        yield serverSentEvent("tray", {"id": element_id, "html": html})
+
+  try:
+    fetchSpools()
+    yield "retry: 3000\n\n"
+    while True:
+      try:
+        event, data = subscription.get(timeout=EVENT_STREAM_POLL)
+      except queue.Empty:
+        event, data = None, None
+
+      messages = []
+      if event == "tray":
+        messages.extend(changedTrays([data]))
+      elif event in ("ams", "stage"):
+        messages.append(serverSentEvent(event, data))
+
+      # Spending, SpoolMan's change feed and tray assignments all end up in the spool cache
+      if event == "resync" or spool_version != getSpoolCacheVersion():
+        spool_version = getSpoolCacheVersion()
+        messages.extend(changedTrays(trayKeys(printer_id)))
+
+      if not messages and time.monotonic() - last_sent >= EVENT_STREAM_HEARTBEAT:
+        messages.append(": heartbeat\n\n")
+
+      if messages:
+        last_sent = time.monotonic()
+        yield "".join(messages)
+  finally:
+    PRINTER_EVENTS.unsubscribe(subscription)
+
+# Every open stream holds a server thread, the ones beyond EVENT_STREAMS_MAX are turned
+# away so the other pages keep getting served
+EVENT_STREAMS = BoundedSemaphore(EVENT_STREAMS_MAX)
+
+@app.route("/events")
+def events():
+  if not EVENT_STREAMS.acquire(blocking=False):
+    return Response("Too many live pages are open", status=503, mimetype="text/plain", headers={"Retry-After": "60"})
+
+  response = Response(stream_with_context(printerEventStream(g.printer.id)), mimetype="text/event-stream",
+                      headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+  # The server closes the response when the stream ends, also if it never started
+  response.call_on_close(EVENT_STREAMS.release)
+  return response
+
 def sort_spools(spools):
   def condition(item):
     # Ensure the item has an "extra" key and is a dictionary
@@ -238,14 +422,16 @@ def sort_spools(spools):
   return sorted(spools, key=lambda spool: bool(condition(spool)))
 
 @app.route("/assign_tag")
+@conditional(spoolsVersion)
 def assign_tag():
-  if not isMqttClientConnected():
+  if not isMqttClientConnected(g.printer.id):
     return render_template('error.html', exception="MQTT is disconnected. Is the printer online?")
     
   try:
-    spools = sort_spools(fetchSpools())
+    spools = fetchSpools()
+    spool_list = renderFragment('fragments/list_spools.html', ("assign",), lambda: dict(spools=sort_spools(spools), action_assign=True), ams=False)
 
-    return render_template('assign_tag.html', spools=spools)
+    return render_template('assign_tag.html', spool_list=spool_list)
   except Exception as e:
     traceback.print_exc()
     return render_template('error.html', exception=str(e))
@@ -272,7 +458,50 @@ def write_tag():
 def health():
   return "OK", 200
 
+@app.route("/prints/<path:image_file>")
+def print_image(image_file):
+  # Thumbnails are named after the hash of their content, so they never change
+  response = send_from_directory(PRINTS_DIR, image_file, max_age=THUMBNAIL_MAX_AGE)
+  response.cache_control.immutable = True
+  return response
+
+def print_history_filters():
+  return {
+    "spool_id": request.args.get("spool", type=int),
+    "filament_type": request.args.get("filament_type") or None,
+    "date_from": request.args.get("date_from") or None,
+    "date_to": request.args.get("date_to") or None,
+    "print_type": request.args.get("print_type") or None,
+  }
+
+def print_history_page(before=None):
+  """One page of the print history with spools and costs, and the cursor of the next page."""
+  prints = get_prints_with_filament(limit=PRINT_HISTORY_PAGE_SIZE + 1, before=before, **print_history_filters())
+
+  next_cursor = None
+  if len(prints) > PRINT_HISTORY_PAGE_SIZE:
+    prints = prints[:PRINT_HISTORY_PAGE_SIZE]
+    next_cursor = f"{prints[-1]['print_date']}|{prints[-1]['id']}"
+
+  fetchSpools()
+
+  for print in prints:
+    print["filament_usage"] = json.loads(print["filament_info"])
+
+    for filament in print["filament_usage"]:
+      if filament["spool_id"]:
+        spool = SPOOL_INDEX.get(filament["spool_id"])
+        if spool:
+          filament["spool"] =  spool
+          # Usage recorded before costs were stored is priced at the spool's current cost
+          if filament["cost"] is None:
+            filament["cost"] = filament['grams_used'] * filament['spool']['cost_per_gram']
+            print["total_cost"] += filament["cost"]
+
+  return prints, next_cursor
+
 @app.route("/print_history")
+@conditional(spoolsVersion, printHistoryVersion, unless=("spool_id",))
 def print_history():
   spoolman_settings = getSettings()
 
@@ -283,7 +512,8 @@ def print_history():
 
   if all([ams_slot, print_id, spool_id]):
     filament = get_filament_for_slot(print_id, ams_slot)
-    update_filament_spool(print_id, ams_slot, spool_id)
+    spool = SPOOL_INDEX.get(spool_id)
+    update_filament_spool(print_id, ams_slot, spool_id, spool["cost_per_gram"] if spool else None)
 
     if(filament["spool_id"] != int(spool_id) and (not old_spool_id or (old_spool_id and filament["spool_id"] == int(old_spool_id)))):
       if old_spool_id:
@@ -291,24 +521,38 @@ def print_history():
         
       consumeSpool(spool_id, filament["grams_used"])
 
-  prints = get_prints_with_filament()
+  # Coming back from assigning a spool, start the page at that print so its anchor exists
+  before = None
+  if print_id:
+    focused_print = get_print(print_id)
+    if focused_print:
+      before = (focused_print["print_date"], focused_print["id"] + 1)
 
-  spool_list = fetchSpools()
-
-  for print in prints:
-    print["filament_usage"] = json.loads(print["filament_info"])
-    print["total_cost"] = 0
+  prints, next_cursor = print_history_page(before)
 
-    for filament in print["filament_usage"]:
-      if filament["spool_id"]:
-        for spool in spool_list:
-          if spool['id'] == filament["spool_id"]:
-            filament["spool"] =  spool
-            filament["cost"] = filament['grams_used'] * filament['spool']['cost_per_gram']
-            print["total_cost"] += filament["cost"]
-            break
+  filters = print_history_filters()
+  spool_usage = get_spool_usage(filters["spool_id"]) if filters["spool_id"] else None
+  monthly_spend = get_monthly_spend(filters["date_from"], filters["date_to"])
   
-  return render_template('print_history.html', prints=prints, currencysymbol=spoolman_settings["currency_symbol"])
+  return render_template('print_history.html', prints=prints, next_cursor=next_cursor, filters=request.args, spool_usage=spool_usage,
+                         spool=SPOOL_INDEX.get(filters["spool_id"]), monthly_spend=monthly_spend, currencysymbol=spoolman_settings["currency_symbol"])
+
+@app.route("/api/print_history")
+def print_history_more():
+  spoolman_settings = getSettings()
+
+  try:
+    print_date, print_id = request.args["cursor"].rsplit("|", 1)
+    before = (print_date, int(print_id))
+  except (KeyError, ValueError):
+    return {"error": "Missing or invalid cursor"}, 400
+
+  prints, next_cursor = print_history_page(before)
+
+  return {
+    "html": render_template('fragments/print_cards.html', prints=prints, action_assign=True, currencysymbol=spoolman_settings["currency_symbol"]),
+    "next_cursor": next_cursor,
+  }
 
 @app.route("/print_select_spool")
 def print_select_spool():
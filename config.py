@@ -1,3 +1,4 @@
+import json
 import os
 EXTERNAL_SPOOL_AMS_ID = 255 # don't change
 EXTERNAL_SPOOL_ID = 254 #  don't change
@@ -8,7 +9,24 @@ PRINTER_ID = os.getenv('PRINTER_ID')  # Printer serial number - Run init_bambula
 PRINTER_CODE = os.getenv('PRINTER_ACCESS_CODE')       # Printer access code - Run init_bambulab.py
 PRINTER_IP = os.getenv('PRINTER_IP')     # Printer local IP address - Check wireless on printer
 PRINTER_NAME = os.getenv('PRINTER_NAME')     # Printer name - Check wireless on printer
+# Several printers as a JSON list of {"id", "ip", "access_code", "name"} objects ("port" and "tls" are optional),
+# defaults to the single printer above. The first one is the default printer of the web pages.
+PRINTERS = json.loads(os.getenv('PRINTERS') or 'null') or [{"id": PRINTER_ID, "ip": PRINTER_IP, "access_code": PRINTER_CODE, "name": PRINTER_NAME}]
+PRINTER_ID, PRINTER_IP, PRINTER_CODE, PRINTER_NAME = PRINTERS[0]["id"], PRINTERS[0]["ip"], PRINTERS[0]["access_code"], PRINTERS[0].get("name")
 SPOOLMAN_BASE_URL = os.getenv('SPOOLMAN_BASE_URL')
 SPOOLMAN_API_URL = f"{SPOOLMAN_BASE_URL}/api/v1"
 AUTO_SPEND = os.getenv('AUTO_SPEND', False)
-SPOOL_SORTING = os.getenv('SPOOL_SORTING', "filament.material:asc,filament.vendor.name:asc,filament.name:asc")
\ No newline at end of file
+SPOOL_SORTING = os.getenv('SPOOL_SORTING', "filament.material:asc,filament.vendor.name:asc,filament.name:asc")
+SPOOLMAN_TIMEOUT = float(os.getenv('SPOOLMAN_TIMEOUT', 10))  # Seconds to wait for SpoolMan to connect or answer
+SPOOLMAN_RETRIES = int(os.getenv('SPOOLMAN_RETRIES', 3))  # Retries with backoff for failed SpoolMan requests
+SPOOLMAN_POOL_SIZE = int(os.getenv('SPOOLMAN_POOL_SIZE', 4))  # Kept-alive connections to SpoolMan
+SPOOLMAN_GZIP = os.getenv('SPOOLMAN_GZIP', 'True').lower() in ('true', '1', 'yes')  # Ask SpoolMan for compressed responses
+SPOOL_CACHE_TTL = float(os.getenv('SPOOL_CACHE_TTL', 60))  # Seconds between background refreshes of the spool list
+SPOOLMAN_WEBSOCKET = os.getenv('SPOOLMAN_WEBSOCKET', 'False').lower() in ('true', '1', 'yes')  # Keep the spool cache current from SpoolMan's change feed
+SPOOLMAN_WRITE_DELAY = float(os.getenv('SPOOLMAN_WRITE_DELAY', 0.2))  # Seconds to collect extra field updates before writing them to SpoolMan
+METADATA_CACHE_SIZE_MB = float(os.getenv('METADATA_CACHE_SIZE_MB', 100))  # Disk budget for parsed 3MF metadata and thumbnails of earlier prints, 0 disables the cache
+PRINTER_FTP_TIMEOUT = float(os.getenv('PRINTER_FTP_TIMEOUT', 10))  # Seconds to wait for the printer's FTP server to connect, answer or send data
+REMOTE_3MF = os.getenv('REMOTE_3MF', 'True').lower() in ('true', '1', 'yes')  # Read only the needed parts of 3MF files with range requests instead of downloading them
+MQTT_LOG_COMPRESS = os.getenv('MQTT_LOG_COMPRESS', 'False').lower() in ('true', '1', 'yes')  # Gzip rotated MQTT logs
+MQTT_LOG_DEDUP = os.getenv('MQTT_LOG_DEDUP', 'False').lower() in ('true', '1', 'yes')  # Log repeated identical printer reports once, with a count of the repeats
+EVENT_STREAMS_MAX = int(os.getenv('EVENT_STREAMS_MAX', 16))  # Live index pages served at once, each holds a server thread while it is open
\ No newline at end of file
@@ -1,3 +1,9 @@
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+
+# Every tray and spool badge asks, but there are only so many filament colors
+@lru_cache(maxsize=1024)
 def color_is_dark(bg_color):
   # Remove '#' if present
   color = bg_color[1:] if bg_color.startswith('#') else bg_color
@@ -21,3 +27,39 @@ def color_is_dark(bg_color):
 
   # Return whether the color is considered "dark"
   return luminance <= 0.179
+
+class FragmentCache:
+  """
+  Rendered HTML fragments, reused for as long as the data they were rendered
+  from has the same version. Holds max_entries fragments, the least recently
+  used one is dropped first.
+  """
+
+  def __init__(self, max_entries=256):
+    self.max_entries = max_entries
+    self.lock = Lock()
+    self.entries = OrderedDict()  # key -> (version, html)
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, key, version, render):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is not None and entry[0] == version:
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+      self.misses += 1
+
+    html = render()
+
+    with self.lock:
+      self.entries[key] = (version, html)
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.max_entries:
+        self.entries.popitem(last=False)
+    return html
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
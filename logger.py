@@ -1,37 +1,159 @@
+import gzip
 import os
-import time
+import queue
 import re
+import shutil
+import threading
+import time
+import traceback
 from datetime import datetime
 
+class RotatingLogWriter:
+    """
+    Appends timestamped lines to a rotating log file from a thread of its own, so
+    callers only pay for putting the line on a queue.
+
+    The file stays open between writes and is flushed once per batch of queued
+    lines. When the bytes written pass max_size the file is renamed with a
+    timestamp, optionally gzipped, and only then are the archives beyond
+    max_files removed. With dedup, a line whose dedup_key equals the previous
+    line's is not written, a note with the number of repeats is written before
+    the next different line instead. A full queue drops lines rather than block.
+    """
+
+    def __init__(self, file_path: str, max_size: int = 1_048_576, max_files: int = 5, compress: bool = False,
+                 dedup: bool = False, dedup_key=None, queue_size: int = 10_000):
+        self.file_path = file_path
+        self.max_size = max_size
+        self.max_files = max_files
+        self.compress = compress
+        self.dedup = dedup
+        self.dedup_key = dedup_key or (lambda text: text)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.file = None
+        self.size = 0
+        self.last_key = None
+        self.repeated = 0
+        self.written = 0
+        self.dropped = 0
+
+        directory, base_filename = os.path.split(file_path)
+        self.directory = directory
+        self.base_filename = os.path.splitext(base_filename)[0]
+        self.pattern = re.compile(rf"^{re.escape(self.base_filename)}_\d{{8}}_\d{{6}}\.log(\.gz)?$")
+
+    def write(self, text: str) -> None:
+        """
+        Queues the text to be written with the current timestamp.
+        """
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+                    self.thread.start()
+
+        try:
+            self.queue.put_nowait((datetime.now(), text))
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self) -> None:
+        """
+        Blocks until every line queued so far is written to the file.
+        """
+        if self.thread is not None:
+            self.queue.join()
+
+    def run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                for timestamp, text in batch:
+                    self.append(timestamp, text)
+                self.file.flush()
+            except Exception:
+                traceback.print_exc()
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.file = open(self.file_path, "a", encoding="utf-8")
+        self.size = self.file.tell()
+
+    def append(self, timestamp: datetime, text: str) -> None:
+        if self.file is None:
+            self.open()
+
+        if self.dedup:
+            key = self.dedup_key(text)
+            if key == self.last_key:
+                self.repeated += 1
+                return
+
+            self.last_key = key
+            if self.repeated:
+                self.append_line(timestamp, f"[previous line repeated {self.repeated} times]")
+                self.repeated = 0
+
+        self.append_line(timestamp, text)
+
+    def append_line(self, timestamp: datetime, text: str) -> None:
+        if self.size > self.max_size:
+            self.rotate()
+
+        data = f"{timestamp.strftime('%Y-%m-%d %H:%M:%S')} :: {text}\n"
+        self.file.write(data)
+        self.size += len(data.encode("utf-8"))
+        self.written += 1
+
+    def rotate(self) -> None:
+        """
+        Archives the current file, compresses the archive if configured and prunes the oldest archives.
+        """
+        self.file.close()
+
+        # Several rotations within a second must not overwrite each other's archive
+        archive_time = time.time()
+        while True:
+            archive_filename = f"{self.base_filename}_{time.strftime('%Y%m%d_%H%M%S', time.localtime(archive_time))}.log"
+            archived_file = os.path.join(self.directory, archive_filename)
+            if not os.path.exists(archived_file) and not os.path.exists(archived_file + ".gz"):
+                break
+            archive_time += 1
+        os.rename(self.file_path, archived_file)
+
+        if self.compress:
+            with open(archived_file, "rb") as source, gzip.open(archived_file + ".gz", "wb") as target:
+                shutil.copyfileobj(source, target)
+            os.remove(archived_file)
+
+        # Archive names sort by their timestamp
+        log_files = sorted(f for f in os.listdir(self.directory) if self.pattern.match(f))
+        while len(log_files) > self.max_files:
+            os.remove(os.path.join(self.directory, log_files.pop(0)))  # Remove the oldest file
+
+        self.open()
+
+_writers = {}
+_writers_lock = threading.Lock()
+
 def append_to_rotating_file(file_path: str, text: str, max_size: int = 1_048_576, max_files: int = 5) -> None:
     """
-    Appends the given text with a timestamp to a rotating log file.
-    If the file exceeds the maximum size, it is renamed with a timestamp, and a new file is created.
-    If the maximum number of log files is reached, the oldest file matching the exact naming pattern is deleted.
+    Appends the given text with a timestamp to a rotating log file, through the
+    RotatingLogWriter of that file. The write happens on the writer's thread.
     """
-    directory, base_filename = os.path.split(file_path)
-    base_filename = os.path.splitext(base_filename)[0]
-    os.makedirs(directory, exist_ok=True)
-    
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_entry = f"{timestamp} :: {text}\n"
-    
-    # Rotate the file if it exceeds the size limit
-    if os.path.exists(file_path) and os.path.getsize(file_path) > max_size:
-        archive_filename = f"{base_filename}_{time.strftime('%Y%m%d_%H%M%S')}.log"
-        archived_file = os.path.join(directory, archive_filename)
-        os.rename(file_path, archived_file)
-    
-    # Append the text with timestamp to the current file
-    with open(file_path, "a", encoding="utf-8") as file:
-        file.write(log_entry)
-    
-    # Find all log files that exactly match the expected pattern
-    pattern = re.compile(rf"^{re.escape(base_filename)}_\d{{8}}_\d{{6}}\.log$")
-    log_files = sorted(
-        [f for f in os.listdir(directory) if pattern.match(f)],
-        key=lambda f: os.path.getctime(os.path.join(directory, f))  # Sort by creation time
-    )
-    
-    while len(log_files) > max_files:
-        os.remove(os.path.join(directory, log_files.pop(0)))  # Remove the oldest file
\ No newline at end of file
+    writer = _writers.get(file_path)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.setdefault(file_path, RotatingLogWriter(file_path, max_size, max_files))
+    writer.write(text)
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import shutil
+from threading import Lock
+
+from config import METADATA_CACHE_SIZE_MB
+
+METADATA_CACHE_DIR = os.path.join(os.getcwd(), 'data', 'metadata_cache')
+
+class MetadataCache:
+  """
+  Parsed 3MF metadata and plate thumbnails of earlier prints, kept on disk so a
+  repeat print of the same file doesn't download and parse it again.
+
+  Entries are stored under a content key of the archive, built from the
+  checksums of its entries. Cheaper identities of the same file, like the FTP
+  size and date or a cloud ETag, are stored as small alias files pointing at
+  the content entry. Every hit touches
+  the files, and the least recently used ones are removed once the cache grows
+  over its disk budget.
+  """
+
+  def __init__(self, directory=METADATA_CACHE_DIR, max_bytes=METADATA_CACHE_SIZE_MB * 1024 * 1024):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.lock = Lock()
+    self.hits = 0
+    self.misses = 0
+
+  @property
+  def enabled(self):
+    return self.max_bytes > 0
+
+  def path(self, key, extension):
+    return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest() + extension)
+
+  def touch(self, *paths):
+    for path in paths:
+      os.utime(path)
+
+  def resolve(self, key):
+    """Follows an alias to its content key, other keys are returned unchanged."""
+    alias_path = self.path(key, ".alias")
+    if not os.path.exists(alias_path):
+      return key
+
+    with open(alias_path, "r", encoding="utf-8") as f:
+      content_key = f.read()
+    self.touch(alias_path)
+    return content_key
+
+  def get(self, key):
+    """
+    Returns (metadata, thumbnail path) for the key, or None if it isn't cached.
+    The thumbnail stays owned by the cache and must be copied by the caller.
+    """
+    if not self.enabled or not key:
+      return None
+
+    with self.lock:
+      try:
+        content_key = self.resolve(key)
+        entry_path = self.path(content_key, ".json")
+        thumbnail_path = self.path(content_key, ".png")
+
+        with open(entry_path, "r", encoding="utf-8") as f:
+          entry = json.load(f)
+        self.touch(entry_path, thumbnail_path)
+      except (OSError, ValueError):
+        self.misses += 1
+        return None
+
+    self.hits += 1
+    return decodeMetadata(entry), thumbnail_path
+
+  def put(self, content_key, metadata, thumbnail_path, *aliases):
+    if not self.enabled:
+      return
+
+    with self.lock:
+      try:
+        os.makedirs(self.directory, exist_ok=True)
+        entry_path = self.path(content_key, ".json")
+
+        shutil.copyfile(thumbnail_path, self.path(content_key, ".png"))
+        with open(entry_path + ".tmp", "w", encoding="utf-8") as f:
+          json.dump(metadata, f)
+        os.replace(entry_path + ".tmp", entry_path)
+
+        for alias in aliases:
+          if alias and alias != content_key:
+            with open(self.path(alias, ".alias"), "w", encoding="utf-8") as f:
+              f.write(content_key)
+
+        self.evict()
+      except OSError as e:
+        print(f"⚠️ Could not cache 3MF metadata: {e}")
+
+  def alias(self, key, content_key):
+    if not self.enabled or not key:
+      return
+
+    with self.lock:
+      try:
+        with open(self.path(key, ".alias"), "w", encoding="utf-8") as f:
+          f.write(content_key)
+      except OSError as e:
+        print(f"⚠️ Could not cache 3MF metadata: {e}")
+
+  def evict(self):
+    """Removes the least recently used files until the cache fits its budget."""
+    files = []
+    total = 0
+    with os.scandir(self.directory) as entries:
+      for entry in entries:
+        stat = entry.stat()
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+        total += stat.st_size
+
+    files.sort()
+    for _, size, path in files:
+      if total <= self.max_bytes:
+        break
+      os.remove(path)
+      total -= size
+
+def decodeMetadata(entry):
+  """JSON turns the integer filament ids into strings, this turns them back."""
+  metadata = dict(entry)
+  for key in ("filaments", "usage", "filamentOrder"):
+    if key in metadata:
+      metadata[key] = {int(id): value for id, value in metadata[key].items()}
+  return metadata
+
+METADATA_CACHE = MetadataCache()
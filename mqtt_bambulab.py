@@ -1,33 +1,250 @@
+import asyncio
 import json
 import ssl
 import traceback
-from threading import Thread
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from threading import Thread, Condition
 
 import paho.mqtt.client as mqtt
 
-from config import PRINTER_ID, PRINTER_CODE, PRINTER_IP, AUTO_SPEND, EXTERNAL_SPOOL_AMS_ID, EXTERNAL_SPOOL_ID
+from config import PRINTERS as PRINTER_CONFIGS, PRINTER_ID, AUTO_SPEND, EXTERNAL_SPOOL_AMS_ID, EXTERNAL_SPOOL_ID, MQTT_LOG_COMPRESS, MQTT_LOG_DEDUP
 from messages import GET_VERSION, PUSH_ALL
-from spoolman_service import spendFilaments, setActiveTray, fetchSpools
+from spoolman_service import spendFilaments, setActiveTray, fetchSpools, SPOOL_INDEX
 from tools_3mf import getMetaDataFrom3mf
-import time
-import copy
-from collections.abc import Mapping
-from logger import append_to_rotating_file
-from print_history import  insert_print, insert_filament_usage, update_filament_spool
-
-MQTT_CLIENT = {}  # Global variable storing MQTT Client
-MQTT_CLIENT_CONNECTED = False
+from printer_state import PrinterState
+from printer_ftp import PRINTER_FTP, PrinterFTPSession
+from logger import RotatingLogWriter
+from print_history import record_print
+from printer_events import PRINTER_EVENTS
+
 MQTT_KEEPALIVE = 60
-LAST_AMS_CONFIG = {}  # Global variable storing last AMS configuration
+MQTT_RECONNECT_DELAY = 1  # first retry, doubled after every failed attempt up to MQTT_RECONNECT_DELAY_MAX
+MQTT_RECONNECT_DELAY_MAX = 60
+MQTT_QUEUE_SIZE = 1000  # reports waiting per printer before its socket is no longer read
+MQTT_READ_BATCH = 100  # reports read from a socket, and handled, per event loop turn
+
+PRINTERS = {}  # printer id -> PrinterConnection, in the order they were registered
+
+# Fields of the "print" report the /events streams show as the print's progress
+PRINT_STATUS_FIELDS = ("gcode_state", "stg_cur", "mc_percent", "mc_remaining_time")
+
+# 3MF downloads and parsing run here, so a print start doesn't stall the MQTT loop
+METADATA_EXECUTOR = ThreadPoolExecutor(max_workers=min(len(PRINTER_CONFIGS), 4), thread_name_prefix="3mf-metadata")
+
+# Reports are handled here, off the event loop: spending talks to SpoolMan and SQLite
+REPORT_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="mqtt-reports")
+
+# Latest tray report per (printer_id, ams_id, tray_id) waiting to be matched against SpoolMan.
+# Newer reports overwrite older ones, so a burst of AMS reports collapses into one pass.
+PENDING_TRAY_RECONCILIATION = {}
+TRAY_RECONCILIATION_CONDITION = Condition()
+
+# Reports only differ in their sequence_id when the printer has nothing new to say
+def reportLogKey(payload):
+  data = json.loads(payload)
+  if isinstance(data.get("print"), dict):
+    data["print"].pop("sequence_id", None)
+  return data
+
+def createMqttClient(printer):
+  """Default client factory: a paho client for the printer's TLS MQTT server, reporting to printer's callbacks."""
+  client = mqtt.Client(userdata=printer)
+  client.username_pw_set("bblp", printer.access_code)
+  if printer.tls:
+    ssl_ctx = ssl.create_default_context()
+    ssl_ctx.check_hostname = False
+    ssl_ctx.verify_mode = ssl.CERT_NONE
+    client.tls_set_context(ssl_ctx)
+    client.tls_insecure_set(True)
+  client.on_connect = on_connect
+  client.on_disconnect = on_disconnect
+  client.on_message = on_message
+  return client
+
+class PrinterConnection:
+  """
+  One printer: its MQTT session, the state of its spend state machine and its
+  last AMS report. Printers share the spool cache, the tray reconciliation
+  worker and the 3MF metadata executor. client_factory(printer) creates the
+  MQTT client, tests can pass one that talks to a local broker.
+
+  The sessions of all printers run on one asyncio event loop (see ingest()).
+  paho reads and writes the socket when the loop reports it ready, received
+  reports go to the printer's queue and are handled in order on the
+  REPORT_EXECUTOR. A full queue stops reading the socket until it drained to
+  half, so a slow SpoolMan slows down the printer instead of growing memory.
+  """
+
+  def __init__(self, printer_id, ip, access_code, name=None, port=8883, tls=True, client_factory=createMqttClient,
+               ftp=None, log_path="/home/app/logs/mqtt.log"):
+    self.id = printer_id
+    self.ip = ip
+    self.access_code = access_code
+    self.name = name
+    self.port = port
+    self.tls = tls
+    self.client_factory = client_factory
+    self.ftp = ftp or PrinterFTPSession(ip, access_code, printer_id=printer_id)
+    self.log = RotatingLogWriter(log_path, compress=MQTT_LOG_COMPRESS, dedup=MQTT_LOG_DEDUP, dedup_key=reportLogKey)
+
+    self.client = None
+    self.connected = False
+    self.connects = 0
+    self.state = PrinterState()
+    self.last_ams_config = {}
+    self.ams_version = 0  # bumped whenever a report changes the AMS, trays or external spool
+    self.print_status = {}
+    self.status_version = 0
+    self.pending_print_metadata = {}
+
+    self.loop = None
+    self.queue = None
+    self.overflow = deque()  # reports that arrived in the same read as the one that filled the queue
+    self.tasks = []
+    self.disconnected = None
+    self.fd = None
+    self.reading_paused = False
+    self.received = 0
+
+  @property
+  def report_topic(self):
+    return f"device/{self.id}/report"
+
+  @property
+  def request_topic(self):
+    return f"device/{self.id}/request"
+
+  # paho calls these from whichever thread opens, closes or writes to the socket,
+  # the event loop is only touched from its own thread
+  def on_socket_open(self, client, userdata, sock):
+    self.loop.call_soon_threadsafe(self.watchSocket, sock.fileno())
+
+  def on_socket_close(self, client, userdata, sock):
+    self.loop.call_soon_threadsafe(self.unwatchSocket, self.fd)
+
+  def on_socket_register_write(self, client, userdata, sock):
+    self.loop.call_soon_threadsafe(self.watchWrites, sock.fileno())
+
+  def on_socket_unregister_write(self, client, userdata, sock):
+    self.loop.call_soon_threadsafe(self.unwatchWrites, self.fd)
+
+  def watchSocket(self, fd):
+    self.fd = fd
+    # A reconnect keeps reading paused until the queue drained to half
+    self.reading_paused = bool(self.overflow) or self.queue.qsize() > MQTT_QUEUE_SIZE // 2
+    if not self.reading_paused:
+      self.loop.add_reader(fd, self.readSocket)
+
+  def unwatchSocket(self, fd):
+    if fd is not None:
+      self.loop.remove_reader(fd)
+      self.loop.remove_writer(fd)
+    if fd == self.fd:
+      self.fd = None
+
+  def watchWrites(self, fd):
+    if fd == self.fd:
+      self.loop.add_writer(fd, self.client.loop_write)
+
+  def unwatchWrites(self, fd):
+    if fd is not None and fd == self.fd:
+      self.loop.remove_writer(fd)
+
+  def readSocket(self):
+    for _ in range(MQTT_READ_BATCH):
+      received = self.received
+      if self.client.loop_read() != mqtt.MQTT_ERR_SUCCESS or self.reading_paused:
+        return
+      # TLS keeps decrypted bytes the socket no longer reports as readable
+      sock = self.client.socket()
+      if self.received == received and not (hasattr(sock, "pending") and sock.pending()):
+        return
+
+  def receive(self, payload):
+    """Queues a report, called by on_message on the event loop."""
+    self.received += 1
+    # paho re-raises a QueueFull from here and the report would be lost
+    if self.overflow or self.queue.full():
+      self.overflow.append(payload)
+    else:
+      self.queue.put_nowait(payload)
+    if self.queue.full() and not self.reading_paused and self.fd is not None:
+      self.reading_paused = True
+      self.loop.remove_reader(self.fd)
+
+  async def consume(self):
+    while True:
+      payloads = [await self.queue.get()]
+      while not self.queue.empty() and len(payloads) < MQTT_READ_BATCH:
+        payloads.append(self.queue.get_nowait())
+      while self.overflow and not self.queue.full():
+        self.queue.put_nowait(self.overflow.popleft())
+
+      if self.reading_paused and not self.overflow and self.queue.qsize() <= MQTT_QUEUE_SIZE // 2 and self.fd is not None:
+        self.reading_paused = False
+        self.loop.add_reader(self.fd, self.readSocket)
+
+      await self.loop.run_in_executor(REPORT_EXECUTOR, handleMessages, self, payloads)
+
+  async def housekeeping(self):
+    # Keepalive pings and detecting a printer that went silent
+    while True:
+      await asyncio.sleep(1)
+      self.client.loop_misc()
+
+  async def run(self):
+    self.loop = asyncio.get_running_loop()
+    self.queue = asyncio.Queue(MQTT_QUEUE_SIZE)
+    self.disconnected = asyncio.Event()
+    self.client = self.client_factory(self)
+    self.client.on_socket_open = self.on_socket_open
+    self.client.on_socket_close = self.on_socket_close
+    self.client.on_socket_register_write = self.on_socket_register_write
+    self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    # The event loop only keeps weak references to its tasks
+    self.tasks = [asyncio.create_task(self.consume()), asyncio.create_task(self.housekeeping())]
+    delay = MQTT_RECONNECT_DELAY
+
+    while True:
+      connects = self.connects
+      self.disconnected.clear()
+      try:
+        print(f"🔄 [{self.id}] Trying to connect ...", flush=True)
+        # connect() resolves, connects and does the TLS handshake blocking
+        await self.loop.run_in_executor(None, self.client.connect, self.ip, self.port, MQTT_KEEPALIVE)
+        await self.disconnected.wait()
+      except Exception as e:
+        print(f"⚠️ [{self.id}] connection failed: {e}", flush=True)
+
+      if self.connects != connects:
+        delay = MQTT_RECONNECT_DELAY
+
+      print(f"🔄 [{self.id}] new try in {delay} seconds...", flush=True)
+      await asyncio.sleep(delay)
+      delay = min(delay * 2, MQTT_RECONNECT_DELAY_MAX)
+
+def registerPrinter(printer_id, ip, access_code, name=None, **kwargs):
+  printer = PrinterConnection(printer_id, ip, access_code, name, **kwargs)
+  PRINTERS[printer_id] = printer
+  return printer
 
-PRINTER_STATE = {}
-PRINTER_STATE_LAST = {}
+def getPrinter(printer_id=None):
+  """The printer with the id, the first registered printer if printer_id is None, None if unknown."""
+  if printer_id is None:
+    return next(iter(PRINTERS.values()), None)
+  return PRINTERS.get(printer_id)
 
-PENDING_PRINT_METADATA = {}
+def getPrinters():
+  return list(PRINTERS.values())
 
-def getPrinterModel():
-    global PRINTER_ID
-    model_code = PRINTER_ID[:3]
+# Rendered into every page, the answer never changes for a printer
+@lru_cache(maxsize=None)
+def getPrinterModel(printer_id=None):
+    printer_id = printer_id or PRINTER_ID
+    model_code = printer_id[:3]
 
     model_map = {
         "094": "H2D",
@@ -41,7 +258,7 @@ def getPrinterModel():
     }
     model_name = model_map.get(model_code, f"Unknown model ({model_code})")
 
-    numeric_tail = ''.join(filter(str.isdigit, PRINTER_ID))
+    numeric_tail = ''.join(filter(str.isdigit, printer_id))
     device_id = numeric_tail[-3:] if len(numeric_tail) >= 3 else numeric_tail
 
     device_name = f"3DP-{model_code}-{device_id}"
@@ -53,263 +270,329 @@ def getPrinterModel():
 
 def num2letter(num):
   return chr(ord("A") + int(num))
-  
-def update_dict(original: dict, updates: dict) -> dict:
-    for key, value in updates.items():
-        if isinstance(value, Mapping) and key in original and isinstance(original[key], Mapping):
-            original[key] = update_dict(original[key], value)
-        else:
-            original[key] = value
-    return original
-
-def map_filament(tray_tar):
-  global PENDING_PRINT_METADATA
+
+def map_filament(printer, tray_tar):
+  pending = printer.pending_print_metadata
   # Prüfen, ob ein Filamentwechsel aktiv ist (stg_cur == 4)
   #if stg_cur == 4 and tray_tar is not None:
-  if PENDING_PRINT_METADATA:
-    PENDING_PRINT_METADATA["filamentChanges"].append(tray_tar)  # Jeder Wechsel zählt, auch auf das gleiche Tray
-    print(f'Filamentchange {len(PENDING_PRINT_METADATA["filamentChanges"])}: Tray {tray_tar}')
+  if pending and "future" in pending:
+    # Filament order is not known before the 3MF is parsed, replay the change once it is
+    pending["bufferedTrayTar"].append(tray_tar)
+    print(f'Filamentchange buffered until 3MF metadata is ready: Tray {tray_tar}')
+  elif pending:
+    pending["filamentChanges"].append(tray_tar)  # Jeder Wechsel zählt, auch auf das gleiche Tray
+    print(f'Filamentchange {len(pending["filamentChanges"])}: Tray {tray_tar}')
 
     # Anzahl der erkannten Wechsel
-    change_count = len(PENDING_PRINT_METADATA["filamentChanges"]) - 1  # -1, weil der erste Eintrag kein Wechsel ist
+    change_count = len(pending["filamentChanges"]) - 1  # -1, weil der erste Eintrag kein Wechsel ist
 
     # Slot in der Wechselreihenfolge bestimmen
-    for tray, usage_count in PENDING_PRINT_METADATA["filamentOrder"].items():
+    for tray, usage_count in pending["filamentOrder"].items():
         if usage_count == change_count:
-            PENDING_PRINT_METADATA["ams_mapping"].append(tray_tar)
+            pending["ams_mapping"].append(tray_tar)
             print(f"✅ Tray {tray_tar} assigned Filament to {tray}")
 
-            for filament, tray in enumerate(PENDING_PRINT_METADATA["ams_mapping"]):
+            for filament, tray in enumerate(pending["ams_mapping"]):
               print(f"  Filament {filament} → Tray {tray}")
 
 
     # Falls alle Slots zugeordnet sind, Ausgabe der Zuordnung
-    if len(PENDING_PRINT_METADATA["ams_mapping"]) == len(PENDING_PRINT_METADATA["filamentOrder"]):
+    if len(pending["ams_mapping"]) == len(pending["filamentOrder"]):
         print("\n✅ All trays assigned:")
-        for filament, tray in enumerate(PENDING_PRINT_METADATA["ams_mapping"]):
+        for filament, tray in enumerate(pending["ams_mapping"]):
             print(f"  Filament {tray} → Tray {tray}")
 
         return True
-  
+
   return False
-  
-def processMessage(data):
-  global LAST_AMS_CONFIG, PRINTER_STATE, PRINTER_STATE_LAST, PENDING_PRINT_METADATA
 
-   # Prepare AMS spending estimation
-  if "print" in data:    
-    update_dict(PRINTER_STATE, data)
-    
-    if "command" in data["print"] and data["print"]["command"] == "project_file" and "url" in data["print"]:
-      PENDING_PRINT_METADATA = getMetaDataFrom3mf(data["print"]["url"])
+def fetchPrintMetadata(printer, url, **pending):
+  printer.pending_print_metadata = pending
+  pending["printer_id"] = printer.id
+  # Cloud prints come with their AMS mapping, only local prints need the filament order from the gcode
+  pending["future"] = METADATA_EXECUTOR.submit(getMetaDataFrom3mf, url, filament_order=pending["print_type"] != "cloud", ftp=printer.ftp)
+  pending["bufferedTrayTar"] = []
+
+# Called for every report, picks up the 3MF metadata once the background job has finished
+def resolvePrintMetadata(printer):
+  pending = printer.pending_print_metadata
+  if not pending or "future" not in pending or not pending["future"].done():
+    return
+
+  future = pending.pop("future")
+  error = future.exception()
+  if error:
+    traceback.print_exception(error)
+  metadata = future.result() if not error else {}
+  if not metadata:
+    print(f"⚠️ [{printer.id}] No 3MF metadata for the current print, filament usage will not be tracked")
+    printer.pending_print_metadata = {}
+    return
+
+  pending.update(metadata)
+
+  if pending["print_type"] == "cloud":
+    file_name = pending["subtask_name"]
+  else:
+    file_name = pending["file"]
+
+  pending["print_id"] = record_print(file_name, pending["print_type"], pending["image"], pending["filaments"])
+
+  for tray_tar in pending.pop("bufferedTrayTar"):
+    if map_filament(printer, tray_tar):
+      pending["complete"] = True
+
+def processMessage(data, printer=None):
+  printer = printer or getPrinter()
 
-      print_id = insert_print(PRINTER_STATE["print"]["subtask_name"], "cloud", PENDING_PRINT_METADATA["image"])
+   # Prepare AMS spending estimation
+  if "print" in data:
+    printer.state.update(data["print"])
+    state = printer.state.current
+    last_state = printer.state.previous
 
-      if "use_ams" in PRINTER_STATE["print"] and PRINTER_STATE["print"]["use_ams"]:
-        PENDING_PRINT_METADATA["ams_mapping"] = PRINTER_STATE["print"]["ams_mapping"]
+    if "command" in data["print"] and data["print"]["command"] == "project_file" and "url" in data["print"]:
+      if "use_ams" in state and state["use_ams"]:
+        ams_mapping = state["ams_mapping"]
       else:
-        PENDING_PRINT_METADATA["ams_mapping"] = [EXTERNAL_SPOOL_ID]
+        ams_mapping = [EXTERNAL_SPOOL_ID]
 
-      PENDING_PRINT_METADATA["print_id"] = print_id
-      PENDING_PRINT_METADATA["complete"] = True
+      fetchPrintMetadata(printer, data["print"]["url"], print_type="cloud", subtask_name=state["subtask_name"], ams_mapping=ams_mapping, complete=True)
 
-      for id, filament in PENDING_PRINT_METADATA["filaments"].items():
-        insert_filament_usage(print_id, filament["type"], filament["color"], filament["used_g"], id)
-  
     #if ("gcode_state" in data["print"] and data["print"]["gcode_state"] == "RUNNING") and ("print_type" in data["print"] and data["print"]["print_type"] != "local") \
     #  and ("tray_tar" in data["print"] and data["print"]["tray_tar"] != "255") and ("stg_cur" in data["print"] and data["print"]["stg_cur"] == 0 and PRINT_CURRENT_STAGE != 0):
-    
+
     #TODO: What happens when printed from external spool, is ams and tray_tar set?
-    if ( "print_type" in PRINTER_STATE["print"] and PRINTER_STATE["print"]["print_type"] == "local" and
-        "print" in PRINTER_STATE_LAST
+    if ( "print_type" in state and state["print_type"] == "local" and
+        last_state is not None
       ):
 
       if (
-          "gcode_state" in PRINTER_STATE["print"] and 
-          PRINTER_STATE["print"]["gcode_state"] == "RUNNING" and
-          PRINTER_STATE_LAST["print"]["gcode_state"] == "PREPARE" and 
-          "gcode_file" in PRINTER_STATE["print"]
+          "gcode_state" in state and
+          state["gcode_state"] == "RUNNING" and
+          last_state.get("gcode_state") == "PREPARE" and
+          "gcode_file" in state
         ):
 
-        PENDING_PRINT_METADATA = getMetaDataFrom3mf(PRINTER_STATE["print"]["gcode_file"])
-
-        print_id = insert_print(PENDING_PRINT_METADATA["file"], PRINTER_STATE["print"]["print_type"], PENDING_PRINT_METADATA["image"])
+        fetchPrintMetadata(printer, state["gcode_file"], print_type=state["print_type"], ams_mapping=[], filamentChanges=[], complete=False)
 
-        PENDING_PRINT_METADATA["ams_mapping"] = []
-        PENDING_PRINT_METADATA["filamentChanges"] = []
-        PENDING_PRINT_METADATA["complete"] = False
-        PENDING_PRINT_METADATA["print_id"] = print_id
+        #TODO
 
-        for id, filament in PENDING_PRINT_METADATA["filaments"].items():
-          insert_filament_usage(print_id, filament["type"], filament["color"], filament["used_g"], id)
-
-        #TODO 
-    
-      # When stage changed to "change filament" and PENDING_PRINT_METADATA is set
-      if (PENDING_PRINT_METADATA and 
+      # When stage changed to "change filament" and the print's metadata is pending
+      if (printer.pending_print_metadata and
           (
-            ("stg_cur" in PRINTER_STATE["print"] and (int(PRINTER_STATE["print"]["stg_cur"]) == 4) and      # change filament stage (beginning of print)
-              ( 
-                "stg_cur" not in PRINTER_STATE_LAST["print"] or                                           # last stage not known
+            ("stg_cur" in state and (int(state["stg_cur"]) == 4) and      # change filament stage (beginning of print)
+              (
+                "stg_cur" not in last_state or                                           # last stage not known
                 (
-                  PRINTER_STATE_LAST["print"]["stg_cur"] != PRINTER_STATE["print"]["stg_cur"]             # stage has changed and last state was 255 (retract to ams)
-                  and "ams" in PRINTER_STATE_LAST["print"] and int(PRINTER_STATE_LAST["print"]["ams"]["tray_tar"]) == 255
+                  last_state["stg_cur"] != state["stg_cur"]             # stage has changed and last state was 255 (retract to ams)
+                  and "tray_tar" in last_state and int(last_state["tray_tar"]) == 255
                 )
-                or "ams" not in PRINTER_STATE_LAST["print"]                                               # ams not set in last state
+                or "tray_tar" not in last_state                                               # ams not set in last state
               )
             )
             or                                                                                            # filament changes during printing are in mc_print_sub_stage
             (
-              "mc_print_sub_stage" in PRINTER_STATE_LAST["print"] and int(PRINTER_STATE_LAST["print"]["mc_print_sub_stage"]) == 4  # last state was change filament
-              and int(PRINTER_STATE["print"]["mc_print_sub_stage"]) == 2                                                           # current state 
+              "mc_print_sub_stage" in last_state and int(last_state["mc_print_sub_stage"]) == 4  # last state was change filament
+              and int(state["mc_print_sub_stage"]) == 2                                                           # current state
             )
             or (
-              "ams" in PRINTER_STATE["print"] and int(PRINTER_STATE["print"]["ams"]["tray_tar"]) == 254
+              "tray_tar" in state and int(state["tray_tar"]) == 254
             )
-            or 
+            or
             (
-              int(PRINTER_STATE["print"]["stg_cur"]) == 24 and int(PRINTER_STATE_LAST["print"]["stg_cur"]) == 13
+              int(state["stg_cur"]) == 24 and int(last_state["stg_cur"]) == 13
             )
 
           )
       ):
-        if "ams" in PRINTER_STATE["print"] and map_filament(int(PRINTER_STATE["print"]["ams"]["tray_tar"])):
-            PENDING_PRINT_METADATA["complete"] = True
-          
+        if "tray_tar" in state and map_filament(printer, int(state["tray_tar"])):
+            printer.pending_print_metadata["complete"] = True
+
 
-    if PENDING_PRINT_METADATA and PENDING_PRINT_METADATA["complete"]:
-      spendFilaments(PENDING_PRINT_METADATA)
+    resolvePrintMetadata(printer)
 
-      PENDING_PRINT_METADATA = {}
-  
-    PRINTER_STATE_LAST = copy.deepcopy(PRINTER_STATE)
+    pending = printer.pending_print_metadata
+    if pending and pending["complete"] and "future" not in pending:
+      spendFilaments(pending)
 
-def publish(client, msg):
-  result = client.publish(f"device/{PRINTER_ID}/request", json.dumps(msg))
+      printer.pending_print_metadata = {}
+
+def publish(client, msg, printer_id=None):
+  topic = f"device/{printer_id or PRINTER_ID}/request"
+  result = client.publish(topic, json.dumps(msg))
   status = result[0]
   if status == 0:
-    print(f"Sent {msg} to topic device/{PRINTER_ID}/request")
+    print(f"Sent {msg} to topic {topic}")
     return True
 
-  print(f"Failed to send message to topic device/{PRINTER_ID}/request")
+  print(f"Failed to send message to topic {topic}")
   return False
 
 # Inspired by https://github.com/Donkie/Spoolman/issues/217#issuecomment-2303022970
-def on_message(client, userdata, msg):
-  global LAST_AMS_CONFIG, PRINTER_STATE, PRINTER_STATE_LAST, PENDING_PRINT_METADATA, PRINTER_MODEL
-  
+def handleMessage(printer, payload):
   try:
-    data = json.loads(msg.payload.decode())
+    data = json.loads(payload.decode())
 
     if "print" in data:
-      append_to_rotating_file("/home/app/logs/mqtt.log", msg.payload.decode())
+      printer.log.write(payload.decode())
 
     #print(data)
 
     if AUTO_SPEND:
-        processMessage(data)
-      
+        processMessage(data, printer)
+
+    changes = reportChanges(printer, data["print"]) if "print" in data else []
+
     # Save external spool tray data
     if "print" in data and "vt_tray" in data["print"]:
-      LAST_AMS_CONFIG["vt_tray"] = data["print"]["vt_tray"]
+      printer.last_ams_config["vt_tray"] = data["print"]["vt_tray"]
 
     # Save ams spool data
     if "print" in data and "ams" in data["print"] and "ams" in data["print"]["ams"]:
-      LAST_AMS_CONFIG["ams"] = data["print"]["ams"]["ams"]
+      printer.last_ams_config["ams"] = data["print"]["ams"]["ams"]
       for ams in data["print"]["ams"]["ams"]:
-        print(f"AMS [{num2letter(ams['id'])}] (hum: {ams['humidity']}, temp: {ams['temp']}ºC)")
+        print(f"[{printer.id}] AMS [{num2letter(ams['id'])}] (hum: {ams['humidity']}, temp: {ams['temp']}ºC)")
         for tray in ams["tray"]:
           if "tray_sub_brands" in tray:
             print(
                 f"    - [{num2letter(ams['id'])}{tray['id']}] {tray['tray_sub_brands']} {tray['tray_color']} ({str(tray['remain']).zfill(3)}%) [[ {tray['tray_uuid']} ]]")
 
-            found = False
-            tray_uuid = "00000000000000000000000000000000"
+            queueTrayReconciliation(printer.id, ams['id'], tray)
 
-            for spool in fetchSpools(True):
+    # Only once the report is stored, so what gets rendered for it is current
+    if any(event != "stage" for event, _ in changes):
+      printer.ams_version += 1
+    for event, event_data in changes:
+      PRINTER_EVENTS.publish(printer.id, event, event_data)
 
-              tray_uuid = tray["tray_uuid"]
+  except Exception:
+    traceback.print_exc()
 
-              if not spool.get("extra", {}).get("tag"):
-                continue
-              tag = json.loads(spool["extra"]["tag"])
-              if tag != tray["tray_uuid"]:
-                continue
+# Reports can leave out fields that did not change, only the reported ones count
+def trayChanged(last_tray, tray):
+  return last_tray is None or any(last_tray.get(key) != value for key, value in tray.items())
 
-              found = True
+# The /events messages for what a report changes, it must be compared before it replaces the last AMS report
+def reportChanges(printer, print_data):
+  changes = []
 
-              setActiveTray(spool['id'], spool["extra"], ams['id'], tray["id"])
+  status = {key: print_data[key] for key in PRINT_STATUS_FIELDS if key in print_data and printer.print_status.get(key) != print_data[key]}
+  if status:
+    printer.print_status = {**printer.print_status, **status}
+    printer.status_version += 1
+    changes.append(("stage", printer.print_status))
 
-              # TODO: filament remaining - Doesn't work for AMS Lite
-              # requests.patch(f"http://{SPOOLMAN_IP}:7912/api/v1/spool/{spool['id']}", json={
-              #  "remaining_weight": tray["remain"] / 100 * tray["tray_weight"]
-              # })
+  if "vt_tray" in print_data and trayChanged(printer.last_ams_config.get("vt_tray"), print_data["vt_tray"]):
+    changes.append(("tray", (EXTERNAL_SPOOL_AMS_ID, EXTERNAL_SPOOL_ID)))
 
-            if not found and tray_uuid == "00000000000000000000000000000000":
-              print("      - No Spool or non Bambulab Spool!")
-            elif not found:
-              print("      - Not found. Update spool tag!")
-              
-  except Exception as e:
-    traceback.print_exc()
+  ams_report = print_data.get("ams")
+  if not isinstance(ams_report, dict) or "ams" not in ams_report:
+    return changes
 
-def on_connect(client, userdata, flags, rc):
-  global MQTT_CLIENT_CONNECTED
-  MQTT_CLIENT_CONNECTED = True
-  print("Connected with result code " + str(rc))
-  client.subscribe(f"device/{PRINTER_ID}/report")
-  publish(client, GET_VERSION)
-  publish(client, PUSH_ALL)
+  last_units = {ams["id"]: ams for ams in printer.last_ams_config.get("ams", [])}
+  for ams in ams_report["ams"]:
+    last_ams = last_units.get(ams["id"], {})
+    if (last_ams.get("humidity"), last_ams.get("temp")) != (ams.get("humidity"), ams.get("temp")):
+      changes.append(("ams", {"ams_id": ams["id"], "humidity": ams.get("humidity"), "temp": ams.get("temp")}))
 
-def on_disconnect(client, userdata, rc):
-  global MQTT_CLIENT_CONNECTED
-  MQTT_CLIENT_CONNECTED = False
-  print("Disconnected with result code " + str(rc))
-  
-def async_subscribe():
-  global MQTT_CLIENT
-  global MQTT_CLIENT_CONNECTED
-  
-  MQTT_CLIENT_CONNECTED = False
-  MQTT_CLIENT = mqtt.Client()
-  MQTT_CLIENT.username_pw_set("bblp", PRINTER_CODE)
-  ssl_ctx = ssl.create_default_context()
-  ssl_ctx.check_hostname = False
-  ssl_ctx.verify_mode = ssl.CERT_NONE
-  MQTT_CLIENT.tls_set_context(ssl_ctx)
-  MQTT_CLIENT.tls_insecure_set(True)
-  MQTT_CLIENT.on_connect = on_connect
-  MQTT_CLIENT.on_disconnect = on_disconnect
-  MQTT_CLIENT.on_message = on_message
-  
+    last_trays = {tray["id"]: tray for tray in last_ams.get("tray", [])}
+    for tray in ams.get("tray", []):
+      if trayChanged(last_trays.get(tray["id"]), tray):
+        changes.append(("tray", (ams["id"], tray["id"])))
+
+  return changes
+
+def handleMessages(printer, payloads):
+  for payload in payloads:
+    handleMessage(printer, payload)
+
+def on_message(client, userdata, msg):
+  printer = userdata or getPrinter()
+  printer.receive(msg.payload)
+
+def queueTrayReconciliation(printer_id, ams_id, tray):
+  with TRAY_RECONCILIATION_CONDITION:
+    PENDING_TRAY_RECONCILIATION[(printer_id, ams_id, tray["id"])] = dict(tray)
+    TRAY_RECONCILIATION_CONDITION.notify()
+
+def reconcileTray(printer_id, ams_id, tray):
+  tray_uuid = tray["tray_uuid"]
+  tagged_spools = SPOOL_INDEX.findByTag(tray_uuid)
+
+  for spool in tagged_spools:
+    setActiveTray(spool['id'], spool["extra"], ams_id, tray["id"], printer_id)
+
+    # TODO: filament remaining - Doesn't work for AMS Lite
+    # requests.patch(f"http://{SPOOLMAN_IP}:7912/api/v1/spool/{spool['id']}", json={
+    #  "remaining_weight": tray["remain"] / 100 * tray["tray_weight"]
+    # })
+
+  if not tagged_spools and tray_uuid == "00000000000000000000000000000000":
+    print(f"    - [{printer_id}] [{num2letter(ams_id)}{tray['id']}] No Spool or non Bambulab Spool!")
+  elif not tagged_spools:
+    print(f"    - [{printer_id}] [{num2letter(ams_id)}{tray['id']}] Not found. Update spool tag!")
+
+# Runs on its own thread so SpoolMan round trips never block paho's network loop
+def tray_reconciliation_worker():
   while True:
-    while not MQTT_CLIENT_CONNECTED:
+    with TRAY_RECONCILIATION_CONDITION:
+      while not PENDING_TRAY_RECONCILIATION:
+        TRAY_RECONCILIATION_CONDITION.wait()
+
+      pending = dict(PENDING_TRAY_RECONCILIATION)
+      PENDING_TRAY_RECONCILIATION.clear()
+
+    for (printer_id, ams_id, _), tray in pending.items():
       try:
-          print("🔄 Trying to connect ...", flush=True)
-          MQTT_CLIENT.connect(PRINTER_IP, 8883, MQTT_KEEPALIVE)
-          MQTT_CLIENT.loop_start()
-          
-      except Exception as e:
-          print(f"⚠️ connection failed: {e}, new try in 15 seconds...", flush=True)
+        fetchSpools(True)
+        reconcileTray(printer_id, ams_id, tray)
+      except Exception:
+        traceback.print_exc()
 
-      time.sleep(15)
+def on_connect(client, userdata, flags, rc):
+  printer = userdata or getPrinter()
+  printer.connected = rc == 0
+  if printer.connected:
+    printer.connects += 1
+  print(f"[{printer.id}] Connected with result code " + str(rc))
+  client.subscribe(printer.report_topic)
+  publish(client, GET_VERSION, printer.id)
+  publish(client, PUSH_ALL, printer.id)
 
-    time.sleep(15)
+def on_disconnect(client, userdata, rc):
+  printer = userdata or getPrinter()
+  printer.connected = False
+  print(f"[{printer.id}] Disconnected with result code " + str(rc))
+  printer.loop.call_soon_threadsafe(printer.disconnected.set)
+
+def registerConfiguredPrinters(client_factory=createMqttClient):
+  """Registers the printers of the PRINTERS setting, each with its own MQTT log if there are several."""
+  for config in PRINTER_CONFIGS:
+    printer_id = config["id"]
+    log_path = "/home/app/logs/mqtt.log" if len(PRINTER_CONFIGS) == 1 else f"/home/app/logs/{printer_id}/mqtt.log"
+    registerPrinter(printer_id, config["ip"], config["access_code"], config.get("name"),
+                    port=int(config.get("port", 8883)), tls=config.get("tls", True), client_factory=client_factory,
+                    ftp=PRINTER_FTP if printer_id == PRINTER_ID else None, log_path=log_path)
 
 def init_mqtt():
-  # Start the asynchronous processing in a separate thread
-  thread = Thread(target=async_subscribe)
-  thread.start()
+  # Match AMS trays to SpoolMan spools outside of the MQTT callbacks
+  Thread(target=tray_reconciliation_worker, daemon=True).start()
+
+  # One event loop thread for the MQTT sessions of all printers
+  Thread(target=asyncio.run, args=(ingest(),), name="mqtt-ingestion", daemon=True).start()
+
+async def ingest():
+  await asyncio.gather(*(printer.run() for printer in getPrinters()))
 
-def getLastAMSConfig():
-  global LAST_AMS_CONFIG
-  return LAST_AMS_CONFIG
+def getLastAMSConfig(printer_id=None):
+  return getPrinter(printer_id).last_ams_config
 
+def getMqttClient(printer_id=None):
+  return getPrinter(printer_id).client
 
-def getMqttClient():
-  global MQTT_CLIENT
-  return MQTT_CLIENT
+def isMqttClientConnected(printer_id=None):
+  printer = getPrinter(printer_id)
+  return printer is not None and printer.connected
 
-def isMqttClientConnected():
-  global MQTT_CLIENT_CONNECTED
-  return MQTT_CLIENT_CONNECTED
\ No newline at end of file
+registerConfiguredPrinters()
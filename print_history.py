@@ -1,12 +1,169 @@
-import copy
 import os
 import sqlite3
-import json
+import threading
 from datetime import datetime
 from collections.abc import Mapping
 
 db_config = {"db_path": os.path.join(os.getcwd(), 'data', "3d_printer_logs.db")}  # Configuration for database location
 
+# Schema changes after the initial tables, applied in order and tracked in PRAGMA user_version
+MIGRATIONS = [
+    # 1: indexes for the history page, the prints of a spool and the filament of a slot
+    '''
+        CREATE INDEX IF NOT EXISTS idx_prints_print_date ON prints (print_date, id);
+        CREATE INDEX IF NOT EXISTS idx_filament_usage_print_id ON filament_usage (print_id, ams_slot);
+        CREATE INDEX IF NOT EXISTS idx_filament_usage_spool_id ON filament_usage (spool_id);
+    ''',
+    # 2: cost stored with the usage, rolled up per print, per spool and per day by triggers.
+    # Only usage with a spool counts, usage recorded before costs were stored counts with cost 0.
+    '''
+        ALTER TABLE filament_usage ADD COLUMN cost REAL;
+        ALTER TABLE prints ADD COLUMN total_cost REAL NOT NULL DEFAULT 0;
+
+        CREATE TABLE IF NOT EXISTS spool_usage (
+            spool_id INTEGER PRIMARY KEY,
+            uses INTEGER NOT NULL DEFAULT 0,
+            grams_used REAL NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0
+        );
+
+        CREATE TABLE IF NOT EXISTS daily_usage (
+            day TEXT PRIMARY KEY,
+            uses INTEGER NOT NULL DEFAULT 0,
+            grams_used REAL NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0
+        );
+
+        INSERT INTO spool_usage (spool_id, uses, grams_used)
+        SELECT spool_id, COUNT(*), SUM(grams_used) FROM filament_usage
+        WHERE spool_id IS NOT NULL
+        GROUP BY spool_id;
+
+        INSERT INTO daily_usage (day, uses, grams_used)
+        SELECT date(p.print_date), COUNT(*), SUM(f.grams_used) FROM filament_usage f
+        JOIN prints p ON p.id = f.print_id
+        WHERE f.spool_id IS NOT NULL
+        GROUP BY date(p.print_date);
+
+        CREATE TRIGGER IF NOT EXISTS filament_usage_rollup_insert AFTER INSERT ON filament_usage
+        WHEN NEW.spool_id IS NOT NULL
+        BEGIN
+            INSERT INTO spool_usage (spool_id, uses, grams_used, cost)
+            VALUES (NEW.spool_id, 1, NEW.grams_used, COALESCE(NEW.cost, 0))
+            ON CONFLICT (spool_id) DO UPDATE SET uses = uses + 1, grams_used = grams_used + excluded.grams_used, cost = cost + excluded.cost;
+
+            INSERT INTO daily_usage (day, uses, grams_used, cost)
+            SELECT date(print_date), 1, NEW.grams_used, COALESCE(NEW.cost, 0) FROM prints WHERE id = NEW.print_id
+            ON CONFLICT (day) DO UPDATE SET uses = uses + 1, grams_used = grams_used + excluded.grams_used, cost = cost + excluded.cost;
+
+            UPDATE prints SET total_cost = total_cost + COALESCE(NEW.cost, 0) WHERE id = NEW.print_id;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS filament_usage_rollup_delete AFTER DELETE ON filament_usage
+        WHEN OLD.spool_id IS NOT NULL
+        BEGIN
+            UPDATE spool_usage SET uses = uses - 1, grams_used = grams_used - OLD.grams_used, cost = cost - COALESCE(OLD.cost, 0)
+            WHERE spool_id = OLD.spool_id;
+
+            UPDATE daily_usage SET uses = uses - 1, grams_used = grams_used - OLD.grams_used, cost = cost - COALESCE(OLD.cost, 0)
+            WHERE day = (SELECT date(print_date) FROM prints WHERE id = OLD.print_id);
+
+            UPDATE prints SET total_cost = total_cost - COALESCE(OLD.cost, 0) WHERE id = OLD.print_id;
+        END;
+
+        -- A reassignment moves the usage from the old spool to the new one
+        CREATE TRIGGER IF NOT EXISTS filament_usage_rollup_update AFTER UPDATE OF spool_id, grams_used, cost ON filament_usage
+        BEGIN
+            UPDATE spool_usage SET uses = uses - 1, grams_used = grams_used - OLD.grams_used, cost = cost - COALESCE(OLD.cost, 0)
+            WHERE spool_id = OLD.spool_id;
+
+            UPDATE daily_usage SET uses = uses - 1, grams_used = grams_used - OLD.grams_used, cost = cost - COALESCE(OLD.cost, 0)
+            WHERE OLD.spool_id IS NOT NULL AND day = (SELECT date(print_date) FROM prints WHERE id = OLD.print_id);
+
+            INSERT INTO spool_usage (spool_id, uses, grams_used, cost)
+            SELECT NEW.spool_id, 1, NEW.grams_used, COALESCE(NEW.cost, 0) WHERE NEW.spool_id IS NOT NULL
+            ON CONFLICT (spool_id) DO UPDATE SET uses = uses + 1, grams_used = grams_used + excluded.grams_used, cost = cost + excluded.cost;
+
+            INSERT INTO daily_usage (day, uses, grams_used, cost)
+            SELECT date(print_date), 1, NEW.grams_used, COALESCE(NEW.cost, 0) FROM prints WHERE id = NEW.print_id AND NEW.spool_id IS NOT NULL
+            ON CONFLICT (day) DO UPDATE SET uses = uses + 1, grams_used = grams_used + excluded.grams_used, cost = cost + excluded.cost;
+
+            UPDATE prints SET total_cost = total_cost - CASE WHEN OLD.spool_id IS NULL THEN 0 ELSE COALESCE(OLD.cost, 0) END
+                                                      + CASE WHEN NEW.spool_id IS NULL THEN 0 ELSE COALESCE(NEW.cost, 0) END
+            WHERE id = NEW.print_id;
+        END;
+    ''',
+    # 3: a revision counted up by every change to the history, from whichever process or
+    # connection writes it, for the ETags of the pages built from it
+    '''
+        CREATE TABLE IF NOT EXISTS history_revision (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            revision INTEGER NOT NULL
+        );
+        INSERT INTO history_revision (id, revision) VALUES (1, 0);
+
+        CREATE TRIGGER IF NOT EXISTS prints_revision_insert AFTER INSERT ON prints
+        BEGIN
+            UPDATE history_revision SET revision = revision + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS prints_revision_update AFTER UPDATE ON prints
+        BEGIN
+            UPDATE history_revision SET revision = revision + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS prints_revision_delete AFTER DELETE ON prints
+        BEGIN
+            UPDATE history_revision SET revision = revision + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS filament_usage_revision_insert AFTER INSERT ON filament_usage
+        BEGIN
+            UPDATE history_revision SET revision = revision + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS filament_usage_revision_update AFTER UPDATE ON filament_usage
+        BEGIN
+            UPDATE history_revision SET revision = revision + 1;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS filament_usage_revision_delete AFTER DELETE ON filament_usage
+        BEGIN
+            UPDATE history_revision SET revision = revision + 1;
+        END;
+    ''',
+]
+
+_connections = threading.local()
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Returns the calling thread's connection to the database, opened on first use.
+    Connections stay open, so sqlite3's per-connection statement cache keeps the
+    queries below prepared. WAL lets the web threads read while the MQTT thread
+    writes, and synchronous=NORMAL only syncs at checkpoints instead of every commit.
+    """
+    conn = getattr(_connections, "conn", None)
+    if conn is None or _connections.db_path != db_config["db_path"]:
+        conn = sqlite3.connect(db_config["db_path"])
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _connections.conn = conn
+        _connections.db_path = db_config["db_path"]
+    return conn
+
+def migrate_database(conn: sqlite3.Connection) -> None:
+    """
+    Applies the migrations the database doesn't have yet, each in its own transaction.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            conn.executescript(f"BEGIN; {migration} PRAGMA user_version = {number}; COMMIT;")
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
 def create_database() -> None:
     """
     Creates an SQLite database to store 3D printer print jobs and filament usage if it does not exist.
@@ -43,85 +200,138 @@ def create_database() -> None:
         conn.commit()
         conn.close()
 
-def insert_print(file_name: str, print_type: str, image_file: str = None, print_date: str = None) -> int:
+    migrate_database(get_connection())
+
+def update_filament_spool(print_id: int, filament_id: int, spool_id: int, cost_per_gram: float = None) -> None:
     """
-    Inserts a new print job into the database and returns the print ID.
-    If no print_date is provided, the current timestamp is used.
+    Updates the spool_id for a given filament usage entry, ensuring it belongs to the specified print job.
+    The cost of the usage is stored at the spool's current cost_per_gram, the triggers of
+    migration 2 move it between the per-spool and per-day totals.
     """
-    if print_date is None:
-        print_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    conn = sqlite3.connect(db_config["db_path"])
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute('''
-        INSERT INTO prints (print_date, file_name, print_type, image_file)
-        VALUES (?, ?, ?, ?)
-    ''', (print_date, file_name, print_type, image_file))
-    print_id = cursor.lastrowid
+        UPDATE filament_usage
+        SET spool_id = ?, cost = grams_used * ?
+        WHERE ams_slot = ? AND print_id = ?
+    ''', (spool_id, cost_per_gram, filament_id, print_id))
     conn.commit()
-    conn.close()
-    return print_id
 
-def insert_filament_usage(print_id: int, filament_type: str, color: str, grams_used: float, ams_slot: int) -> None:
+
+def record_print(file_name: str, print_type: str, image_file: str = None, filaments: Mapping = None, print_date: str = None) -> int:
     """
-    Inserts a new filament usage entry for a specific print job.
+    Inserts a print job together with the filament usage of its AMS slots and returns the print ID.
+    filaments maps the ams_slot to the filament's type, color and used_g as read from the 3MF.
+    Everything is written in one transaction, so either the whole print is recorded or nothing.
     """
-    conn = sqlite3.connect(db_config["db_path"])
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO filament_usage (print_id, filament_type, color, grams_used, ams_slot)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (print_id, filament_type, color, grams_used, ams_slot))
-    conn.commit()
-    conn.close()
+    if print_date is None:
+        print_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    conn = get_connection()
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO prints (print_date, file_name, print_type, image_file)
+            VALUES (?, ?, ?, ?)
+        ''', (print_date, file_name, print_type, image_file))
+        print_id = cursor.lastrowid
+        cursor.executemany('''
+            INSERT INTO filament_usage (print_id, filament_type, color, grams_used, ams_slot)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(print_id, filament["type"], filament["color"], filament["used_g"], ams_slot)
+              for ams_slot, filament in (filaments or {}).items()])
+    return print_id
 
-def update_filament_spool(print_id: int, filament_id: int, spool_id: int) -> None:
+def assign_spools(print_id: int, assignments) -> None:
     """
-    Updates the spool_id for a given filament usage entry, ensuring it belongs to the specified print job.
+    Sets the spools of a print job's filament usage in one transaction. assignments is a list
+    of (ams_slot, spool_id, cost_per_gram), applied in order like update_filament_spool.
     """
-    conn = sqlite3.connect(db_config["db_path"])
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE filament_usage
-        SET spool_id = ?
-        WHERE ams_slot = ? AND print_id = ?
-    ''', (spool_id, filament_id, print_id))
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        conn.executemany('''
+            UPDATE filament_usage
+            SET spool_id = ?, cost = grams_used * ?
+            WHERE ams_slot = ? AND print_id = ?
+        ''', [(spool_id, cost_per_gram, ams_slot, print_id) for ams_slot, spool_id, cost_per_gram in assignments])
 
-
-def get_prints_with_filament():
+def get_prints_with_filament(limit: int = None, before: tuple = None, spool_id: int = None, filament_type: str = None,
+                             date_from: str = None, date_to: str = None, print_type: str = None):
     """
-    Retrieves all print jobs along with their associated filament usage, grouped by print job.
-    Returns the result as a JSON-serializable list.
+    Retrieves print jobs along with their associated filament usage, grouped by print job,
+    newest first. Returns the result as a JSON-serializable list.
+
+    Pages are selected by keyset: before is the (print_date, id) of the last print of the
+    previous page, so every page is an index range scan no matter how deep it is. The
+    filament of a print is collected by a subquery on idx_filament_usage_print_id, which
+    only runs for the prints that are returned.
+    The filters select prints that used the spool or filament type, were printed
+    between the dates (YYYY-MM-DD, both inclusive) or have the print type.
     """
-    conn = sqlite3.connect(db_config["db_path"])
-    conn.row_factory = sqlite3.Row  # Enable column name access
+    conditions = []
+    params = []
+    if before is not None:
+        conditions.append("(p.print_date, p.id) < (?, ?)")
+        params.extend(before)
+    if spool_id is not None:
+        conditions.append("EXISTS (SELECT 1 FROM filament_usage u WHERE u.print_id = p.id AND u.spool_id = ?)")
+        params.append(spool_id)
+    if filament_type:
+        conditions.append("EXISTS (SELECT 1 FROM filament_usage u WHERE u.print_id = p.id AND u.filament_type = ?)")
+        params.append(filament_type)
+    if date_from:
+        conditions.append("p.print_date >= date(?)")
+        params.append(date_from)
+    if date_to:
+        conditions.append("p.print_date < date(?, '+1 day')")
+        params.append(date_to)
+    if print_type:
+        conditions.append("p.print_type = ?")
+        params.append(print_type)
+
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    params.append(limit if limit is not None else -1)
+
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute('''
+    cursor.row_factory = sqlite3.Row  # Enable column name access
+    cursor.execute(f'''
         SELECT p.id AS id, p.print_date AS print_date, p.file_name AS file_name, 
                p.print_type AS print_type, p.image_file AS image_file,
+               p.total_cost AS total_cost,
                (
                    SELECT json_group_array(json_object(
                        'spool_id', f.spool_id,
                        'filament_type', f.filament_type,
                        'color', f.color,
                        'grams_used', f.grams_used,
-                       'ams_slot', f.ams_slot
+                       'ams_slot', f.ams_slot,
+                       'cost', f.cost
                    )) FROM filament_usage f WHERE f.print_id = p.id
                ) AS filament_info
         FROM prints p
-        ORDER BY p.print_date DESC
-    ''')
+        {where}
+        ORDER BY p.print_date DESC, p.id DESC
+        LIMIT ?
+    ''', params)
     prints = [dict(row) for row in cursor.fetchall()]
-    conn.close()
     return prints
 
+def get_print(print_id: int):
+    """
+    Retrieves a single print job, or None if it doesn't exist.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row  # Enable column name access
+    cursor.execute('SELECT * FROM prints WHERE id = ?', (print_id,))
+    return cursor.fetchone()
+
 def get_prints_by_spool(spool_id: int):
     """
     Retrieves all print jobs that used a specific spool.
     """
-    conn = sqlite3.connect(db_config["db_path"])
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute('''
         SELECT DISTINCT p.* FROM prints p
@@ -129,13 +339,12 @@ def get_prints_by_spool(spool_id: int):
         WHERE f.spool_id = ?
     ''', (spool_id,))
     prints = cursor.fetchall()
-    conn.close()
     return prints
 
 def get_filament_for_slot(print_id: int, ams_slot: int):
-    conn = sqlite3.connect(db_config["db_path"])
-    conn.row_factory = sqlite3.Row  # Enable column name access
+    conn = get_connection()
     cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row  # Enable column name access
     
     cursor.execute('''
         SELECT * FROM filament_usage
@@ -143,16 +352,72 @@ def get_filament_for_slot(print_id: int, ams_slot: int):
     ''', (print_id, ams_slot))
     
     results = cursor.fetchone()
-    conn.close()
     return results
 
+def get_spool_usage(spool_id: int):
+    """
+    Returns how often a spool was used in prints, the grams and the cost, or None if it never was.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row  # Enable column name access
+    cursor.execute('SELECT * FROM spool_usage WHERE spool_id = ?', (spool_id,))
+    return cursor.fetchone()
+
+def get_monthly_spend(date_from: str = None, date_to: str = None):
+    """
+    Returns the uses, grams and cost of filament per month (YYYY-MM) between two days (YYYY-MM-DD, both inclusive), newest first.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row  # Enable column name access
+    cursor.execute('''
+        SELECT substr(day, 1, 7) AS month, SUM(uses) AS uses, SUM(grams_used) AS grams_used, SUM(cost) AS cost
+        FROM daily_usage
+        WHERE day >= COALESCE(?, '') AND day <= COALESCE(?, '9999-12-31')
+        GROUP BY month
+        ORDER BY month DESC
+    ''', (date_from, date_to))
+    return [dict(row) for row in cursor.fetchall()]
+
+def get_revision() -> int:
+    """
+    Returns a number that grows with every change to the print history, made by any process.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT revision FROM history_revision')
+    return cursor.fetchone()[0]
+
+def get_image_files() -> set:
+    """
+    Returns the names of all thumbnails referenced by print jobs.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT DISTINCT image_file FROM prints WHERE image_file IS NOT NULL')
+    image_files = {row[0] for row in cursor.fetchall()}
+    return image_files
+
+def replace_image_file(old_image_file: str, new_image_file: str) -> None:
+    """
+    Points all print jobs using one thumbnail at another one.
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE prints
+        SET image_file = ?
+        WHERE image_file = ?
+    ''', (new_image_file, old_image_file))
+    conn.commit()
+
 # Example for creating the database if it does not exist
 create_database()
 
 # Example usage
-#print_id = insert_print("test_print.gcode", "PLA", "test_print.png")
-#insert_filament_usage(print_id, 15.2, 1)  # Spool_id is unknown initially
-#insert_filament_usage(print_id, 10.5, 2, 123)  # Spool_id is known
+#print_id = record_print("test_print.gcode", "local", "test_print.png", {1: {"type": "PLA", "color": "#FFFFFF", "used_g": 15.2}})  # Spool_id is unknown initially
+#assign_spools(print_id, [(1, 123, 0.02)])  # Spool_id is known
 
 # Updating spool_id for the first filament entry
 #update_filament_spool(1, 456)  # Assigns spool_id to the first filament usage entry
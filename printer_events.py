@@ -0,0 +1,49 @@
+import queue
+from threading import Lock
+
+class PrinterEvents:
+  """
+  Fans the changes the MQTT handlers see out to the open /events streams.
+  Every stream subscribes to one printer and gets its own bounded queue, a
+  stream that falls behind gets a single "resync" instead of the events it
+  missed and renders everything again.
+  """
+
+  def __init__(self, queue_size=100):
+    self.queue_size = queue_size
+    self.lock = Lock()
+    self.subscribers = {}  # queue -> printer id
+
+  def subscribe(self, printer_id):
+    subscription = queue.Queue(self.queue_size)
+    with self.lock:
+      self.subscribers[subscription] = printer_id
+    return subscription
+
+  def unsubscribe(self, subscription):
+    with self.lock:
+      self.subscribers.pop(subscription, None)
+
+  def publish(self, printer_id, event, data=None):
+    with self.lock:
+      subscriptions = [subscription for subscription, subscribed_id in self.subscribers.items() if subscribed_id == printer_id]
+
+    for subscription in subscriptions:
+      try:
+        subscription.put_nowait((event, data))
+      except queue.Full:
+        self.resync(subscription)
+
+  @staticmethod
+  def resync(subscription):
+    try:
+      while True:
+        subscription.get_nowait()
+    except queue.Empty:
+      pass
+    try:
+      subscription.put_nowait(("resync", None))
+    except queue.Full:
+      pass
+
+PRINTER_EVENTS = PrinterEvents()
@@ -0,0 +1,157 @@
+import io
+import urllib.parse
+from threading import Lock
+
+import pycurl
+
+from config import PRINTER_ID, PRINTER_IP, PRINTER_CODE, PRINTER_FTP_TIMEOUT
+
+class PrinterFTPError(Exception):
+  pass
+
+class PrinterFTPSession:
+  """
+  Reusable FTPS session to the printer's SD card.
+
+  All transfers go through one pycurl handle, so the control connection and the
+  login are reused between them. TLS sessions live in a CurlShare and survive
+  the handle being replaced after an error, which lets a reconnect resume the
+  session instead of doing a full handshake. Every transfer checks the server's
+  response code and records its metrics in last_transfer.
+  """
+
+  def __init__(self, host=PRINTER_IP, access_code=PRINTER_CODE, timeout=PRINTER_FTP_TIMEOUT, printer_id=PRINTER_ID):
+    self.host = host
+    self.printer_id = printer_id
+    self.access_code = access_code
+    self.timeout = timeout
+    self.lock = Lock()
+    self.handle = None
+    self.last_transfer = {}
+    self.transfers = 0
+    self.connects = 0
+    self.bytes_downloaded = 0
+
+    self.share = pycurl.CurlShare()
+    self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+    self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+
+  def curl(self):
+    if self.handle is None:
+      c = pycurl.Curl()
+      c.setopt(c.SHARE, self.share)
+      c.setopt(c.USERPWD, f"bblp:{self.access_code}")
+
+      # 🔹 Enable SSL/TLS, the printer has a self signed certificate
+      c.setopt(c.SSL_VERIFYPEER, 0)
+      c.setopt(c.SSL_VERIFYHOST, 0)
+
+      # 🔹 Explicit FTPS for control and data connections (like FileZilla)
+      c.setopt(c.FTP_SSL, c.FTPSSL_ALL)
+      c.setopt(c.FTPSSLAUTH, c.FTPAUTH_TLS)
+
+      # Give up on a printer that doesn't answer or a transfer that stalls
+      c.setopt(c.CONNECTTIMEOUT, int(self.timeout))
+      c.setopt(c.FTP_RESPONSE_TIMEOUT, int(self.timeout))
+      c.setopt(c.LOW_SPEED_LIMIT, 1)
+      c.setopt(c.LOW_SPEED_TIME, int(self.timeout))
+      self.handle = c
+
+    return self.handle
+
+  def reset(self):
+    if self.handle is not None:
+      self.handle.close()
+      self.handle = None
+
+  def close(self):
+    with self.lock:
+      self.reset()
+
+  def perform(self, remote_path, write, byte_range=None, progress=None):
+    with self.lock:
+      c = self.curl()
+      c.setopt(c.URL, f"ftps://{self.host}{urllib.parse.quote(remote_path)}")
+      c.setopt(c.WRITEFUNCTION, write)
+      if byte_range:
+        c.setopt(c.RANGE, byte_range)
+      else:
+        c.unsetopt(c.RANGE)
+
+      if progress:
+        c.setopt(c.NOPROGRESS, 0)
+        c.setopt(c.XFERINFOFUNCTION, lambda total, downloaded, upload_total, uploaded: progress(downloaded, total))
+      else:
+        c.setopt(c.NOPROGRESS, 1)
+
+      try:
+        c.perform()
+      except pycurl.error as e:
+        # The connection is in an unknown state, start over on the next transfer
+        self.reset()
+        raise PrinterFTPError(f"{remote_path}: {e.args[-1]}") from e
+
+      response_code = c.getinfo(c.RESPONSE_CODE)
+      self.record(c, remote_path)
+
+      # A ranged read ends by aborting the data connection, which the server may answer with 4xx
+      if response_code >= 400 and not byte_range:
+        raise PrinterFTPError(f"{remote_path}: server answered {response_code}")
+
+      return self.last_transfer
+
+  def record(self, c, remote_path):
+    # NUM_CONNECTS includes the data connection every FTP transfer opens, a
+    # reused control connection shows as no TLS handshake instead
+    connects = c.getinfo(c.NUM_CONNECTS)
+    tls_time = c.getinfo(c.APPCONNECT_TIME)
+    self.last_transfer = {
+      "path": remote_path,
+      "response_code": c.getinfo(c.RESPONSE_CODE),
+      "size": int(c.getinfo(c.SIZE_DOWNLOAD)),
+      "time": c.getinfo(c.TOTAL_TIME),
+      "speed": c.getinfo(c.SPEED_DOWNLOAD),
+      "tls_time": tls_time,
+      "reused": tls_time == 0,
+    }
+    self.transfers += 1
+    self.connects += connects
+    self.bytes_downloaded += self.last_transfer["size"]
+
+  def download(self, remote_path, dest_file, progress=None):
+    """Writes the remote file to dest_file, returns the transfer metrics."""
+    return self.perform(remote_path, dest_file.write, progress=progress)
+
+  def read(self, remote_path, offset, length):
+    """Returns length bytes of the remote file starting at offset (REST offset)."""
+    buffer = io.BytesIO()
+    self.perform(remote_path, buffer.write, byte_range=f"{offset}-{offset + length - 1}")
+    return buffer.getvalue()[:length]
+
+  def size(self, remote_path):
+    with self.lock:
+      c = self.curl()
+      c.setopt(c.URL, f"ftps://{self.host}{urllib.parse.quote(remote_path)}")
+      c.setopt(c.NOBODY, 1)
+      # curl reports the SIZE answer as a Content-Length pseudo header, don't print it
+      c.setopt(c.HEADERFUNCTION, lambda header: None)
+      c.setopt(c.WRITEFUNCTION, lambda data: None)
+      try:
+        c.perform()
+      except pycurl.error as e:
+        self.reset()
+        raise PrinterFTPError(f"{remote_path}: {e.args[-1]}") from e
+      finally:
+        if self.handle is not None:
+          c.setopt(c.NOBODY, 0)
+          c.unsetopt(c.HEADERFUNCTION)
+
+      return int(c.getinfo(c.CONTENT_LENGTH_DOWNLOAD))
+
+  def list(self, remote_dir):
+    """Returns the lines of a LIST of the remote directory."""
+    buffer = io.BytesIO()
+    self.perform(remote_dir.rstrip("/") + "/", buffer.write)
+    return buffer.getvalue().decode("utf-8", errors="replace").splitlines()
+
+PRINTER_FTP = PrinterFTPSession()
@@ -0,0 +1,32 @@
+from collections.abc import Mapping
+
+# Fields of the printer's "print" report read by the filament spending state machine
+TRACKED_FIELDS = ("gcode_state", "stg_cur", "mc_print_sub_stage", "print_type", "gcode_file", "subtask_name", "use_ams", "ams_mapping")
+
+class PrinterState:
+  """
+  The tracked fields of the printer's "print" reports, merged across the partial
+  reports the printer sends, plus the values they had before the latest report.
+  ams.tray_tar is kept flat as "tray_tar". Every report builds a new small dict
+  for current, so previous is just the old one and no copying is needed.
+  """
+
+  def __init__(self):
+    self.current = {}
+    self.previous = None  # None until a report has been merged
+    self.reports = 0
+
+  def update(self, print_data):
+    changes = {key: print_data[key] for key in TRACKED_FIELDS if key in print_data}
+
+    ams = print_data.get("ams")
+    if isinstance(ams, Mapping) and "tray_tar" in ams:
+      changes["tray_tar"] = ams["tray_tar"]
+
+    self.previous = self.current if self.reports else None
+    if changes:
+      self.current = {**self.current, **changes}
+    self.reports += 1
+
+  def get(self, key, default=None):
+    return self.current.get(key, default)
@@ -0,0 +1,167 @@
+import io
+from collections import OrderedDict
+
+import requests
+
+# zipfile looks for the end of central directory record in the last 64 KiB + 22 bytes
+TAIL_SIZE = 65536 + 22
+
+class RangeNotSupported(Exception):
+  pass
+
+class RemoteFile(io.RawIOBase):
+  """
+  Read-only, seekable view of a remote file that only fetches the bytes that are
+  read, so zipfile.ZipFile can open a 3MF and read single entries without
+  downloading the whole archive.
+
+  The tail of the file, which holds the central directory, is fetched up front.
+  zipfile reads local headers and small entries in many tiny pieces, these are
+  served from a few cached blocks. Reads of a block or more are fetched as they
+  are. Subclasses implement fetch(offset, length).
+  """
+
+  def __init__(self, size, block_size=64 * 1024, max_blocks=16):
+    super().__init__()
+    self.size = size
+    self.block_size = block_size
+    self.max_blocks = max_blocks
+    self.blocks = OrderedDict()
+    self.tail_offset = size
+    self.tail = b""
+    self.position = 0
+    self.requests = 0
+    self.bytes_fetched = 0
+
+  def fetch(self, offset, length):
+    raise NotImplementedError
+
+  def fetchCounted(self, offset, length):
+    data = self.fetch(offset, length)
+    self.requests += 1
+    self.bytes_fetched += len(data)
+    return data
+
+  def setTail(self, tail):
+    self.tail = tail
+    self.tail_offset = self.size - len(tail)
+
+  def readable(self):
+    return True
+
+  def seekable(self):
+    return True
+
+  def tell(self):
+    return self.position
+
+  def seek(self, offset, whence=io.SEEK_SET):
+    if whence == io.SEEK_CUR:
+      offset += self.position
+    elif whence == io.SEEK_END:
+      offset += self.size
+
+    if offset < 0:
+      raise ValueError(f"negative seek position {offset}")
+
+    self.position = offset
+    return self.position
+
+  def block(self, index):
+    if index in self.blocks:
+      self.blocks.move_to_end(index)
+      return self.blocks[index]
+
+    offset = index * self.block_size
+    block = self.fetchCounted(offset, min(self.block_size, self.size - offset))
+    self.blocks[index] = block
+    if len(self.blocks) > self.max_blocks:
+      self.blocks.popitem(last=False)
+    return block
+
+  def read(self, size=-1):
+    if size is None or size < 0:
+      size = self.size - self.position
+    size = min(size, self.size - self.position)
+    if size <= 0:
+      return b""
+
+    offset = self.position
+    if offset >= self.tail_offset:
+      data = self.tail[offset - self.tail_offset:offset - self.tail_offset + size]
+    elif size >= self.block_size:
+      data = self.fetchCounted(offset, size)
+    else:
+      chunks = []
+      end = offset + size
+      while offset < end:
+        index = offset // self.block_size
+        start = offset - index * self.block_size
+        chunk = self.block(index)[start:start + end - offset]
+        if not chunk:
+          break
+        chunks.append(chunk)
+        offset += len(chunk)
+      data = b"".join(chunks)
+
+    self.position += len(data)
+    return data
+
+  def readinto(self, buffer):
+    data = self.read(len(buffer))
+    buffer[:len(data)] = data
+    return len(data)
+
+class RemoteHTTPFile(RemoteFile):
+  """
+  A file behind an HTTP server that supports range requests, like the presigned
+  cloud storage URLs of cloud prints. Raises RangeNotSupported if the server
+  answers with the whole file instead.
+  """
+
+  def __init__(self, url, timeout=10, **kwargs):
+    self.url = url
+    self.timeout = timeout
+    self.session = requests.Session()
+    # Offsets are into the file as stored, not a compressed transfer of it
+    self.session.headers["Accept-Encoding"] = "identity"
+
+    try:
+      response = self.get(f"bytes=-{TAIL_SIZE}")
+    except Exception:
+      self.session.close()
+      raise
+
+    super().__init__(int(response.headers["Content-Range"].rsplit("/", 1)[1]), **kwargs)
+    self.requests = 1
+    self.bytes_fetched = len(response.content)
+    self.setTail(response.content)
+
+  def get(self, byte_range):
+    response = self.session.get(self.url, headers={"Range": byte_range}, stream=True, timeout=self.timeout)
+    response.raise_for_status()
+    if response.status_code != 206 or "Content-Range" not in response.headers:
+      response.close()
+      raise RangeNotSupported(f"server answered a range request with {response.status_code}")
+    return response
+
+  def fetch(self, offset, length):
+    return self.get(f"bytes={offset}-{offset + length - 1}").content
+
+  def close(self):
+    self.session.close()
+    super().close()
+
+class RemoteFTPFile(RemoteFile):
+  """A file on the printer's SD card, read with REST offsets over a PrinterFTPSession."""
+
+  def __init__(self, session, remote_path, **kwargs):
+    self.session = session
+    self.remote_path = remote_path
+    super().__init__(session.size(remote_path), **kwargs)
+
+    tail_offset = max(self.size - TAIL_SIZE, 0)
+    self.setTail(self.fetchCounted(tail_offset, self.size - tail_offset))
+
+  def fetch(self, offset, length):
+    return self.session.read(self.remote_path, offset, length)
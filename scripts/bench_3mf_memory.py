@@ -0,0 +1,80 @@
+"""
+Reports the peak RSS of getMetaDataFrom3mf for a large synthetic 3MF, fetched
+from a local HTTP server and from the local filesystem, with the old
+read-everything-into-memory downloads and with the streaming ones.
+
+Usage: python scripts/bench_3mf_memory.py [model_mb] [gcode_mb]
+"""
+import functools
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+class QuietHandler(SimpleHTTPRequestHandler):
+  def log_message(self, format, *args):
+    pass
+
+def peak_rss_mb():
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run(url, implementation):
+  """Child process: one getMetaDataFrom3mf call, prints baseline and peak RSS."""
+  import requests
+  import tools_3mf
+
+  if implementation == "in-memory":
+    def download3mfFromCloud(url, destFile):
+      response = requests.get(url)
+      response.raise_for_status()
+      destFile.write(response.content)
+
+    def download3mfFromLocalFilesystem(path, destFile):
+      with open(path, "rb") as src_file:
+        destFile.write(src_file.read())
+
+    tools_3mf.download3mfFromCloud = download3mfFromCloud
+    tools_3mf.download3mfFromLocalFilesystem = download3mfFromLocalFilesystem
+
+  baseline = peak_rss_mb()
+  metadata = tools_3mf.getMetaDataFrom3mf(url)
+  assert metadata.get("filaments"), "no metadata parsed"
+  print(f"{baseline:.1f} {peak_rss_mb():.1f}")
+
+def main():
+  if len(sys.argv) > 1 and sys.argv[1] == "--child":
+    return run(sys.argv[2], sys.argv[3])
+
+  model_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+  gcode_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+  from fixture_3mf import build_3mf
+
+  workdir = tempfile.mkdtemp()
+  os.makedirs(os.path.join(workdir, "static", "prints"))
+  os.makedirs(os.path.join(workdir, "data"))
+  path = build_3mf(os.path.join(workdir, "bench.gcode.3mf"), model_mb * 1024 * 1024, gcode_mb * 1024 * 1024)
+  print(f"3MF size: {os.path.getsize(path) / 1024 / 1024:.0f} MB")
+
+  handler = functools.partial(QuietHandler, directory=workdir)
+  server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  http_url = f"http://127.0.0.1:{server.server_address[1]}/bench.gcode.3mf"
+
+  for source, url in (("http", http_url), ("local", f"local:{path}")):
+    for implementation in ("in-memory", "streaming"):
+      output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", url, implementation],
+                              cwd=workdir, capture_output=True, text=True, check=True).stdout
+      baseline, peak = map(float, output.strip().splitlines()[-1].split())
+      print(f"{source:<6} {implementation:<10} peak RSS {peak:8.1f} MB  (+{peak - baseline:.1f} MB over baseline)")
+
+  server.shutdown()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,81 @@
+"""
+Compares get_filament_order against the previous line-by-line implementation on
+synthetic plate gcode, both as a plain file and as a member of a 3MF archive.
+
+Usage: python scripts/bench_filament_order.py [gcode_mb]
+"""
+import os
+import re
+import sys
+import tempfile
+import time
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fixture_3mf import write_gcode
+from tools_3mf import get_filament_order
+
+SWITCHES = (0, 1, 2, 0, 3, 1, 255, 2, 4)
+
+def get_filament_order_lines(file):
+  """The implementation this replaces: decode, strip and regex match every line."""
+  filament_order = {}
+  switch_count = 0
+
+  for line in file:
+    match_filament = re.match(r"^M620 S(\d+)[^;\r\n]*$", line.decode("utf-8").strip())
+    if match_filament:
+      filament = int(match_filament.group(1))
+      if filament not in filament_order and int(filament) != 255:
+        filament_order[int(filament)] = switch_count
+      switch_count += 1
+
+  if len(filament_order) == 0:
+    filament_order = {1:0}
+
+  return filament_order
+
+def timed(implementation, open_file):
+  with open_file() as f:
+    start = time.perf_counter()
+    result = implementation(f)
+    return result, time.perf_counter() - start
+
+def main():
+  gcode_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+  size = gcode_mb * 1024 * 1024
+
+  workdir = tempfile.mkdtemp()
+  gcode_path = os.path.join(workdir, "plate_1.gcode")
+  archive_path = os.path.join(workdir, "print.3mf")
+
+  with open(gcode_path, "wb") as f:
+    write_gcode(f, size, SWITCHES)
+  with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as z:
+    z.write(gcode_path, "Metadata/plate_1.gcode")
+
+  def open_plain():
+    return open(gcode_path, "rb")
+
+  def open_member():
+    z = zipfile.ZipFile(archive_path)
+    member = z.open("Metadata/plate_1.gcode")
+    member.close = lambda close=member.close: (close(), z.close())
+    return member
+
+  print(f"{os.path.getsize(gcode_path) / 1024 / 1024:.0f} MB of gcode, {len(SWITCHES)} filament changes")
+  for source, open_file in (("file", open_plain), ("3mf member", open_member)):
+    expected, old_time = timed(get_filament_order_lines, open_file)
+    result, new_time = timed(get_filament_order, open_file)
+    assert result == expected, f"{result} != {expected}"
+    print(f"{source:>10}: lines {old_time:6.2f}s  scan {new_time:6.2f}s  "
+          f"({old_time / new_time:.1f}x)  {result}")
+
+  os.remove(gcode_path)
+  os.remove(archive_path)
+  os.rmdir(workdir)
+
+if __name__ == "__main__":
+  main()
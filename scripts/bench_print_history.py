@@ -0,0 +1,120 @@
+"""
+Loads a print history database with many prints and times the print_history
+queries, the whole history and single pages of it. They are compared with the
+queries as they were before (a new connection per call and no indexes), which
+only finish in reasonable time on a slice of the data.
+
+Usage: python scripts/bench_print_history.py [prints]
+"""
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+workdir = tempfile.mkdtemp()
+os.makedirs(os.path.join(workdir, "data"))
+os.chdir(workdir)
+
+import print_history
+
+OLD_SLICE = 5000
+
+OLD_PRINTS_WITH_FILAMENT = '''
+    SELECT p.id AS id, p.print_date AS print_date, p.file_name AS file_name,
+           p.print_type AS print_type, p.image_file AS image_file,
+           (
+               SELECT json_group_array(json_object(
+                   'spool_id', f.spool_id,
+                   'filament_type', f.filament_type,
+                   'color', f.color,
+                   'grams_used', f.grams_used,
+                   'ams_slot', f.ams_slot
+               )) FROM filament_usage f WHERE f.print_id = p.id
+           ) AS filament_info
+    FROM prints p
+    ORDER BY p.print_date DESC
+'''
+
+def old_query(db_path, query, params=()):
+  conn = sqlite3.connect(db_path)
+  conn.row_factory = sqlite3.Row
+  rows = [dict(row) for row in conn.execute(query, params).fetchall()]
+  conn.close()
+  return rows
+
+def without_cost(rows):
+  # The old query predates the cost stored with each filament usage
+  return sorted((row["id"], [{key: value for key, value in filament.items() if key != "cost"} for filament in json.loads(row["filament_info"])]) for row in rows)
+
+def timed(label, function, repeat=1):
+  start = time.perf_counter()
+  for _ in range(repeat):
+    result = function()
+  elapsed = (time.perf_counter() - start) / repeat
+  print(f"{label:>42}: {elapsed * 1000:9.2f} ms")
+  return result
+
+def load(count):
+  random.seed(1)
+  conn = print_history.get_connection()
+  start = time.perf_counter()
+  for number in range(count):
+    print_date = f"2024-{number % 12 + 1:02d}-{number % 28 + 1:02d} {number % 24:02d}:{number % 60:02d}:{number % 59:02d}"
+    filaments = {slot: {"type": random.choice(("PLA", "PETG", "ABS")), "color": "#FFFFFF", "used_g": round(random.uniform(1, 80), 2)}
+                 for slot in range(1, random.randint(1, 4) + 1)}
+    print_id = print_history.record_print(f"plate_{number % 500}.3mf", random.choice(("local", "cloud")), f"{number % 500:064x}.png", filaments, print_date)
+    print_history.assign_spools(print_id, [(slot, random.randint(1, 300), None) for slot in filaments if random.random() < 0.8])
+  conn.commit()
+  elapsed = time.perf_counter() - start
+  print(f"loaded {count} prints in {elapsed:.1f}s ({count / elapsed:.0f} prints/s with their filament rows)")
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+  db_path = print_history.db_config["db_path"]
+  load(count)
+
+  # Without indexes the old queries scan filament_usage once per print, they only
+  # finish in reasonable time for a slice of the history
+  old_path = os.path.join(workdir, "data", "old.db")
+  print_history.get_connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+  shutil.copyfile(db_path, old_path)
+  conn = sqlite3.connect(old_path)
+  conn.execute("PRAGMA journal_mode=DELETE")
+  for index in ("idx_prints_print_date", "idx_filament_usage_print_id", "idx_filament_usage_spool_id"):
+    conn.execute(f"DROP INDEX {index}")
+  conn.execute("DELETE FROM filament_usage WHERE print_id > ?", (OLD_SLICE,))
+  conn.execute("DELETE FROM prints WHERE id > ?", (OLD_SLICE,))
+  conn.commit()
+  conn.execute("VACUUM")
+  conn.close()
+
+  new = timed("get_prints_with_filament", print_history.get_prints_with_filament)
+  old = timed("before, with the indexes", lambda: old_query(db_path, OLD_PRINTS_WITH_FILAMENT))
+  assert without_cost(new) == without_cost(old)
+  timed(f"before, {OLD_SLICE} prints", lambda: old_query(old_path, OLD_PRINTS_WITH_FILAMENT))
+
+  timed("first page of 50", lambda: print_history.get_prints_with_filament(limit=50), repeat=20)
+  middle = new[len(new) // 2]
+  timed("page of 50 in the middle", lambda: print_history.get_prints_with_filament(limit=50, before=(middle["print_date"], middle["id"])), repeat=20)
+
+  timed("get_prints_by_spool", lambda: print_history.get_prints_by_spool(42), repeat=20)
+  timed(f"before, {OLD_SLICE} prints", lambda: old_query(old_path, '''
+      SELECT DISTINCT p.* FROM prints p
+      JOIN filament_usage f ON p.id = f.print_id
+      WHERE f.spool_id = ?''', (42,)), repeat=20)
+
+  print_ids = [random.randint(1, OLD_SLICE) for _ in range(1000)]
+  timed("get_filament_for_slot x1000", lambda: [print_history.get_filament_for_slot(print_id, 1) for print_id in print_ids])
+  timed(f"before, {OLD_SLICE} prints", lambda: [old_query(old_path, "SELECT * FROM filament_usage WHERE print_id = ? AND ams_slot = ?", (print_id, 1)) for print_id in print_ids])
+
+  shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+  main()
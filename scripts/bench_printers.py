@@ -0,0 +1,107 @@
+"""
+Runs several printers in one process against the in-process fake MQTT broker
+and checks that their sessions stay apart: each printer gets its own MQTT
+connection, state machine and AMS trays, all over the one shared spool cache.
+
+Every printer is sent its synthetic log of fake_printer.py on its report topic,
+interleaved with the other printers. Reports the end-to-end message rate and
+checks each printer's spend ledger against what its log should have spent.
+A small queue size makes the printers stop reading their sockets while their
+reports are handled. At the end the broker drops all connections and every
+printer has to reconnect.
+
+Usage: python scripts/bench_printers.py [printers] [prints] [queue size]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PRINTER_ID", "01P00A000000000")
+os.environ.setdefault("SPOOLMAN_BASE_URL", "http://127.0.0.1:9")
+workdir = tempfile.mkdtemp()
+os.chdir(workdir)
+os.makedirs("data")
+
+from fake_mqtt_broker import FakeMqttBroker
+from fake_printer import InMemorySpoolman, InMemoryPrintHistory, ImmediateExecutor, assignTrays, fakeMetadata, synthetic_log, expected_ledger
+from fake_spoolman import make_spools
+import mqtt_bambulab
+import spoolman_client
+import spoolman_service
+
+FILAMENTS = 2
+
+def wait_for(condition, timeout=30):
+  deadline = time.monotonic() + timeout
+  while not condition():
+    if time.monotonic() > deadline:
+      raise TimeoutError("printers did not catch up")
+    time.sleep(0.01)
+
+def main():
+  printer_count = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+  prints = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+  mqtt_bambulab.MQTT_QUEUE_SIZE = int(sys.argv[3]) if len(sys.argv) > 3 else mqtt_bambulab.MQTT_QUEUE_SIZE
+
+  broker = FakeMqttBroker().start()
+  printer_ids = [f"01P00A{number:09d}" for number in range(printer_count)]
+
+  spoolman = InMemorySpoolman(assignTrays(make_spools(4 * printer_count + 20), printer_ids))
+  history = InMemoryPrintHistory()
+  spoolman_client.SPOOLMAN_CLIENT = spoolman
+  spoolman_service.assign_spools = history.assign_spools
+  spoolman_service.SPOOL_CACHE_LIVE = True
+
+  mqtt_bambulab.AUTO_SPEND = True
+  mqtt_bambulab.METADATA_EXECUTOR = ImmediateExecutor()
+  mqtt_bambulab.getMetaDataFrom3mf = fakeMetadata(FILAMENTS)
+  mqtt_bambulab.record_print = history.record_print
+  mqtt_bambulab.MQTT_RECONNECT_DELAY = 0.1
+
+  mqtt_bambulab.PRINTERS.clear()
+  for printer_id in printer_ids:
+    mqtt_bambulab.registerPrinter(printer_id, "127.0.0.1", "12345678", f"Printer {printer_id[-2:]}", port=broker.port, tls=False,
+                                  log_path=os.path.join(workdir, "logs", printer_id, "mqtt.log"))
+
+  start = time.perf_counter()
+  mqtt_bambulab.init_mqtt()
+  wait_for(lambda: all(printer.connected for printer in mqtt_bambulab.getPrinters()))
+  wait_for(lambda: all(broker.subscribers(f"device/{printer_id}/report") for printer_id in printer_ids))
+  threads = [thread for thread in threading.enumerate() if "process_request" not in thread.name and "serve_forever" not in thread.name]
+  print(f"{printer_count} printers connected in {time.perf_counter() - start:.2f}s, {len(threads)} threads besides the broker's")
+
+  requests = {topic for topic, _ in broker.messages}
+  assert requests == {f"device/{printer_id}/request" for printer_id in printer_ids}, "every printer asks its own printer for a full report"
+
+  logs = [synthetic_log(prints, FILAMENTS, index) for index in range(printer_count)]
+  start = time.perf_counter()
+  for lines in zip(*logs):
+    for printer_id, line in zip(printer_ids, lines):
+      broker.publish(f"device/{printer_id}/report", line)
+  wait_for(lambda: all(printer.state.reports == len(logs[0]) for printer in mqtt_bambulab.getPrinters()))
+  elapsed = time.perf_counter() - start
+
+  total = len(logs[0]) * printer_count
+  print(f"{total} reports processed in {elapsed:.2f}s ({total / elapsed:.0f} reports/s)")
+  print(f"prints recorded: {len(history.prints)}, SpoolMan requests: {spoolman.requests}")
+
+  for index, printer in enumerate(mqtt_bambulab.getPrinters()):
+    ledger = {spool_id: grams for spool_id, grams in spoolman.ledger.items() if 4 * index < spool_id <= 4 * index + 4}
+    assert ledger == expected_ledger(prints, FILAMENTS, index), f"{printer.id}: {ledger}"
+    assert not printer.pending_print_metadata, f"{printer.id} has a print left over"
+    assert len(printer.last_ams_config["ams"]) == 1
+  print("every printer spent its own trays' spools")
+
+  start = time.perf_counter()
+  broker.disconnectClients()
+  wait_for(lambda: all(printer.connects == 2 and printer.connected for printer in mqtt_bambulab.getPrinters()))
+  print(f"{printer_count} printers reconnected in {time.perf_counter() - start:.2f}s")
+
+  broker.stop()
+  os._exit(0)  # the printers' MQTT threads run forever
+
+if __name__ == "__main__":
+  main()
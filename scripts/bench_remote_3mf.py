@@ -0,0 +1,137 @@
+"""
+Compares reading a 3MF in place with range requests against downloading all of
+it, for a synthetic 3MF served by a local HTTP server. Also checks that both
+give the same metadata and that a server without range support falls back to
+the full download.
+
+Usage: python scripts/bench_remote_3mf.py [model_mb] [gcode_mb]
+"""
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+class QuietHandler(SimpleHTTPRequestHandler):
+  """Serves whole files only, like a server without range support."""
+  requests_served = 0
+  bytes_served = 0
+
+  def log_message(self, format, *args):
+    pass
+
+  def copyfile(self, source, outputfile):
+    QuietHandler.requests_served += 1
+    try:
+      while chunk := source.read(1024 * 1024):
+        outputfile.write(chunk)
+        QuietHandler.bytes_served += len(chunk)
+    except (BrokenPipeError, ConnectionResetError):
+      pass  # the client stopped reading a full file answer to its range request
+
+class RangeHandler(QuietHandler):
+  """Answers single byte ranges with 206, like cloud object storage."""
+
+  def send_head(self):
+    match = RANGE.match(self.headers.get("Range", ""))
+    path = self.translate_path(self.path)
+    if not match or not os.path.isfile(path):
+      return super().send_head()
+
+    size = os.path.getsize(path)
+    if match.group(1):
+      start = int(match.group(1))
+      end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    else:
+      start = max(size - int(match.group(2)), 0)
+      end = size - 1
+
+    f = open(path, "rb")
+    f.seek(start)
+    self.send_response(206)
+    self.send_header("Content-Type", "application/octet-stream")
+    self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+    self.send_header("Content-Length", str(end - start + 1))
+    self.end_headers()
+    return LimitedFile(f, end - start + 1)
+
+class LimitedFile:
+  def __init__(self, f, length):
+    self.f = f
+    self.remaining = length
+
+  def read(self, size):
+    data = self.f.read(min(size, self.remaining))
+    self.remaining -= len(data)
+    return data
+
+  def close(self):
+    self.f.close()
+
+def serve(handler, directory):
+  server = ThreadingHTTPServer(("127.0.0.1", 0), lambda *args: handler(*args, directory=directory))
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  return server
+
+def measure(tools_3mf, url, filament_order, remote):
+  tools_3mf.REMOTE_3MF = remote
+  QuietHandler.requests_served = 0
+  QuietHandler.bytes_served = 0
+  start = time.perf_counter()
+  metadata = tools_3mf.getMetaDataFrom3mf(url, filament_order=filament_order)
+  elapsed = time.perf_counter() - start
+  assert metadata.get("filaments"), "no metadata parsed"
+  return metadata, elapsed, QuietHandler.requests_served, QuietHandler.bytes_served
+
+def main():
+  model_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+  gcode_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+  from fixture_3mf import build_3mf
+
+  workdir = tempfile.mkdtemp()
+  os.makedirs(os.path.join(workdir, "static", "prints"))
+  os.chdir(workdir)
+  build_3mf(os.path.join(workdir, "print.3mf"), model_mb * 1024 * 1024, gcode_mb * 1024 * 1024)
+
+  import tools_3mf
+  from metadata_cache import METADATA_CACHE
+  METADATA_CACHE.max_bytes = 0
+  tools_3mf.PRINTS_DIR = os.path.join(workdir, "static", "prints")
+
+  range_server = serve(RangeHandler, workdir)
+  plain_server = serve(QuietHandler, workdir)
+  range_url = f"http://127.0.0.1:{range_server.server_port}/print.3mf"
+  plain_url = f"http://127.0.0.1:{plain_server.server_port}/print.3mf"
+
+  size = os.path.getsize(os.path.join(workdir, "print.3mf"))
+  print(f"3MF of {size / 1024 / 1024:.0f} MB ({model_mb} MB model, {gcode_mb} MB gcode)")
+
+  results = {}
+  for label, url, filament_order, remote in (
+      ("cloud, full download", range_url, False, False),
+      ("cloud, in place", range_url, False, True),
+      ("local, full download", range_url, True, False),
+      ("local, in place", range_url, True, True),
+      ("no range support", plain_url, True, True)):
+    metadata, elapsed, requests_served, bytes_served = measure(tools_3mf, url, filament_order, remote)
+    results[label] = metadata
+    print(f"{label:>21}: {bytes_served / 1024 / 1024:8.2f} MB in {requests_served:3d} requests, {elapsed:6.2f}s")
+
+  for label, metadata in results.items():
+    expected = results["local, full download"] if "filamentOrder" in metadata else results["cloud, full download"]
+    assert metadata == expected, f"{label}: {metadata} != {expected}"
+  print("metadata identical")
+
+  range_server.shutdown()
+  plain_server.shutdown()
+
+if __name__ == "__main__":
+  main()
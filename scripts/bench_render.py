@@ -0,0 +1,77 @@
+"""
+Times the server side rendering of the spool list pages (/fill and
+/assign_tag) and the tray cards of the index page with many spools in the
+spool cache. Every page is timed with the fragment cache cleared before each
+request (what a change of a spool or a tray costs) and with the cached
+fragments reused (what reloads and dashboards cost until something changes).
+
+SpoolMan is replaced by an in-memory spool list and the printer by an AMS
+report, so nothing leaves the process.
+
+Usage: python scripts/bench_render.py [spools] [requests]
+"""
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PRINTER_ID", "01P00A000000000")
+os.environ.setdefault("PRINTER_IP", "127.0.0.1")
+os.environ.setdefault("SPOOLMAN_BASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("AUTO_SPEND", "True")
+workdir = tempfile.mkdtemp()
+os.chdir(workdir)
+os.makedirs("data")
+
+from fake_printer import InMemorySpoolman, assignTrays, synthetic_log
+from fake_spoolman import make_spools
+import mqtt_bambulab
+import spoolman_client
+import spoolman_service
+
+PAGES = ["/fill?ams=0&tray=1", "/assign_tag", "/"]
+
+def timed(client, url, count, cold):
+  import app
+  timings = []
+  for _ in range(count):
+    if cold:
+      app.FRAGMENT_CACHE.clear()
+    start = time.perf_counter()
+    response = client.get(url)
+    timings.append(time.perf_counter() - start)
+    assert response.status_code == 200, url
+  return timings, len(response.data)
+
+def main():
+  spool_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+  count = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+  printer_id = os.environ["PRINTER_ID"]
+  spoolman_client.SPOOLMAN_CLIENT = InMemorySpoolman(assignTrays(make_spools(spool_count), [printer_id]))
+  spoolman_service.SPOOL_CACHE_LIVE = True
+
+  import app
+  printer = mqtt_bambulab.getPrinter()
+  printer.connected = True
+  report = json.loads(synthetic_log(1, 1)[0])
+  for tray in report["print"]["ams"]["ams"][0]["tray"]:
+    tray["tray_type"] = "PLA"
+  mqtt_bambulab.handleMessage(printer, json.dumps(report).encode())
+
+  client = app.app.test_client()
+  print(f"{spool_count} spools, {count} requests per page")
+  print(f"{'page':>20} {'uncached p50':>14} {'cached p50':>12} {'cached p99':>12} {'size':>10}")
+  for url in PAGES:
+    cold, size = timed(client, url, count, cold=True)
+    warm, _ = timed(client, url, count, cold=False)
+    print(f"{url:>20} {statistics.median(cold) * 1000:11.2f} ms {statistics.median(warm) * 1000:9.2f} ms "
+          f"{sorted(warm)[int(len(warm) * 0.99) - 1] * 1000:9.2f} ms {size / 1024:7.0f} KiB")
+
+  os._exit(0)  # init_mqtt() started the printer's connection thread
+
+if __name__ == "__main__":
+  main()
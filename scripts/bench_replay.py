@@ -0,0 +1,195 @@
+"""
+Replays MQTT reports through the spending state machine and measures it.
+
+The reports come from the logs handleMessage writes (mqtt.log and its
+rotated mqtt_<date>_<time>.log files, also gzipped), or from a synthetic log of
+cloud and local prints. They are fed to handleMessage (or processMessage with
+--direct) with SpoolMan, the 3MF metadata fetcher and the print history replaced
+by in-memory fakes, so nothing leaves the process and the run is repeatable.
+
+Reports messages/s, p50/p99 handler latency, the memory a message allocates
+(tracemalloc peak, in a second pass) and the final spend ledger. The ledger can
+be saved with --save-ledger and compared on later runs with --expect-ledger.
+
+Usage: python scripts/bench_replay.py [--direct] [--filaments N] [--synthetic PRINTS]
+                                      [--save-ledger FILE] [--expect-ledger FILE] [log or log directory ...]
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("PRINTER_ID", "01P00A000000000")
+os.environ.setdefault("SPOOLMAN_BASE_URL", "http://127.0.0.1:9")
+workdir = tempfile.mkdtemp()
+os.chdir(workdir)
+os.makedirs("data")
+os.makedirs(os.path.join("static", "prints"))
+
+from fake_printer import InMemorySpoolman, InMemoryPrintHistory, ImmediateExecutor, fakeMetadata, synthetic_log
+from fake_spoolman import make_spools
+import mqtt_bambulab
+import spoolman_client
+import spoolman_service
+
+LOG_LINE = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} :: ")
+ROTATED_LOG = re.compile(r"^(.+)_(\d{8}_\d{6})\.log(\.gz)?$")
+
+class DiscardOutput:
+  """Swallows the handlers' print output, counting the tracebacks handleMessage prints."""
+
+  def __init__(self):
+    self.tracebacks = 0
+
+  def write(self, text):
+    if text.startswith("Traceback"):
+      self.tracebacks += 1
+    return len(text)
+
+  def flush(self):
+    pass
+
+def log_files(paths):
+  """The given logs, with directories expanded to their MQTT logs, oldest rotation first."""
+  files = []
+  for path in paths:
+    if not os.path.isdir(path):
+      files.append(path)
+      continue
+
+    rotated = sorted(name for name in os.listdir(path) if ROTATED_LOG.match(name))
+    files.extend(os.path.join(path, name) for name in rotated)
+    for name in ("mqtt.log", "mqtt.log.gz"):
+      if os.path.exists(os.path.join(path, name)):
+        files.append(os.path.join(path, name))
+  return files
+
+def read_log(path):
+  opener = gzip.open if path.endswith(".gz") else open
+  with opener(path, "rt", encoding="utf-8") as file:
+    for line in file:
+      line = LOG_LINE.sub("", line.strip())
+      if line.startswith("{"):
+        yield line
+
+def reset(filament_count, spool_count):
+  """Fresh printer, spool cache and fakes, so every pass replays from the same start."""
+  spoolman = InMemorySpoolman(make_spools(spool_count, os.environ["PRINTER_ID"]))
+  history = InMemoryPrintHistory()
+
+  spoolman_client.SPOOLMAN_CLIENT = spoolman
+  spoolman_service.assign_spools = history.assign_spools
+  spoolman_service.SPOOLS = []
+  spoolman_service.SPOOL_CACHE_LIVE = True  # no background refreshes while replaying
+
+  mqtt_bambulab.AUTO_SPEND = True
+  mqtt_bambulab.PENDING_TRAY_RECONCILIATION.clear()
+  mqtt_bambulab.METADATA_EXECUTOR = ImmediateExecutor()
+  mqtt_bambulab.getMetaDataFrom3mf = fakeMetadata(filament_count)
+  mqtt_bambulab.record_print = history.record_print
+
+  # handleMessage logs every report, into the temporary directory instead of /home/app/logs
+  mqtt_bambulab.PRINTERS.clear()
+  mqtt_bambulab.registerPrinter(os.environ["PRINTER_ID"], "127.0.0.1", "", log_path=os.path.join(workdir, "logs", "mqtt.log"))
+  return spoolman, history
+
+def handler(direct):
+  if direct:
+    return lambda payload: mqtt_bambulab.processMessage(json.loads(payload))
+
+  def handleMessage(payload):
+    mqtt_bambulab.handleMessage(mqtt_bambulab.getPrinter(), payload.encode())
+  return handleMessage
+
+def replay(payloads, handle, output, trace=False):
+  latencies = []
+  allocated = []
+  stdout, stderr = sys.stdout, sys.stderr
+  sys.stdout = sys.stderr = output
+  try:
+    for payload in payloads:
+      if trace:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+      start = time.perf_counter()
+      try:
+        handle(payload)
+      except Exception:
+        output.tracebacks += 1
+      latencies.append(time.perf_counter() - start)
+      if trace:
+        allocated.append(tracemalloc.get_traced_memory()[1] - before)
+  finally:
+    sys.stdout, sys.stderr = stdout, stderr
+  return latencies, allocated
+
+def percentile(values, fraction):
+  values = sorted(values)
+  return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("logs", nargs="*", help="MQTT logs or directories with them, a synthetic log if none")
+  parser.add_argument("--direct", action="store_true", help="call processMessage instead of handleMessage")
+  parser.add_argument("--synthetic", type=int, default=200, help="prints in the synthetic log")
+  parser.add_argument("--filaments", type=int, default=2, help="filaments per print in the fake 3MF metadata")
+  parser.add_argument("--spools", type=int, default=400, help="spools in the fake SpoolMan")
+  parser.add_argument("--save-ledger", help="write the spend ledger to this JSON file")
+  parser.add_argument("--expect-ledger", help="fail unless the spend ledger equals this JSON file")
+  args = parser.parse_args()
+
+  if args.logs:
+    files = log_files(args.logs)
+    payloads = [payload for path in files for payload in read_log(path)]
+    source = f"{len(files)} log files"
+  else:
+    payloads = synthetic_log(args.synthetic, args.filaments)
+    source = f"synthetic log of {args.synthetic} prints"
+
+  handle = handler(args.direct)
+  spoolman, history = reset(args.filaments, args.spools)
+  output = DiscardOutput()
+  start = time.perf_counter()
+  latencies, _ = replay(payloads, handle, output)
+  elapsed = time.perf_counter() - start
+  ledger = {str(spool_id): round(grams, 3) for spool_id, grams in sorted(spoolman.ledger.items())}
+
+  reset(args.filaments, args.spools)
+  tracemalloc.start()
+  _, allocated = replay(payloads, handle, DiscardOutput(), trace=True)
+  tracemalloc.stop()
+
+  print(f"{len(payloads)} messages from {source} through {'processMessage' if args.direct else 'handleMessage'}")
+  print(f"messages/s:          {len(payloads) / elapsed:10.0f}")
+  print(f"latency p50:         {percentile(latencies, 0.5) * 1e6:10.1f} us")
+  print(f"latency p99:         {percentile(latencies, 0.99) * 1e6:10.1f} us")
+  print(f"latency max:         {max(latencies) * 1e6:10.1f} us")
+  print(f"allocated/message:   {sum(allocated) / len(allocated) / 1024:10.1f} KiB mean, {percentile(allocated, 0.99) / 1024:.1f} KiB p99 (tracemalloc peak)")
+  print(f"handler errors:      {output.tracebacks:10d}")
+  print(f"prints recorded:     {len(history.prints):10d}")
+  print(f"spool assignments:   {len(history.assignments):10d}")
+  print(f"SpoolMan requests:   {spoolman.requests:10d}")
+  print("spend ledger (spool id: grams):")
+  for spool_id, grams in ledger.items():
+    print(f"  {spool_id:>6}: {grams:10.3f}")
+
+  if args.save_ledger:
+    with open(args.save_ledger, "w", encoding="utf-8") as file:
+      json.dump(ledger, file, indent=2)
+
+  if args.expect_ledger:
+    with open(args.expect_ledger, encoding="utf-8") as file:
+      expected = json.load(file)
+    if ledger != expected:
+      print(f"spend ledger differs from {args.expect_ledger}: expected {expected}")
+      sys.exit(1)
+    print(f"spend ledger matches {args.expect_ledger}")
+
+if __name__ == "__main__":
+  main()
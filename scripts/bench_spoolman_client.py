@@ -0,0 +1,48 @@
+"""
+Measures SpoolMan requests per second against a local stub server, comparing
+one bare requests call per operation with the pooled SpoolmanClient.
+
+Usage: python scripts/bench_spoolman_client.py [requests] [spools]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from fake_spoolman import FakeSpoolman, make_spools
+from spoolman_client import SpoolmanClient
+
+def measure(label, count, call):
+  start = time.perf_counter()
+  for i in range(count):
+    call(i)
+  elapsed = time.perf_counter() - start
+  print(f"{label:<40} {count / elapsed:10.1f} req/s  ({elapsed * 1000 / count:.2f} ms/req)")
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+  spool_count = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+
+  fake = FakeSpoolman(make_spools(spool_count)).start()
+  api_url = fake.api_url
+  client = SpoolmanClient(api_url=api_url)
+
+  try:
+    measure("GET /spool/<id>, bare requests", count,
+            lambda i: requests.get(f"{api_url}/spool/{i % spool_count + 1}").json())
+    measure("GET /spool/<id>, SpoolmanClient", count,
+            lambda i: client.getSpoolById(i % spool_count + 1))
+
+    list_count = max(count // 20, 1)
+    measure(f"GET /spool ({spool_count} spools), bare requests", list_count,
+            lambda i: requests.get(f"{api_url}/spool", headers={"Accept-Encoding": "identity"}).json())
+    measure(f"GET /spool ({spool_count} spools), SpoolmanClient", list_count,
+            lambda i: client.fetchSpoolList())
+  finally:
+    fake.stop()
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,72 @@
+"""
+Drives the SpoolMan change feed listener against the local fake SpoolMan and
+reports how fast websocket events reach the spool cache, and how many REST
+requests the cache needed meanwhile.
+
+Usage: python scripts/bench_spoolman_events.py [events] [spools]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp())
+os.makedirs("data")
+
+from fake_spoolman import FakeSpoolman, make_spools
+import spoolman_client
+import spoolman_service
+from spoolman_events import SpoolmanEventListener, websocketUrl
+
+def wait_for(condition, timeout=5):
+  deadline = time.monotonic() + timeout
+  while not condition():
+    if time.monotonic() > deadline:
+      raise TimeoutError("cache did not catch up")
+    time.sleep(0.0005)
+
+def main():
+  count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+  spool_count = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+
+  fake = FakeSpoolman(make_spools(spool_count)).start()
+  spoolman_client.SPOOLMAN_CLIENT = spoolman_client.SpoolmanClient(api_url=fake.api_url)
+
+  listener = SpoolmanEventListener(websocketUrl(fake.base_url), reconnect_delay=0.1)
+  listener.start()
+  wait_for(lambda: listener.connected)
+  requests_before = fake.requests
+
+  latencies = []
+  for i in range(count):
+    spool = dict(fake.spools[i % spool_count + 1])
+    spool["remaining_weight"] = float(i)
+    sent = time.perf_counter()
+    fake.broadcast("updated", "spool", spool)
+    wait_for(lambda: spoolman_service.SPOOL_INDEX.get(spool["id"])["remaining_weight"] == float(i))
+    latencies.append(time.perf_counter() - sent)
+
+  new_spool = make_spools(spool_count + 1)[-1]
+  fake.broadcast("added", "spool", new_spool)
+  wait_for(lambda: spoolman_service.SPOOL_INDEX.get(new_spool["id"]) is not None)
+  fake.broadcast("deleted", "spool", new_spool)
+  wait_for(lambda: spoolman_service.SPOOL_INDEX.get(new_spool["id"]) is None)
+
+  # Dropping the feed falls back to polling, reconnecting resynchronises
+  fake.disconnect_websockets()
+  wait_for(lambda: not listener.connected)
+  wait_for(lambda: listener.connected)
+
+  latencies.sort()
+  print(f"events applied:          {listener.events}")
+  print(f"event -> cache p50:      {latencies[len(latencies) // 2] * 1000:.3f} ms")
+  print(f"event -> cache p99:      {latencies[int(len(latencies) * 0.99)] * 1000:.3f} ms")
+  print(f"REST requests meanwhile: {fake.requests - requests_before} (one resync after the reconnect)")
+  print(f"cache version:           {spoolman_service.getSpoolCacheVersion()}")
+
+  listener.stop()
+  fake.stop()
+
+if __name__ == "__main__":
+  main()
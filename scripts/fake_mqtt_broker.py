@@ -0,0 +1,161 @@
+"""
+Minimal in-process MQTT 3.1.1 broker standing in for the printers' MQTT servers
+(or a local Mosquitto) in the benchmark scripts.
+
+Plain TCP, QoS 0 only: CONNECT, SUBSCRIBE with + and # wildcards, PUBLISH,
+PINGREQ and DISCONNECT. publish() sends a message to the subscribed clients the
+way a printer sends its reports, messages clients publish are kept in messages.
+disconnectClients() drops all connections to test reconnecting.
+"""
+import socket
+import socketserver
+import struct
+import threading
+
+def topicMatches(topic_filter, topic):
+  filter_levels = topic_filter.split("/")
+  levels = topic.split("/")
+  for index, level in enumerate(filter_levels):
+    if level == "#":
+      return True
+    if index >= len(levels) or (level != "+" and level != levels[index]):
+      return False
+  return len(filter_levels) == len(levels)
+
+def encodeLength(length):
+  encoded = bytearray()
+  while True:
+    byte = length % 128
+    length //= 128
+    encoded.append(byte | 0x80 if length else byte)
+    if not length:
+      return bytes(encoded)
+
+def publishPacket(topic, payload):
+  topic = topic.encode()
+  body = struct.pack("!H", len(topic)) + topic + payload
+  return b"\x30" + encodeLength(len(body)) + body
+
+class FakeMqttBroker:
+  def __init__(self, host="127.0.0.1", port=0):
+    self.subscriptions = []  # (topic filter, connection)
+    self.messages = []  # (topic, payload) published by clients
+    self.connections = 0
+    self.clients = set()
+    self.lock = threading.Lock()
+    self.server = socketserver.ThreadingTCPServer((host, port), self._handler())
+    self.server.daemon_threads = True
+
+  @property
+  def port(self):
+    return self.server.server_address[1]
+
+  def start(self):
+    threading.Thread(target=self.server.serve_forever, daemon=True).start()
+    return self
+
+  def stop(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+  def publish(self, topic, payload):
+    """Sends payload to every client subscribed to topic, returns how many there were."""
+    if isinstance(payload, str):
+      payload = payload.encode()
+    packet = publishPacket(topic, payload)
+
+    with self.lock:
+      subscribers = [connection for topic_filter, connection in self.subscriptions if topicMatches(topic_filter, topic)]
+    for connection in subscribers:
+      connection.send(packet)
+    return len(subscribers)
+
+  def disconnectClients(self):
+    """Drops every client connection, like a printer that rebooted."""
+    with self.lock:
+      clients = list(self.clients)
+    for client in clients:
+      try:
+        client.request.shutdown(socket.SHUT_RDWR)
+      except OSError:
+        pass
+
+  def subscribers(self, topic):
+    with self.lock:
+      return sum(1 for topic_filter, _ in self.subscriptions if topicMatches(topic_filter, topic))
+
+  def _handler(self):
+    broker = self
+
+    class Handler(socketserver.BaseRequestHandler):
+      def setup(self):
+        self.write_lock = threading.Lock()
+        with broker.lock:
+          broker.clients.add(self)
+
+      def send(self, data):
+        try:
+          with self.write_lock:
+            self.request.sendall(data)
+        except OSError:
+          pass
+
+      def read(self, size):
+        data = b""
+        while len(data) < size:
+          chunk = self.request.recv(size - len(data))
+          if not chunk:
+            raise ConnectionError("client went away")
+          data += chunk
+        return data
+
+      def packet(self):
+        first = self.read(1)[0]
+        length, multiplier = 0, 1
+        while True:
+          byte = self.read(1)[0]
+          length += (byte & 0x7F) * multiplier
+          multiplier *= 128
+          if not byte & 0x80:
+            break
+        return first >> 4, first & 0x0F, self.read(length) if length else b""
+
+      def handle(self):
+        try:
+          while True:
+            packet_type, flags, body = self.packet()
+            if packet_type == 1:  # CONNECT
+              with broker.lock:
+                broker.connections += 1
+              self.send(b"\x20\x02\x00\x00")
+            elif packet_type == 8:  # SUBSCRIBE
+              packet_id = body[:2]
+              position = 2
+              granted = bytearray()
+              while position < len(body):
+                (length,) = struct.unpack("!H", body[position:position + 2])
+                topic_filter = body[position + 2:position + 2 + length].decode()
+                position += 2 + length + 1
+                granted.append(0)
+                with broker.lock:
+                  broker.subscriptions.append((topic_filter, self))
+              reply = packet_id + bytes(granted)
+              self.send(b"\x90" + encodeLength(len(reply)) + reply)
+            elif packet_type == 3:  # PUBLISH
+              (length,) = struct.unpack("!H", body[:2])
+              topic = body[2:2 + length].decode()
+              payload = body[2 + length + (2 if flags & 0x06 else 0):]
+              with broker.lock:
+                broker.messages.append((topic, payload))
+            elif packet_type == 12:  # PINGREQ
+              self.send(b"\xd0\x00")
+            elif packet_type == 14:  # DISCONNECT
+              break
+        except (ConnectionError, OSError):
+          pass
+        finally:
+          with broker.lock:
+            broker.clients.discard(self)
+            broker.subscriptions = [(topic_filter, connection) for topic_filter, connection in broker.subscriptions if connection is not self]
+
+    return Handler
@@ -0,0 +1,127 @@
+"""
+In-memory stand-ins for what the MQTT state machine talks to, used by the benchmark scripts:
+SpoolMan, the print history, the 3MF metadata fetcher and its executor, plus a
+synthetic log of printer reports.
+"""
+import json
+import os
+from concurrent.futures import Future
+
+class InMemorySpoolman:
+  """The SpoolmanClient methods the state machine uses, on a spool list in memory."""
+
+  def __init__(self, spools):
+    self.spools = {spool["id"]: spool for spool in spools}
+    self.ledger = {}  # spool id -> grams consumed
+    self.requests = 0
+
+  def copy(self, spool_id):
+    spool = self.spools[spool_id]
+    return {**spool, "extra": dict(spool["extra"]), "filament": dict(spool["filament"])}
+
+  def fetchSpoolList(self):
+    self.requests += 1
+    return [self.copy(spool_id) for spool_id in self.spools]
+
+  def getSpoolById(self, spool_id):
+    self.requests += 1
+    return self.copy(int(spool_id))
+
+  def patchExtraTags(self, spool_id, old_extras, new_extras):
+    self.requests += 1
+    self.spools[int(spool_id)]["extra"].update(new_extras)
+    return self.copy(int(spool_id))
+
+  def consumeSpool(self, spool_id, use_weight):
+    self.requests += 1
+    spool = self.spools[int(spool_id)]
+    spool["used_weight"] += use_weight
+    spool["remaining_weight"] -= use_weight
+    self.ledger[int(spool_id)] = self.ledger.get(int(spool_id), 0) + use_weight
+    return self.copy(int(spool_id))
+
+  def fetchSettings(self):
+    return {"extra_fields_spool": [], "extra_fields_filament": [], "base_url": "", "currency": "EUR"}
+
+class InMemoryPrintHistory:
+  """record_print and assign_spools on lists instead of SQLite."""
+
+  def __init__(self):
+    self.prints = []
+    self.assignments = {}
+
+  def record_print(self, file_name, print_type, image_file=None, filaments=None, print_date=None):
+    self.prints.append({"file_name": file_name, "print_type": print_type, "filaments": dict(filaments or {})})
+    return len(self.prints)
+
+  def assign_spools(self, print_id, assignments):
+    for ams_slot, spool_id, cost_per_gram in assignments:
+      self.assignments[(print_id, ams_slot)] = spool_id
+
+class ImmediateExecutor:
+  """Parses the 3MF on submit, so reports resolve the metadata deterministically."""
+
+  def submit(self, function, *args, **kwargs):
+    future = Future()
+    try:
+      future.set_result(function(*args, **kwargs))
+    except Exception as e:
+      future.set_exception(e)
+    return future
+
+def fakeMetadata(filament_count):
+  """Stands in for getMetaDataFrom3mf: filament_count filaments of 10 g + slot, used in slot order."""
+  def getMetaDataFrom3mf(url, filament_order=True, ftp=None):
+    metadata = {
+      "file": os.path.basename(url),
+      "image": "0" * 64 + ".png",
+      "filaments": {slot: {"type": "PLA", "color": "#FFFFFF", "used_g": 10.0 + slot} for slot in range(1, filament_count + 1)},
+    }
+    if filament_order:
+      metadata["filamentOrder"] = {slot: slot - 1 for slot in range(1, filament_count + 1)}
+    return metadata
+  return getMetaDataFrom3mf
+
+def assignTrays(spools, printer_ids):
+  """Puts spools 1-4 in the AMS trays of the first printer, 5-8 in those of the second and so on."""
+  for spool in spools:
+    index = spool["id"] - 1
+    if index < 4 * len(printer_ids):
+      spool["extra"]["active_tray"] = json.dumps(f"{printer_ids[index // 4]}_0_{index % 4}")
+    else:
+      spool["extra"]["active_tray"] = json.dumps("")
+  return spools
+
+def synthetic_log(prints, filament_count, printer_index=0):
+  """Reports of alternating cloud and local prints of filament_count filaments, with status chatter.
+  The AMS reports the tags of the spools assignTrays puts in the trays of the printer_index-th printer."""
+  def report(**fields):
+    return json.dumps({"print": fields})
+
+  ams = {"ams": [{"id": "0", "humidity": "3", "temp": "24.5", "tray": [
+    {"id": str(tray), "tray_sub_brands": "PLA Basic", "tray_color": "FFFFFFFF", "remain": 80, "tray_uuid": f"{4 * printer_index + tray + 1:032X}"}
+    for tray in range(4)]}], "tray_tar": "255"}
+
+  lines = []
+  for number in range(prints):
+    lines.append(report(gcode_state="IDLE", stg_cur=255, mc_print_sub_stage=0, ams=ams))
+    if number % 2 == 0:
+      lines.append(report(command="project_file", url=f"https://cloud.example/print_{number}.3mf", print_type="cloud",
+                          subtask_name=f"print_{number}", use_ams=True, ams_mapping=list(range(filament_count))))
+      lines.append(report(gcode_state="RUNNING", stg_cur=0, print_type="cloud"))
+    else:
+      lines.append(report(print_type="local", gcode_state="PREPARE", gcode_file=f"/sdcard/print_{number}.3mf", stg_cur=2, ams={"tray_tar": "255"}))
+      lines.append(report(gcode_state="RUNNING", stg_cur=4, ams={"tray_tar": "0"}))
+      for tray in range(1, filament_count):
+        lines.append(report(stg_cur=0, mc_print_sub_stage=4, ams={"tray_tar": str(tray)}))
+        lines.append(report(stg_cur=0, mc_print_sub_stage=2))
+
+    for percent in range(0, 100, 5):
+      lines.append(report(mc_percent=percent, stg_cur=0, mc_print_sub_stage=2, nozzle_temper=220.0, bed_temper=60.0))
+    lines.append(report(gcode_state="FINISH", stg_cur=255, mc_percent=100))
+
+  return lines
+
+def expected_ledger(prints, filament_count, printer_index=0):
+  """The grams synthetic_log(prints, filament_count) spends from each spool of the printer with assignTrays."""
+  return {4 * printer_index + slot: prints * (10.0 + slot) for slot in range(1, filament_count + 1)}
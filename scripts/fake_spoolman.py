@@ -0,0 +1,202 @@
+"""
+Minimal in-process stand-in for the SpoolMan REST API, used by the benchmark scripts.
+
+Serves /api/v1/spool, /api/v1/spool/<id>, PATCH /api/v1/spool/<id>,
+PUT /api/v1/spool/<id>/use and /api/v1/setting/ from an in-memory spool list,
+and SpoolMan's change feed as a websocket on /api/v1/ (see FakeSpoolman.broadcast).
+"""
+import base64
+import gzip
+import hashlib
+import json
+import re
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+def make_spools(count, printer_id="01P00A000000000"):
+  spools = []
+  for spool_id in range(1, count + 1):
+    spools.append({
+      "id": spool_id,
+      "registered": "2025-01-01T00:00:00Z",
+      "first_used": "2025-01-02T00:00:00Z",
+      "last_used": "2025-03-01T12:00:00Z",
+      "price": 20.0,
+      "initial_weight": 1000.0,
+      "remaining_weight": 1000.0 - spool_id % 900,
+      "used_weight": float(spool_id % 900),
+      "archived": False,
+      "extra": {
+        "tag": json.dumps(f"{spool_id:032X}"),
+        "active_tray": json.dumps(f"{printer_id}_0_{spool_id - 1}" if spool_id <= 4 else ""),
+      },
+      "filament": {
+        "id": spool_id % 40 + 1,
+        "name": f"Filament {spool_id % 40}",
+        "material": ("PLA", "PETG", "ABS", "TPU")[spool_id % 4],
+        "price": 20.0,
+        "weight": 1000.0,
+        "color_hex": f"{(spool_id * 2654435761) & 0xFFFFFF:06X}",
+        "vendor": {"id": spool_id % 5 + 1, "name": f"Vendor {spool_id % 5}"},
+        "extra": {},
+      },
+    })
+  return spools
+
+class FakeSpoolman:
+  def __init__(self, spools=None, host="127.0.0.1", port=0):
+    self.spools = {spool["id"]: spool for spool in (spools if spools is not None else make_spools(400))}
+    self.requests = 0
+    self.lock = threading.Lock()
+    self.websockets = []
+    self.server = ThreadingHTTPServer((host, port), self._handler())
+    self.server.daemon_threads = True
+    self.thread = None
+
+  @property
+  def base_url(self):
+    host, port = self.server.server_address[:2]
+    return f"http://{host}:{port}"
+
+  @property
+  def api_url(self):
+    return f"{self.base_url}/api/v1"
+
+  def start(self):
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+    return self
+
+  def stop(self):
+    self.disconnect_websockets()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def broadcast(self, event_type, resource, payload):
+    """Sends a SpoolMan style change event to every connected websocket client."""
+    message = json.dumps({"type": event_type, "resource": resource, "date": "2025-01-01T00:00:00Z", "payload": payload}).encode()
+    if len(message) < 126:
+      header = struct.pack("!BB", 0x81, len(message))
+    elif len(message) < 65536:
+      header = struct.pack("!BBH", 0x81, 126, len(message))
+    else:
+      header = struct.pack("!BBQ", 0x81, 127, len(message))
+
+    with self.lock:
+      for wfile in list(self.websockets):
+        try:
+          wfile.write(header + message)
+        except OSError:
+          self.websockets.remove(wfile)
+
+  def disconnect_websockets(self):
+    with self.lock:
+      for wfile in self.websockets:
+        try:
+          wfile.write(struct.pack("!BB", 0x88, 0))
+        except OSError:
+          pass
+      self.websockets.clear()
+
+  def _handler(self):
+    fake = self
+
+    class Handler(BaseHTTPRequestHandler):
+      protocol_version = "HTTP/1.1"
+      disable_nagle_algorithm = True
+
+      def log_message(self, format, *args):
+        pass
+
+      def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        headers = {"Content-Type": "application/json"}
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+          body = gzip.compress(body, compresslevel=1)
+          headers["Content-Encoding"] = "gzip"
+
+        self.send_response(status)
+        for key, value in headers.items():
+          self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def _body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+      def _count(self):
+        with fake.lock:
+          fake.requests += 1
+
+      def _websocket(self):
+        accept = base64.b64encode(hashlib.sha1((self.headers["Sec-WebSocket-Key"] + "258EAFA5-E914-47DA-95CA-C5AB0DC85B11").encode()).digest()).decode()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+
+        with fake.lock:
+          fake.websockets.append(self.wfile)
+
+        # Client frames (pings, close) are not interpreted, the socket is held until the client goes away
+        while self.rfile.read(1):
+          pass
+
+        with fake.lock:
+          if self.wfile in fake.websockets:
+            fake.websockets.remove(self.wfile)
+        self.close_connection = True
+
+      def do_GET(self):
+        if self.headers.get("Upgrade", "").lower() == "websocket":
+          return self._websocket()
+
+        self._count()
+        path = self.path.split("?", 1)[0]
+        if path == "/api/v1/spool":
+          return self._send(200, list(fake.spools.values()))
+        if path == "/api/v1/setting/":
+          return self._send(200, {
+            "extra_fields_spool": {"value": "[]"},
+            "extra_fields_filament": {"value": "[]"},
+            "base_url": {"value": '""'},
+            "currency": {"value": '"EUR"'},
+          })
+
+        match = re.fullmatch(r"/api/v1/spool/(\d+)", path)
+        if match and int(match.group(1)) in fake.spools:
+          return self._send(200, fake.spools[int(match.group(1))])
+
+        self._send(404, {"message": "Not found"})
+
+      def do_PATCH(self):
+        self._count()
+        match = re.fullmatch(r"/api/v1/spool/(\d+)", self.path)
+        if not match or int(match.group(1)) not in fake.spools:
+          return self._send(404, {"message": "Not found"})
+
+        spool = fake.spools[int(match.group(1))]
+        payload = self._body()
+        with fake.lock:
+          spool["extra"].update(payload.pop("extra", {}))
+          spool.update(payload)
+        self._send(200, spool)
+
+      def do_PUT(self):
+        self._count()
+        match = re.fullmatch(r"/api/v1/spool/(\d+)/use", self.path)
+        if not match or int(match.group(1)) not in fake.spools:
+          return self._send(404, {"message": "Not found"})
+
+        spool = fake.spools[int(match.group(1))]
+        use_weight = self._body().get("use_weight", 0)
+        with fake.lock:
+          spool["used_weight"] += use_weight
+          spool["remaining_weight"] -= use_weight
+        self._send(200, spool)
+
+    return Handler
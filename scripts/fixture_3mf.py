@@ -0,0 +1,60 @@
+"""
+Builds synthetic Bambu Studio style 3MF archives for the benchmark scripts.
+"""
+import os
+import zipfile
+
+SLICE_INFO = """<?xml version="1.0" encoding="UTF-8"?>
+<config>
+  <plate>
+    <metadata key="index" value="{plate}"/>
+    <filament id="1" tray_info_idx="GFL99" type="PLA" color="#0DFF00" used_m="6.79" used_g="20.26" />
+    <filament id="2" tray_info_idx="GFL99" type="PLA" color="#000000" used_m="0.72" used_g="2.15" />
+    <filament id="3" tray_info_idx="GFG99" type="PETG" color="#FFFFFF" used_m="1.20" used_g="3.58" />
+  </plate>
+</config>
+"""
+
+# Smallest valid PNG, the thumbnail content doesn't matter
+PNG = bytes.fromhex("89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+                    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082")
+
+GCODE_BLOCK = b"".join(b"G1 X%d.%03d Y%d.%03d E0.%05d F1200\n" % (i % 250, i % 997, i % 230, i % 991, i) for i in range(2000))
+FILAMENT_CHANGE = b"; filament change\nM620 S%dA\nM204 S9000\nT%d\nM621 S%dA\n"
+
+def write_gcode(f, size, switches=(0, 1, 2, 0, 1)):
+  """Writes roughly size bytes of plate gcode with a filament change before each part."""
+  part_size = max(size // len(switches), len(GCODE_BLOCK))
+  written = 0
+  for filament in switches:
+    change = FILAMENT_CHANGE % (filament, filament, filament)
+    f.write(change)
+    written += len(change)
+    part_end = written + part_size
+    while written < part_end:
+      f.write(GCODE_BLOCK)
+      written += len(GCODE_BLOCK)
+
+  f.write(b"M620 S255\n; end of print\n")
+
+def build_3mf(path, model_size=8 * 1024 * 1024, gcode_size=8 * 1024 * 1024, plate=1, plates=1):
+  """
+  Writes a 3MF with an incompressible model blob of model_size bytes and plate
+  gcode of about gcode_size bytes for each of the given number of plates.
+  """
+  with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as z:
+    z.writestr("Metadata/slice_info.config", SLICE_INFO.format(plate=plate))
+
+    with z.open("3D/3dmodel.model", "w", force_zip64=True) as model:
+      remaining = model_size
+      while remaining > 0:
+        chunk = os.urandom(min(remaining, 1024 * 1024))
+        model.write(chunk)
+        remaining -= len(chunk)
+
+    for plate_id in range(1, plates + 1):
+      z.writestr(f"Metadata/plate_{plate_id}.png", PNG)
+      with z.open(f"Metadata/plate_{plate_id}.gcode", "w", force_zip64=True) as gcode:
+        write_gcode(gcode, gcode_size)
+
+  return path
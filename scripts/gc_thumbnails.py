@@ -0,0 +1,80 @@
+"""
+Cleans up the print thumbnails in static/prints. Thumbnails from before they
+were stored by content hash are renamed to their hash, so duplicates collapse
+into one file, and hashed thumbnails no print refers to anymore are removed.
+Other files, like the sample thumbnails that ship with the repository, are kept.
+
+Run it from the OpenSpoolMan directory (the one with data/ and static/), e.g.
+inside the running container: python scripts/gc_thumbnails.py [--dry-run]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from print_history import get_image_files, replace_image_file
+from tools_3mf import PRINTS_DIR, storeThumbnail
+
+HASHED_NAME = re.compile(r"^[0-9a-f]{64}\.png$")
+
+def dedupe(image_files, dry_run):
+  """Moves referenced thumbnails with timestamp names to their content hash."""
+  renamed = 0
+  for image_file in sorted(image_files):
+    path = os.path.join(PRINTS_DIR, image_file)
+    if HASHED_NAME.match(image_file) or not os.path.isfile(path):
+      continue
+
+    if dry_run:
+      print(f"would rename {image_file}")
+    else:
+      with open(path, "rb") as source_file:
+        hashed_file = storeThumbnail(source_file)
+      replace_image_file(image_file, hashed_file)
+      os.remove(path)
+      print(f"{image_file} -> {hashed_file}")
+    renamed += 1
+
+  return renamed
+
+def collect(image_files, grace_seconds, dry_run):
+  """Removes hashed thumbnails no print refers to, unless they were written just now."""
+  removed = 0
+  freed = 0
+  cutoff = time.time() - grace_seconds
+  with os.scandir(PRINTS_DIR) as entries:
+    for entry in entries:
+      # Only names storeThumbnail gives out, anything else was not put there by a print
+      if not entry.is_file() or not HASHED_NAME.match(entry.name) or entry.name in image_files:
+        continue
+
+      stat = entry.stat()
+      # A print that is just starting may not be in the history yet
+      if stat.st_mtime > cutoff:
+        continue
+
+      if dry_run:
+        print(f"would remove {entry.name}")
+      else:
+        os.remove(entry.path)
+      removed += 1
+      freed += stat.st_size
+
+  return removed, freed
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+  parser.add_argument("--dry-run", action="store_true", help="only list what would change")
+  parser.add_argument("--grace-minutes", type=float, default=60, help="keep unreferenced files younger than this")
+  args = parser.parse_args()
+
+  renamed = dedupe(get_image_files(), args.dry_run)
+  removed, freed = collect(get_image_files(), args.grace_minutes * 60, args.dry_run)
+  print(f"{renamed} thumbnails renamed, {removed} unreferenced thumbnails removed ({freed / 1024 / 1024:.1f} MB)")
+
+if __name__ == "__main__":
+  main()
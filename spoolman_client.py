@@ -1,62 +1,109 @@
 import requests
-from config import SPOOLMAN_API_URL, SPOOL_SORTING
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from config import SPOOLMAN_API_URL, SPOOL_SORTING, SPOOLMAN_TIMEOUT, SPOOLMAN_RETRIES, SPOOLMAN_POOL_SIZE, SPOOLMAN_GZIP
 import json
 
-def patchExtraTags(spool_id, old_extras, new_extras):
-  for key, value in new_extras.items():
-    old_extras[key] = value
+class SpoolmanClient:
+  """
+  Keep-alive HTTP client for the SpoolMan REST API.
 
-  resp = requests.patch(f"{SPOOLMAN_API_URL}/spool/{spool_id}", json={
-    "extra": old_extras
-  })
-  print(resp.text)
-  print(resp.status_code)
+  All requests share one requests.Session, so connections are pooled and reused.
+  Connection errors are retried with exponential backoff for every method, read
+  errors and 502/503/504 responses only for GET and PATCH. PUT /use is not
+  idempotent and is never resent once SpoolMan may have seen it.
+  """
 
+  def __init__(self, api_url=SPOOLMAN_API_URL, timeout=SPOOLMAN_TIMEOUT, retries=SPOOLMAN_RETRIES,
+               pool_size=SPOOLMAN_POOL_SIZE, gzip=SPOOLMAN_GZIP):
+    self.api_url = api_url
+    self.timeout = timeout
 
-def getSpoolById(spool_id):
-  response = requests.get(f"{SPOOLMAN_API_URL}/spool/{spool_id}")
-  print(response.status_code)
-  print(response.text)
-  return response.json()
+    retry = Retry(total=retries,
+                  backoff_factor=0.3,
+                  status_forcelist=(502, 503, 504),
+                  allowed_methods=frozenset({"GET", "PATCH"}),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+    self.session = requests.Session()
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+    self.session.headers["Accept"] = "application/json"
+    self.session.headers["Accept-Encoding"] = "gzip, deflate" if gzip else "identity"
+
+  def request(self, method, path, **kwargs):
+    kwargs.setdefault("timeout", self.timeout)
+    return self.session.request(method, f"{self.api_url}{path}", **kwargs)
+
+  def get(self, path, **kwargs):
+    response = self.request("GET", path, **kwargs)
+    response.raise_for_status()
+    return response.json()
+
+  def write(self, method, path, payload):
+    response = self.request(method, path, json=payload)
+    if not response.ok:
+      print(f"{method} {path} failed with {response.status_code}: {response.text}")
+      return None
+
+    print(f"{method} {path}: {response.status_code}")
+    return response.json()
+
+  def patchExtraTags(self, spool_id, old_extras, new_extras):
+    for key, value in new_extras.items():
+      old_extras[key] = value
+
+    return self.write("PATCH", f"/spool/{spool_id}", {
+      "extra": old_extras
+    })
+
+  def getSpoolById(self, spool_id):
+    return self.get(f"/spool/{spool_id}")
+
+  def fetchSpoolList(self):
+    if SPOOL_SORTING:
+      return self.get("/spool", params={"sort": SPOOL_SORTING})
+
+    return self.get("/spool")
 
+  def consumeSpool(self, spool_id, use_weight):
+    print(f'Consuming {use_weight} from spool {spool_id}')
+
+    return self.write("PUT", f"/spool/{spool_id}/use", {
+      "use_weight": use_weight
+    })
+
+  def fetchSettings(self):
+    data = self.get("/setting/")
+
+    # Extrahiere die Werte aus den relevanten Feldern
+    extra_fields_spool = json.loads(data["extra_fields_spool"]["value"])
+    extra_fields_filament = json.loads(data["extra_fields_filament"]["value"])
+    base_url = data["base_url"]["value"]
+    currency = data["currency"]["value"]
+
+    settings = {}
+    settings["extra_fields_spool"] = extra_fields_spool
+    settings["extra_fields_filament"] = extra_fields_filament
+    settings["base_url"] = base_url.replace('"', '')
+    settings["currency"] = currency.replace('"', '')
+
+    return settings
+
+SPOOLMAN_CLIENT = SpoolmanClient()
+
+def patchExtraTags(spool_id, old_extras, new_extras):
+  return SPOOLMAN_CLIENT.patchExtraTags(spool_id, old_extras, new_extras)
+
+def getSpoolById(spool_id):
+  return SPOOLMAN_CLIENT.getSpoolById(spool_id)
 
 def fetchSpoolList():
-  if SPOOL_SORTING:
-    response = requests.get(f"{SPOOLMAN_API_URL}/spool?sort={SPOOL_SORTING}")
-  else:
-    response = requests.get(f"{SPOOLMAN_API_URL}/spool")
-    
-  print(response.status_code)
-  print(response.text)
-  return response.json()
+  return SPOOLMAN_CLIENT.fetchSpoolList()
 
 def consumeSpool(spool_id, use_weight):
-  print(f'Consuming {use_weight} from spool {spool_id}')
-
-  response = requests.put(f"{SPOOLMAN_API_URL}/spool/{spool_id}/use", json={
-    "use_weight": use_weight
-  })
-  print(response.status_code)
-  print(response.text)
+  return SPOOLMAN_CLIENT.consumeSpool(spool_id, use_weight)
 
 def fetchSettings():
-  response = requests.get(f"{SPOOLMAN_API_URL}/setting/")
-  print(response.status_code)
-  print(response.text)
-
-  # JSON in ein Python-Dictionary laden
-  data = response.json()
-
-  # Extrahiere die Werte aus den relevanten Feldern
-  extra_fields_spool = json.loads(data["extra_fields_spool"]["value"])
-  extra_fields_filament = json.loads(data["extra_fields_filament"]["value"])
-  base_url = data["base_url"]["value"]
-  currency = data["currency"]["value"]
-
-  settings = {}
-  settings["extra_fields_spool"] = extra_fields_spool 
-  settings["extra_fields_filament"] = extra_fields_filament
-  settings["base_url"] = base_url.replace('"', '')
-  settings["currency"] = currency.replace('"', '')
-
-  return settings
\ No newline at end of file
+  return SPOOLMAN_CLIENT.fetchSettings()
@@ -0,0 +1,90 @@
+import json
+import time
+import traceback
+from threading import Thread
+
+import websocket
+
+from config import SPOOLMAN_BASE_URL
+from spoolman_service import applySpoolmanEvent, refreshSpools, setSpoolCacheLive
+
+SPOOLMAN_EVENT_LISTENER = None
+
+def websocketUrl(base_url):
+  if base_url.startswith("https://"):
+    return "wss://" + base_url[len("https://"):] + "/api/v1/"
+  return "ws://" + base_url.removeprefix("http://") + "/api/v1/"
+
+class SpoolmanEventListener(Thread):
+  """
+  Follows SpoolMan's websocket change feed and applies spool, filament and
+  vendor changes to the spool cache. While connected the cache is marked live
+  and periodic list downloads pause. Every (re)connect resynchronises with one
+  full refresh, so changes made while disconnected are not lost.
+  """
+
+  def __init__(self, url, reconnect_delay=5, ping_interval=30):
+    super().__init__(daemon=True)
+    self.url = url
+    self.reconnect_delay = reconnect_delay
+    self.ping_interval = ping_interval
+    self.connected = False
+    self.running = True
+    self.events = 0
+    self.connection = None
+
+  def run(self):
+    while self.running:
+      try:
+        self.connection = websocket.create_connection(self.url, timeout=self.ping_interval)
+        print(f"Listening to SpoolMan changes on {self.url}")
+        refreshSpools()
+        self.connected = True
+        setSpoolCacheLive(True)
+        self.listen()
+      except Exception as e:
+        if self.running:
+          print(f"⚠️ SpoolMan change feed unavailable: {e}, new try in {self.reconnect_delay} seconds...")
+      finally:
+        self.connected = False
+        setSpoolCacheLive(False)
+        self.close()
+
+      if self.running:
+        time.sleep(self.reconnect_delay)
+
+  def listen(self):
+    while self.running:
+      try:
+        message = self.connection.recv()
+      except websocket.WebSocketTimeoutException:
+        # Idle feed, make sure the connection is still there
+        self.connection.ping()
+        continue
+
+      if not message:
+        return
+
+      try:
+        applySpoolmanEvent(json.loads(message))
+        self.events += 1
+      except Exception:
+        traceback.print_exc()
+
+  def close(self):
+    if self.connection is not None:
+      try:
+        self.connection.close()
+      except Exception:
+        pass
+      self.connection = None
+
+  def stop(self):
+    self.running = False
+    self.close()
+
+def startSpoolmanEventListener(url=None):
+  global SPOOLMAN_EVENT_LISTENER
+  SPOOLMAN_EVENT_LISTENER = SpoolmanEventListener(url or websocketUrl(SPOOLMAN_BASE_URL))
+  SPOOLMAN_EVENT_LISTENER.start()
+  return SPOOLMAN_EVENT_LISTENER
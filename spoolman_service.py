@@ -1,15 +1,27 @@
-import os
-from config import PRINTER_ID, EXTERNAL_SPOOL_AMS_ID, EXTERNAL_SPOOL_ID
+import time
+import traceback
+from concurrent.futures import Future, wait
+from threading import Thread, RLock, Lock, Condition
+from config import PRINTER_ID, EXTERNAL_SPOOL_AMS_ID, EXTERNAL_SPOOL_ID, SPOOL_CACHE_TTL, SPOOLMAN_WRITE_DELAY, SPOOLMAN_TIMEOUT
 from datetime import datetime
 from zoneinfo import ZoneInfo
-from print_history import update_filament_spool
+from print_history import assign_spools
 import json
 
-from spoolman_client import consumeSpool, patchExtraTags, fetchSpoolList, fetchSettings
+import spoolman_client
+from spoolman_client import fetchSpoolList, fetchSettings
 
-SPOOLS = {}
+SPOOLS = []
 SPOOLMAN_SETTINGS = {}
 
+# Version of the spool cache, bumped whenever a refresh or a local write changes a spool
+SPOOL_CACHE_VERSION = 0
+SPOOL_CACHE_FETCHED_AT = 0.0
+SPOOL_CACHE_LOCK = RLock()
+SPOOL_CACHE_REFRESHING = Lock()
+SPOOL_WRITTEN_AT = {}  # spool id -> time of the last local write, so a refresh started earlier can't undo it
+SPOOL_CACHE_LIVE = False  # True while SpoolMan's change feed keeps the cache current, polling pauses then
+
 currency_symbols = {
     "AED": "د.إ", "AFN": "؋", "ALL": "Lek", "AMD": "դր.", "ANG": "ƒ", "AOA": "Kz", 
     "ARS": "$", "AUD": "$", "AWG": "Afl.", "AZN": "₼", "BAM": "KM", "BBD": "$", 
@@ -40,42 +52,125 @@ currency_symbols = {
     "ZAR": "R", "ZMW": "ZK", "ZWL": "$"
 }
 
+def decodeSpoolExtra(spool, key):
+  value = (spool.get("extra") or {}).get(key)
+  if not value:
+    return None
+
+  try:
+    return json.loads(value)
+  except (TypeError, ValueError):
+    return None
+
+class SpoolIndex:
+  """
+  Lookup tables over the cached spool list, keyed by spool id, decoded NFC tag
+  and decoded active_tray. Tag and tray lookups return every spool filed under
+  the key, because nothing stops two spools in SpoolMan from claiming the same one.
+  Readers take no lock, writers (under SPOOL_CACHE_LOCK) replace the entries they
+  change instead of editing them, so a reader never finds an updated spool missing.
+  """
+
+  def __init__(self):
+    self.by_id = {}
+    self.by_tag = {}
+    self.by_active_tray = {}
+    self._keys = {}
+
+  def rebuild(self, spools):
+    # Fill a fresh index and swap the tables in, so readers never see it half empty
+    index = SpoolIndex()
+    for spool in spools:
+      index.update(spool)
+
+    self.by_id, self.by_tag, self.by_active_tray, self._keys = index.by_id, index.by_tag, index.by_active_tray, index._keys
+
+  def update(self, spool):
+    spool_id = spool["id"]
+    tag = decodeSpoolExtra(spool, "tag")
+    active_tray = decodeSpoolExtra(spool, "active_tray")
+    old_tag, old_active_tray = self._keys.get(spool_id, (None, None))
+
+    self.by_id[spool_id] = spool
+    self._refile(self.by_tag, tag, old_tag, spool_id, spool)
+    self._refile(self.by_active_tray, active_tray, old_active_tray, spool_id, spool)
+    self._keys[spool_id] = (tag, active_tray)
+
+  def remove(self, spool_id):
+    if spool_id not in self._keys:
+      return
+
+    tag, active_tray = self._keys.pop(spool_id)
+    self.by_id.pop(spool_id, None)
+    self._discard(self.by_tag, tag, spool_id)
+    self._discard(self.by_active_tray, active_tray, spool_id)
+
+  def get(self, spool_id):
+    try:
+      return self.by_id.get(int(spool_id))
+    except (TypeError, ValueError):
+      return None
+
+  def findByTag(self, tag):
+    return list(self.by_tag.get(tag, {}).values())
+
+  def findByActiveTray(self, tray_uid):
+    return list(self.by_active_tray.get(tray_uid, {}).values())
+
+  @staticmethod
+  def _refile(table, key, old_key, spool_id, spool):
+    # File the spool under its new key before it leaves the old one
+    if key:
+      table[key] = {**table.get(key, {}), spool_id: spool}
+    if old_key != key:
+      SpoolIndex._discard(table, old_key, spool_id)
+
+  @staticmethod
+  def _discard(table, key, spool_id):
+    if key and key in table:
+      entries = {other_id: other for other_id, other in table[key].items() if other_id != spool_id}
+      if entries:
+        table[key] = entries
+      else:
+        table.pop(key, None)
+
+SPOOL_INDEX = SpoolIndex()
+
 def get_currency_symbol(code):
     return currency_symbols.get(code, code)
 
-def trayUid(ams_id, tray_id):
-  return f"{PRINTER_ID}_{ams_id}_{tray_id}"
+def trayUid(ams_id, tray_id, printer_id=None):
+  return f"{printer_id or PRINTER_ID}_{ams_id}_{tray_id}"
 
 def getAMSFromTray(n):
     return n // 4
 
-def augmentTrayDataWithSpoolMan(spool_list, tray_data, tray_id):
+def augmentTrayDataWithSpoolMan(tray_data, tray_id):
   tray_data["matched"] = False
-  for spool in spool_list:
-    if spool.get("extra") and spool["extra"].get("active_tray") and spool["extra"]["active_tray"] == json.dumps(tray_id):
-      #TODO: check for mismatch
-      tray_data["name"] = spool["filament"]["name"]
-      tray_data["vendor"] = spool["filament"]["vendor"]["name"]
-      tray_data["remaining_weight"] = spool["remaining_weight"]
-      
-      if "last_used" in spool:
-        try:
-            dt = datetime.strptime(spool["last_used"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=ZoneInfo("UTC"))
-        except ValueError:
-            dt = datetime.strptime(spool["last_used"], "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=ZoneInfo("UTC"))
-
-        local_time = dt.astimezone()
-        tray_data["last_used"] = local_time.strftime("%d.%m.%Y %H:%M:%S")
+  for spool in SPOOL_INDEX.findByActiveTray(tray_id):
+    #TODO: check for mismatch
+    tray_data["name"] = spool["filament"]["name"]
+    tray_data["vendor"] = spool["filament"]["vendor"]["name"]
+    tray_data["remaining_weight"] = spool["remaining_weight"]
 
-      else:
-          tray_data["last_used"] = "-"
-          
-      if "multi_color_hexes" in spool["filament"]:
-        tray_data["tray_color"] = spool["filament"]["multi_color_hexes"]
-        tray_data["tray_color_orientation"] = spool["filament"]["multi_color_direction"]
-        
-      tray_data["matched"] = True
-      break
+    if "last_used" in spool:
+      try:
+          dt = datetime.strptime(spool["last_used"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=ZoneInfo("UTC"))
+      except ValueError:
+          dt = datetime.strptime(spool["last_used"], "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=ZoneInfo("UTC"))
+
+      local_time = dt.astimezone()
+      tray_data["last_used"] = local_time.strftime("%d.%m.%Y %H:%M:%S")
+
+    else:
+        tray_data["last_used"] = "-"
+
+    if "multi_color_hexes" in spool["filament"]:
+      tray_data["tray_color"] = spool["filament"]["multi_color_hexes"]
+      tray_data["tray_color_orientation"] = spool["filament"]["multi_color_direction"]
+
+    tray_data["matched"] = True
+    break
 
   if tray_data.get("tray_type") and tray_data["tray_type"] != "" and tray_data["matched"] == False:
     tray_data["issue"] = True
@@ -112,70 +207,353 @@ def spendFilaments(printdata):
     #if ams_usage.get(trayUid(ams_id, tray_id)):
     #    ams_usage[trayUid(ams_id, tray_id)]["usedGrams"] += float(filament["used_g"])
     #else:
-    ams_usage.append({"trayUid": trayUid(ams_id, tray_id), "id": filamentId, "usedGrams":float(filament["used_g"])})
+    ams_usage.append({"trayUid": trayUid(ams_id, tray_id, printdata.get("printer_id")), "id": filamentId, "usedGrams":float(filament["used_g"])})
 
-  for spool in fetchSpools():
+  fetchSpools()
+
+  used_grams_by_spool = {}
+  assignments = []
+  for ams_tray in ams_usage:
     #TODO: What if there is a mismatch between AMS and SpoolMan?
-                 
-    if spool.get("extra") and spool.get("extra").get("active_tray"):
-      #filament = ams_usage.get()
-      active_tray = json.loads(spool.get("extra").get("active_tray"))
-
-      # iterate over all ams_trays and set spool in print history, at the same time sum the usage for the tray and consume it from the spool
-      used_grams = 0
-      for ams_tray in ams_usage:
-        if active_tray == ams_tray["trayUid"]:
-          used_grams += ams_tray["usedGrams"]
-          update_filament_spool(printdata["print_id"], ams_tray["id"], spool["id"])
-        
-      if used_grams != 0:
-        consumeSpool(spool["id"], used_grams)
-        
-
-def setActiveTray(spool_id, spool_extra, ams_id, tray_id):
+    # set spool in print history, at the same time sum the usage for the tray and consume it from the spool
+    for spool in SPOOL_INDEX.findByActiveTray(ams_tray["trayUid"]):
+      used_grams_by_spool[spool["id"]] = used_grams_by_spool.get(spool["id"], 0) + ams_tray["usedGrams"]
+      assignments.append((ams_tray["id"], spool["id"], spool["cost_per_gram"]))
+
+  assign_spools(printdata["print_id"], assignments)
+
+  for spool_id, used_grams in used_grams_by_spool.items():
+    if used_grams != 0:
+      consumeSpool(spool_id, used_grams)
+
+class ExtraTagWriteQueue:
+  """
+  Write-behind queue for extra field updates. Updates to the same spool are merged
+  until the worker flushes them as one PATCH, updates that would not change what
+  SpoolMan (or an earlier queued update) already has are dropped. submit() returns
+  a Future that resolves to the spool SpoolMan returned, or fails with the error.
+  The PATCH starts from the extras the caller passed in, or the cached spool's.
+  """
+
+  def __init__(self, flush_delay=SPOOLMAN_WRITE_DELAY):
+    self.flush_delay = flush_delay
+    self.pending = {}  # spool id -> {"base": caller's extras, "extra": merged updates, "futures": [...]}
+    self.flushing = {}  # the batch the worker is writing right now
+    self.condition = Condition()
+    self.thread = None
+
+  def effectiveExtras(self, spool_id, extras=None):
+    if extras is None:
+      spool = SPOOL_INDEX.get(spool_id)
+      extras = (spool.get("extra") or {}) if spool else {}
+
+    extras = dict(extras)
+    with self.condition:
+      for batch in (self.flushing, self.pending):
+        if int(spool_id) in batch:
+          extras.update(batch[int(spool_id)]["extra"])
+    return extras
+
+  # Spools SpoolMan lists under a tray, plus queued moves onto it, minus queued moves away
+  def spoolsClaimingTray(self, tray_uid):
+    with self.condition:
+      spool_ids = {spool["id"] for spool in SPOOL_INDEX.findByActiveTray(tray_uid)}
+      for batch in (self.flushing, self.pending):
+        spool_ids.update(spool_id for spool_id, entry in batch.items() if "active_tray" in entry["extra"])
+
+    claimed = json.dumps(tray_uid)
+    return [spool_id for spool_id in spool_ids if self.effectiveExtras(spool_id).get("active_tray") == claimed]
+
+  def submit(self, spool_id, new_extras, base_extras=None):
+    spool_id = int(spool_id)
+    future = Future()
+
+    with self.condition:
+      current = self.effectiveExtras(spool_id)
+      changes = {key: value for key, value in new_extras.items() if current.get(key) != value}
+
+      if not changes and spool_id not in self.pending:
+        in_flight = self.flushing.get(spool_id)
+        if in_flight is None:
+          future.set_result(SPOOL_INDEX.get(spool_id))
+        # The same change is being written right now, this caller gets its outcome
+        elif "error" in in_flight:
+          future.set_exception(in_flight["error"])
+        elif "spool" in in_flight:
+          future.set_result(in_flight["spool"])
+        else:
+          in_flight["futures"].append(future)
+        return future
+
+      entry = self.pending.setdefault(spool_id, {"base": None, "extra": {}, "futures": []})
+      if base_extras is not None:
+        entry["base"] = dict(base_extras)
+      entry["extra"].update(changes)
+      entry["futures"].append(future)
+
+      if self.thread is None:
+        self.thread = Thread(target=self.worker, daemon=True)
+        self.thread.start()
+      self.condition.notify()
+
+    return future
+
+  def worker(self):
+    while True:
+      with self.condition:
+        while not self.pending:
+          self.condition.wait()
+
+      # Give updates that arrive in the same burst a chance to be merged
+      time.sleep(self.flush_delay)
+
+      with self.condition:
+        self.flushing = self.pending
+        self.pending = {}
+
+      for spool_id, entry in self.flushing.items():
+        self.flush(spool_id, entry)
+
+      with self.condition:
+        self.flushing = {}
+
+  def flush(self, spool_id, entry):
+    cached_spool = SPOOL_INDEX.get(spool_id)
+    if entry["base"] is not None:
+      extras = dict(entry["base"])
+    else:
+      extras = dict(cached_spool.get("extra") or {}) if cached_spool else {}
+    changes = {key: value for key, value in entry["extra"].items() if extras.get(key) != value}
+
+    try:
+      if not changes:
+        print(f"Spool {spool_id}: extra fields already up to date")
+        spool = cached_spool
+      else:
+        spool = spoolman_client.patchExtraTags(spool_id, extras, changes)
+        if spool is None:
+          raise RuntimeError(f"SpoolMan rejected extra fields {changes} for spool {spool_id}")
+
+        updateCachedSpool(spool)
+        print(f"Spool {spool_id}: updated extra fields {list(changes)}")
+
+      with self.condition:
+        entry["spool"] = spool
+        futures = list(entry["futures"])
+      for future in futures:
+        future.set_result(spool)
+    except Exception as e:
+      print(f"Spool {spool_id}: failed to update extra fields: {e}")
+      with self.condition:
+        entry["error"] = e
+        futures = list(entry["futures"])
+      for future in futures:
+        future.set_exception(e)
+
+SPOOL_WRITE_QUEUE = ExtraTagWriteQueue()
+
+def queueExtraTags(spool_id, new_extras, base_extras=None):
+  return SPOOL_WRITE_QUEUE.submit(spool_id, new_extras, base_extras)
+
+def waitForWrites(futures, timeout=SPOOLMAN_TIMEOUT):
+  done, not_done = wait(futures, timeout=timeout)
+  for future in done:
+    future.result()
+  if not_done:
+    raise TimeoutError(f"SpoolMan did not confirm {len(not_done)} extra field update(s) within {timeout}s, they are still pending")
+
+def setActiveTray(spool_id, spool_extra, ams_id, tray_id, printer_id=None):
   if spool_extra == None:
     spool_extra = {}
 
-  if not spool_extra.get("active_tray") or json.loads(spool_extra.get("active_tray")) != trayUid(ams_id, tray_id):
-    patchExtraTags(spool_id, spool_extra, {
-      "active_tray": json.dumps(trayUid(ams_id, tray_id)),
-    })
+  tray_uid = trayUid(ams_id, tray_id, printer_id)
+  effective_extra = SPOOL_WRITE_QUEUE.effectiveExtras(spool_id, spool_extra)
+
+  if not effective_extra.get("active_tray") or json.loads(effective_extra.get("active_tray")) != tray_uid:
+    # Spools still claiming this tray, looked up before the new spool is queued onto it
+    fetchSpools(cached=True)
+    stale_spool_ids = [old_spool_id for old_spool_id in SPOOL_WRITE_QUEUE.spoolsClaimingTray(tray_uid) if old_spool_id != int(spool_id)]
+
+    futures = [queueExtraTags(spool_id, {
+      "active_tray": json.dumps(tray_uid),
+    }, spool_extra)]
 
     # Remove active tray from inactive spools
-    for old_spool in fetchSpools(cached=True):
-      if spool_id != old_spool["id"] and old_spool.get("extra") and old_spool["extra"].get("active_tray") and json.loads(old_spool["extra"]["active_tray"]) == trayUid(ams_id, tray_id):
-        patchExtraTags(old_spool["id"], old_spool["extra"], {"active_tray": json.dumps("")})
+    for old_spool_id in stale_spool_ids:
+      futures.append(queueExtraTags(old_spool_id, {"active_tray": json.dumps("")}))
+
+    return futures
   else:
     print("Skipping set active tray")
+    return []
 
-# Fetch spools from spoolman
-def fetchSpools(cached=False):
-  global SPOOLS
-  if not cached or not SPOOLS:
-    SPOOLS = fetchSpoolList()
-    
-    for spool in SPOOLS:
-      initial_weight = 0
-
-      if "initial_weight" in spool and spool["initial_weight"] > 0 :
-        initial_weight = spool["initial_weight"]
-      elif "weight" in spool["filament"] and spool["filament"]["weight"] > 0:
-        initial_weight = spool["filament"]["weight"]
-
-      price = 0
-      if "price" in spool and spool["price"] > 0:
-        price = spool["price"]
-      elif "price" in spool["filament"] and spool["filament"]["price"] > 0:
-        price = spool["filament"]["price"]
-
-      if initial_weight > 0 and price > 0:
-        spool["cost_per_gram"] = price / initial_weight
+def patchExtraTags(spool_id, old_extras, new_extras):
+  spool = spoolman_client.patchExtraTags(spool_id, old_extras, new_extras)
+  updateCachedSpool(spool)
+  return spool
+
+def consumeSpool(spool_id, use_weight):
+  spool = spoolman_client.consumeSpool(spool_id, use_weight)
+  updateCachedSpool(spool)
+  return spool
+
+def augmentSpool(spool):
+  initial_weight = 0
+
+  if "initial_weight" in spool and spool["initial_weight"] > 0 :
+    initial_weight = spool["initial_weight"]
+  elif "weight" in spool["filament"] and spool["filament"]["weight"] > 0:
+    initial_weight = spool["filament"]["weight"]
+
+  price = 0
+  if "price" in spool and spool["price"] > 0:
+    price = spool["price"]
+  elif "price" in spool["filament"] and spool["filament"]["price"] > 0:
+    price = spool["filament"]["price"]
+
+  if initial_weight > 0 and price > 0:
+    spool["cost_per_gram"] = price / initial_weight
+  else:
+    spool["cost_per_gram"] = 0
+
+  if isinstance(spool["filament"].get("multi_color_hexes"), str):
+    spool["filament"]["multi_color_hexes"] = spool["filament"]["multi_color_hexes"].split(',')
+
+  return spool
+
+# Replace the cached copy of a spool with the one SpoolMan returned after a write
+def updateCachedSpool(spool):
+  global SPOOLS, SPOOL_CACHE_VERSION
+  if not spool or "id" not in spool:
+    return
+
+  augmentSpool(spool)
+
+  with SPOOL_CACHE_LOCK:
+    if not SPOOLS:
+      return
+
+    if SPOOL_INDEX.get(spool["id"]) is not None:
+      SPOOLS = [spool if cached_spool["id"] == spool["id"] else cached_spool for cached_spool in SPOOLS]
+    else:
+      SPOOLS = SPOOLS + [spool]
+
+    SPOOL_INDEX.update(spool)
+    SPOOL_WRITTEN_AT[spool["id"]] = time.monotonic()
+    SPOOL_CACHE_VERSION += 1
+
+def removeCachedSpool(spool_id):
+  global SPOOLS, SPOOL_CACHE_VERSION
+
+  with SPOOL_CACHE_LOCK:
+    if SPOOL_INDEX.get(spool_id) is None:
+      return
+
+    SPOOLS = [cached_spool for cached_spool in SPOOLS if cached_spool["id"] != spool_id]
+    SPOOL_INDEX.remove(spool_id)
+    SPOOL_CACHE_VERSION += 1
+
+# Spools embed their filament and its vendor, so changes to those are copied into every spool using them
+def updateCachedFilament(filament):
+  for spool in list(SPOOLS):
+    if spool["filament"]["id"] == filament["id"]:
+      updateCachedSpool({**spool, "filament": dict(filament)})
+
+def updateCachedVendor(vendor):
+  for spool in list(SPOOLS):
+    if spool["filament"].get("vendor", {}).get("id") == vendor["id"]:
+      updateCachedSpool({**spool, "filament": {**spool["filament"], "vendor": dict(vendor)}})
+
+def applySpoolmanEvent(event):
+  """
+  Applies a SpoolMan websocket change notification of the form
+  {"type": "added" | "updated" | "deleted", "resource": "spool" | "filament" | "vendor", "payload": {...}}
+  to the spool cache.
+  """
+  event_type = event.get("type")
+  resource = event.get("resource")
+  payload = event.get("payload") or {}
+
+  if resource == "spool":
+    # Archived spools are not part of the list SpoolMan returns by default
+    if event_type == "deleted" or payload.get("archived"):
+      removeCachedSpool(payload["id"])
+    elif event_type in ("added", "updated"):
+      updateCachedSpool(payload)
+  elif resource == "filament" and event_type == "updated":
+    updateCachedFilament(payload)
+  elif resource == "vendor" and event_type == "updated":
+    updateCachedVendor(payload)
+
+def setSpoolCacheLive(live):
+  global SPOOL_CACHE_LIVE
+  SPOOL_CACHE_LIVE = live
+
+# Download the spool list and swap it in, keeping the cached objects of unchanged spools
+def refreshSpools():
+  global SPOOLS, SPOOL_CACHE_VERSION, SPOOL_CACHE_FETCHED_AT
+  started_at = time.monotonic()
+  spools = [augmentSpool(spool) for spool in fetchSpoolList()]
+
+  with SPOOL_CACHE_LOCK:
+    changed = len(spools) != len(SPOOLS)
+    for i, spool in enumerate(spools):
+      cached_spool = SPOOL_INDEX.get(spool["id"])
+      if cached_spool is not None and SPOOL_WRITTEN_AT.get(spool["id"], 0) > started_at:
+        spools[i] = cached_spool
+      elif cached_spool == spool:
+        spools[i] = cached_spool
       else:
-        spool["cost_per_gram"] = 0
+        changed = True
+
+    if changed or not SPOOLS:
+      SPOOLS = spools
+      SPOOL_INDEX.rebuild(SPOOLS)
+      SPOOL_CACHE_VERSION += 1
+
+    SPOOL_CACHE_FETCHED_AT = started_at
+    SPOOL_WRITTEN_AT.clear()
+
+  return SPOOLS
+
+def refreshSpoolsInBackground():
+  # Only one refresh at a time, callers keep using the current cache meanwhile
+  if not SPOOL_CACHE_REFRESHING.acquire(blocking=False):
+    return
+
+  def refresh():
+    try:
+      refreshSpools()
+    except Exception:
+      traceback.print_exc()
+    finally:
+      SPOOL_CACHE_REFRESHING.release()
+
+  Thread(target=refresh, daemon=True).start()
+
+def spool_cache_refresher():
+  while True:
+    time.sleep(SPOOL_CACHE_TTL)
+    if not SPOOL_CACHE_LIVE and time.monotonic() - SPOOL_CACHE_FETCHED_AT >= SPOOL_CACHE_TTL:
+      refreshSpoolsInBackground()
+
+def startSpoolCacheRefresher():
+  Thread(target=spool_cache_refresher, daemon=True).start()
+
+def getSpoolCacheVersion():
+  return SPOOL_CACHE_VERSION
+
+# Spools from the cache. Only an empty cache blocks on SpoolMan, a stale one is
+# served as is while a refresh runs in the background. cached=True never refreshes,
+# neither does a cache kept live by the change feed.
+def fetchSpools(cached=False):
+  if not SPOOLS:
+    with SPOOL_CACHE_LOCK:
+      if not SPOOLS:
+        refreshSpools()
+  elif not cached and not SPOOL_CACHE_LIVE and time.monotonic() - SPOOL_CACHE_FETCHED_AT >= SPOOL_CACHE_TTL:
+    refreshSpoolsInBackground()
 
-      if "multi_color_hexes" in spool["filament"]:
-        spool["filament"]["multi_color_hexes"] = spool["filament"]["multi_color_hexes"].split(',')
-        
   return SPOOLS
 
 def getSettings(cached=False):
@@ -1,15 +1,22 @@
 import requests
 import zipfile
+import hashlib
 import tempfile
 import xml.etree.ElementTree as ET
-import pycurl
-import urllib.parse
 import os
 import re
-import time
+import mmap
+import shutil
 from datetime import datetime
-from config import PRINTER_ID, PRINTER_CODE, PRINTER_IP
-from urllib.parse import urlparse, unquote
+from config import REMOTE_3MF
+from urllib.parse import urlparse
+from metadata_cache import METADATA_CACHE
+from printer_ftp import PRINTER_FTP, PrinterFTPError
+from remote_zip import RemoteHTTPFile, RemoteFTPFile, RangeNotSupported
+
+# 3MF files can be hundreds of MB, they are only ever moved around in chunks of this size
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+PRINTS_DIR = os.path.join(os.getcwd(), 'static', 'prints')
 
 def parse_ftp_listing(line):
     """Parse a line from an FTP LIST command."""
@@ -39,18 +46,59 @@ def parse_date(item):
     except ValueError:
         return None
 
-def get_filament_order(file):
-    filament_order = {} 
-    switch_count = 0 
+# Plate gcode is scanned in blocks of this size, carrying the last partial line over
+FILAMENT_SCAN_CHUNK_SIZE = 8 * 1024 * 1024
+FILAMENT_CHANGE_MARKER = b"M620 S"
+# Same rule as matching the stripped line against ^M620 S(\d+)[^;\r\n]*$
+FILAMENT_CHANGE_LINE = re.compile(rb"[ \t\r\x0b\x0c]*M620 S(\d+)[^;\r\n]*\r?\Z")
+
+def scan_filament_changes(data, end, filament_order, switch_count):
+    """
+    Finds the M620 filament change lines in data[:end]. Only the few lines that
+    contain the marker are looked at, everything else is skipped with find().
+    """
+    pos = data.find(FILAMENT_CHANGE_MARKER, 0, end)
+    while pos != -1:
+        line_start = data.rfind(b"\n", 0, pos) + 1
+        line_end = data.find(b"\n", pos, end)
+        if line_end == -1:
+            line_end = end
 
-    for line in file:
-        match_filament = re.match(r"^M620 S(\d+)[^;\r\n]*$", line.decode("utf-8").strip())
+        match_filament = FILAMENT_CHANGE_LINE.match(data, line_start, line_end)
         if match_filament:
             filament = int(match_filament.group(1))
-            if filament not in filament_order and int(filament) != 255:
-                filament_order[int(filament)] = switch_count
+            if filament not in filament_order and filament != 255:
+                filament_order[filament] = switch_count
             switch_count += 1
 
+        pos = data.find(FILAMENT_CHANGE_MARKER, line_end, end)
+
+    return switch_count
+
+def get_filament_order(file, chunk_size=FILAMENT_SCAN_CHUNK_SIZE):
+    filament_order = {}
+    switch_count = 0
+
+    try:
+        fileno = file.fileno()
+    except (AttributeError, OSError):
+        fileno = None
+
+    if fileno is not None and os.fstat(fileno).st_size > 0:
+        # Plain files are scanned in place without copying them into memory
+        with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as data:
+            scan_filament_changes(data, len(data), filament_order, switch_count)
+    else:
+        # Zip members are inflated chunk by chunk, only complete lines are scanned
+        tail = b""
+        while chunk := file.read(chunk_size):
+            data = tail + chunk
+            end = data.rfind(b"\n") + 1
+            switch_count = scan_filament_changes(data, end, filament_order, switch_count)
+            tail = data[end:]
+
+        scan_filament_changes(tail, len(tail), filament_order, switch_count)
+
     if len(filament_order) == 0:
        filament_order = {1:0}
 
@@ -59,63 +107,229 @@ def get_filament_order(file):
 def download3mfFromCloud(url, destFile):
   print("Downloading 3MF file from cloud...")
   # Download the file and save it to the temporary file
-  response = requests.get(url)
-  response.raise_for_status()
-  destFile.write(response.content)
+  with requests.get(url, stream=True) as response:
+    response.raise_for_status()
+    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+      destFile.write(chunk)
 
-def download3mfFromFTP(filename, destFile):
+def download3mfFromFTP(filename, destFile, ftp=PRINTER_FTP):
   print("Downloading 3MF file from FTP...")
-  ftp_host = PRINTER_IP
-  ftp_user = "bblp"
-  ftp_pass = PRINTER_CODE
   remote_path = "/cache/" + filename
-  local_path = destFile.name  # 🔹 Download into the current directory
-  encoded_remote_path = urllib.parse.quote(remote_path)
-  with open(local_path, "wb") as f:
-    c = pycurl.Curl()
-    url = f"ftps://{ftp_host}{encoded_remote_path}"
-
-    # 🔹 Setup explicit FTPS connection (like FileZilla)
-    c.setopt(c.URL, url)
-    c.setopt(c.USERPWD, f"{ftp_user}:{ftp_pass}")
-    c.setopt(c.WRITEDATA, f)
-    
-    # 🔹 Enable SSL/TLS
-    c.setopt(c.SSL_VERIFYPEER, 0)  # Disable SSL verification
-    c.setopt(c.SSL_VERIFYHOST, 0)
-    
-    # 🔹 Enable passive mode (like FileZilla)
-    c.setopt(c.FTP_SSL, c.FTPSSL_ALL)
-    
-    # 🔹 Enable proper TLS authentication
-    c.setopt(c.FTPSSLAUTH, c.FTPAUTH_TLS)
-
-    print("[DEBUG] Starting file download into ./test.3mf...")
-
-    try:
-        c.perform()
-        print("[DEBUG] File successfully downloaded into ./test.3mf!")
-    except pycurl.error as e:
-        print(f"[ERROR] cURL error: {e}")
+  transfer = ftp.download(remote_path, destFile)
+  print(f"Downloaded {transfer['size'] / 1024 / 1024:.1f} MB from the printer in {transfer['time']:.1f}s "
+        f"({transfer['speed'] / 1024 / 1024:.1f} MB/s, {'reused connection' if transfer['reused'] else 'new connection'})")
 
-    c.close()
+def listFTPDirectory(remote_dir, ftp=PRINTER_FTP):
+  return [item for item in map(parse_ftp_listing, ftp.list(remote_dir)) if item]
 
 def download3mfFromLocalFilesystem(path, destFile):
   with open(path, "rb") as src_file:
-    destFile.write(src_file.read())
+    shutil.copyfileobj(src_file, destFile, DOWNLOAD_CHUNK_SIZE)
 
-def getMetaDataFrom3mf(url):
+def get3mfIdentity(url, ftp=PRINTER_FTP):
+  """
+  A cheap identity for the file behind url that changes whenever its content
+  does: size and date from the FTP listing, the cloud ETag or the local file's
+  size and mtime. Returns None if the source can't tell.
+  """
+  try:
+    if url.startswith("http"):
+      # Presigned cloud URLs only allow GET, a one byte range still carries the ETag
+      with requests.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=10) as response:
+        response.raise_for_status()
+        etag = response.headers.get("ETag")
+      return f"etag:{urlparse(url).netloc}:{etag}" if etag else None
+    elif url.startswith("local:"):
+      path = url.replace("local:", "")
+      stat = os.stat(path)
+      return f"local:{path}:{stat.st_size}:{stat.st_mtime_ns}"
+    else:
+      remote_path = "/cache/" + url.replace("ftp://", "").replace(".gcode","")
+      remote_dir, name = remote_path.rsplit("/", 1)
+      for item in listFTPDirectory(remote_dir, ftp):
+        if item["name"] == name:
+          return f"ftp:{ftp.printer_id}:{remote_path}:{item['size']}:{item['month']} {item['day']} {item['time_or_year']}"
+      return None
+  except (requests.exceptions.RequestException, PrinterFTPError, OSError) as e:
+    print(f"Could not identify 3MF file {url}: {e}")
+    return None
+
+def storeThumbnail(source_file):
+  """
+  Stores a plate thumbnail in static/prints named after the hash of its content,
+  so repeat prints share one file. Returns the file name.
+  """
+  digest = hashlib.sha256()
+  with tempfile.NamedTemporaryFile(dir=PRINTS_DIR, suffix=".tmp", delete=False) as target_file:
+    while chunk := source_file.read(DOWNLOAD_CHUNK_SIZE):
+      digest.update(chunk)
+      target_file.write(chunk)
+
+  image = digest.hexdigest() + ".png"
+  if os.path.exists(os.path.join(PRINTS_DIR, image)):
+    os.remove(target_file.name)
+  else:
+    os.replace(target_file.name, os.path.join(PRINTS_DIR, image))
+
+  return image
+
+def useCachedMetadata(url, metadata, thumbnail_path):
+  metadata["file"] = os.path.basename(urlparse(url).path)
+  with open(thumbnail_path, "rb") as source_file:
+    metadata["image"] = storeThumbnail(source_file)
+
+  print(f"Using cached 3MF metadata: {metadata}")
+  return metadata
+
+def archiveKey(z):
+  """Identifies an archive by the names, checksums and sizes of its entries."""
+  digest = hashlib.sha256()
+  for info in z.infolist():
+    digest.update(f"{info.filename}:{info.CRC}:{info.file_size}\n".encode("utf-8"))
+  return "zip:" + digest.hexdigest()
+
+def read3mf(url, source, identity, filament_order):
+  metadata = {}
+  metadata["file"] = os.path.basename(urlparse(url).path)
+
+  # Unzip the 3MF file
+  with zipfile.ZipFile(source, 'r') as z:
+    # The same file may have been uploaded again under a new name or date
+    content_key = archiveKey(z) if METADATA_CACHE.enabled else None
+    cached = METADATA_CACHE.get(content_key)
+    if cached and (not filament_order or "filamentOrder" in cached[0]):
+      METADATA_CACHE.alias(identity, content_key)
+      return useCachedMetadata(url, *cached)
+
+    # Check for the Metadata/slice_info.config file
+    slice_info_path = "Metadata/slice_info.config"
+    if slice_info_path in z.namelist():
+      with z.open(slice_info_path) as slice_info_file:
+        # Parse the XML content of the file
+        tree = ET.parse(slice_info_file)
+        root = tree.getroot()
+
+        # Extract id and used_g from each filament
+        """
+        <?xml version="1.0" encoding="UTF-8"?>
+        <config>
+          <header>
+            <header_item key="X-BBL-Client-Type" value="slicer"/>
+            <header_item key="X-BBL-Client-Version" value="01.10.01.50"/>
+          </header>
+          <plate>
+            <metadata key="index" value="1"/>
+            <metadata key="printer_model_id" value="N2S"/>
+            <metadata key="nozzle_diameters" value="0.4"/>
+            <metadata key="timelapse_type" value="0"/>
+            <metadata key="prediction" value="5450"/>
+            <metadata key="weight" value="26.91"/>
+            <metadata key="outside" value="false"/>
+            <metadata key="support_used" value="false"/>
+            <metadata key="label_object_enabled" value="true"/>
+            <object identify_id="930" name="FILENAME.3mf" skipped="false" />
+            <object identify_id="1030" name="FILENAME.3mf" skipped="false" />
+            <object identify_id="1130" name="FILENAME.3mf" skipped="false" />
+            <object identify_id="1230" name="FILENAME.3mf" skipped="false" />
+            <object identify_id="1330" name="FILENAME.3mf" skipped="false" />
+            <object identify_id="1430" name="FILENAME.3mf" skipped="false" />
+            <object identify_id="1530" name="FILENAME.3mf" skipped="false" />
+            <object identify_id="1630" name="FILENAME.3mf" skipped="false" />
+            <object identify_id="1730" name="FILENAME.3mf" skipped="false" />
+            <object identify_id="1830" name="FILENAME.3mf" skipped="false" />
+            <object identify_id="1930" name="FILENAME.3mf" skipped="false" />
+            <object identify_id="2030" name="FILENAME.3mf" skipped="false" />
+            <object identify_id="2130" name="FILENAME.3mf" skipped="false" />
+            <object identify_id="2230" name="FILENAME.3mf" skipped="false" />
+            <filament id="1" tray_info_idx="GFL99" type="PLA" color="#0DFF00" used_m="6.79" used_g="20.26" />
+            <filament id="2" tray_info_idx="GFL99" type="PLA" color="#000000" used_m="0.72" used_g="2.15" />
+            <filament id="6" tray_info_idx="GFL99" type="PLA" color="#0DFF00" used_m="1.20" used_g="3.58" />
+            <filament id="7" tray_info_idx="GFL99" type="PLA" color="#000000" used_m="0.31" used_g="0.92" />
+            <warning msg="bed_temperature_too_high_than_filament" level="1" error_code ="1000C001"  />
+          </plate>
+        </config>
+        """
+
+        for meta in root.findall(".//plate/metadata"):
+          if meta.attrib.get("key") == "index":
+              metadata["plateID"] = meta.attrib.get("value", "")
+
+        usage = {}
+        filaments= {}
+        filamentId = 1
+        for plate in root.findall(".//plate"):
+          for filament in plate.findall(".//filament"):
+            used_g = filament.attrib.get("used_g")
+            #filamentId = int(filament.attrib.get("id"))
+
+            usage[filamentId] = used_g
+            filaments[filamentId] = {"id": filamentId,
+                                     "tray_info_idx": filament.attrib.get("tray_info_idx"), 
+                                     "type":filament.attrib.get("type"), 
+                                     "color": filament.attrib.get("color"), 
+                                     "used_g": used_g, 
+                                     "used_m":filament.attrib.get("used_m")}
+            filamentId += 1
+
+        metadata["filaments"] = filaments
+        metadata["usage"] = usage
+    else:
+      print(f"File '{slice_info_path}' not found in the archive.")
+      return {}
+
+    with z.open("Metadata/plate_"+metadata["plateID"]+".png") as source_file:
+      metadata["image"] = storeThumbnail(source_file)
+
+    # Check for the Metadata/slice_info.config file
+    gcode_path = "Metadata/plate_"+metadata["plateID"]+".gcode"
+    if filament_order and gcode_path in z.namelist():
+      with z.open(gcode_path) as gcode_file:
+        metadata["filamentOrder"] =  get_filament_order(gcode_file)
+
+    print(metadata)
+
+    if content_key:
+      cached = {key: value for key, value in metadata.items() if key not in ("file", "image")}
+      METADATA_CACHE.put(content_key, cached, os.path.join(PRINTS_DIR, metadata["image"]), identity)
+
+    return metadata
+
+def openRemote3mf(url, ftp=PRINTER_FTP):
+  if url.startswith("http"):
+    return RemoteHTTPFile(url)
+  return RemoteFTPFile(ftp, "/cache/" + url.replace("ftp://", "").replace(".gcode",""))
+
+def getMetaDataFrom3mf(url, filament_order=True, ftp=PRINTER_FTP):
   """
   Download a 3MF file from a URL, unzip it, and parse filament usage.
 
+  Cloud and printer files are read in place with range requests when the
+  server supports them, so only the central directory, slice_info.config, the
+  plate thumbnail and, if filament_order is set, the plate gcode are fetched.
+
   Args:
       url (str): URL to the 3MF file.
+      filament_order (bool): Scan the plate gcode for the order filaments are used in.
+      ftp (PrinterFTPSession): Session to the printer that has the file, for files on its SD card.
 
   Returns:
-      list[dict]: List of dictionaries with `tray_info_idx` and `used_g`.
+      dict: Filaments, usage, plate, thumbnail and filament order of the print.
   """
   try:
-    metadata = {}
+    # Repeat prints of a known file skip the download
+    identity = get3mfIdentity(url, ftp) if METADATA_CACHE.enabled else None
+    cached = METADATA_CACHE.get(identity)
+    if cached and (not filament_order or "filamentOrder" in cached[0]):
+      return useCachedMetadata(url, *cached)
+
+    if REMOTE_3MF and not url.startswith("local:"):
+      try:
+        with openRemote3mf(url, ftp) as remote_file:
+          metadata = read3mf(url, remote_file, identity, filament_order)
+        print(f"Read {remote_file.bytes_fetched / 1024:.0f} KB of the {remote_file.size / 1024:.0f} KB 3MF file in {remote_file.requests} requests")
+        return metadata
+      except (RangeNotSupported, PrinterFTPError) as e:
+        print(f"Can't read the 3MF file in place ({e}), downloading all of it")
 
     # Create a temporary file
     with tempfile.NamedTemporaryFile(delete_on_close=False,delete=True, suffix=".3mf") as temp_file:
@@ -126,110 +340,15 @@ def getMetaDataFrom3mf(url):
       elif url.startswith("local:"):
         download3mfFromLocalFilesystem(url.replace("local:", ""), temp_file)
       else:
-        download3mfFromFTP(url.replace("ftp://", "").replace(".gcode",""), temp_file)
+        download3mfFromFTP(url.replace("ftp://", "").replace(".gcode",""), temp_file, ftp)
       
       temp_file.close()
 
-      parsed_url = urlparse(url)
-      metadata["file"] = os.path.basename(parsed_url.path)
-
       print(f"3MF file downloaded and saved as {temp_file_name}.")
 
-      # Unzip the 3MF file
-      with zipfile.ZipFile(temp_file_name, 'r') as z:
-        # Check for the Metadata/slice_info.config file
-        slice_info_path = "Metadata/slice_info.config"
-        if slice_info_path in z.namelist():
-          with z.open(slice_info_path) as slice_info_file:
-            # Parse the XML content of the file
-            tree = ET.parse(slice_info_file)
-            root = tree.getroot()
-
-            # Extract id and used_g from each filament
-            """
-            <?xml version="1.0" encoding="UTF-8"?>
-            <config>
-              <header>
-                <header_item key="X-BBL-Client-Type" value="slicer"/>
-                <header_item key="X-BBL-Client-Version" value="01.10.01.50"/>
-              </header>
-              <plate>
-                <metadata key="index" value="1"/>
-                <metadata key="printer_model_id" value="N2S"/>
-                <metadata key="nozzle_diameters" value="0.4"/>
-                <metadata key="timelapse_type" value="0"/>
-                <metadata key="prediction" value="5450"/>
-                <metadata key="weight" value="26.91"/>
-                <metadata key="outside" value="false"/>
-                <metadata key="support_used" value="false"/>
-                <metadata key="label_object_enabled" value="true"/>
-                <object identify_id="930" name="FILENAME.3mf" skipped="false" />
-                <object identify_id="1030" name="FILENAME.3mf" skipped="false" />
-                <object identify_id="1130" name="FILENAME.3mf" skipped="false" />
-                <object identify_id="1230" name="FILENAME.3mf" skipped="false" />
-                <object identify_id="1330" name="FILENAME.3mf" skipped="false" />
-                <object identify_id="1430" name="FILENAME.3mf" skipped="false" />
-                <object identify_id="1530" name="FILENAME.3mf" skipped="false" />
-                <object identify_id="1630" name="FILENAME.3mf" skipped="false" />
-                <object identify_id="1730" name="FILENAME.3mf" skipped="false" />
-                <object identify_id="1830" name="FILENAME.3mf" skipped="false" />
-                <object identify_id="1930" name="FILENAME.3mf" skipped="false" />
-                <object identify_id="2030" name="FILENAME.3mf" skipped="false" />
-                <object identify_id="2130" name="FILENAME.3mf" skipped="false" />
-                <object identify_id="2230" name="FILENAME.3mf" skipped="false" />
-                <filament id="1" tray_info_idx="GFL99" type="PLA" color="#0DFF00" used_m="6.79" used_g="20.26" />
-                <filament id="2" tray_info_idx="GFL99" type="PLA" color="#000000" used_m="0.72" used_g="2.15" />
-                <filament id="6" tray_info_idx="GFL99" type="PLA" color="#0DFF00" used_m="1.20" used_g="3.58" />
-                <filament id="7" tray_info_idx="GFL99" type="PLA" color="#000000" used_m="0.31" used_g="0.92" />
-                <warning msg="bed_temperature_too_high_than_filament" level="1" error_code ="1000C001"  />
-              </plate>
-            </config>
-            """
-            
-            for meta in root.findall(".//plate/metadata"):
-              if meta.attrib.get("key") == "index":
-                  metadata["plateID"] = meta.attrib.get("value", "")
-
-            usage = {}
-            filaments= {}
-            filamentId = 1
-            for plate in root.findall(".//plate"):
-              for filament in plate.findall(".//filament"):
-                used_g = filament.attrib.get("used_g")
-                #filamentId = int(filament.attrib.get("id"))
-                
-                usage[filamentId] = used_g
-                filaments[filamentId] = {"id": filamentId,
-                                         "tray_info_idx": filament.attrib.get("tray_info_idx"), 
-                                         "type":filament.attrib.get("type"), 
-                                         "color": filament.attrib.get("color"), 
-                                         "used_g": used_g, 
-                                         "used_m":filament.attrib.get("used_m")}
-                filamentId += 1
-
-            metadata["filaments"] = filaments
-            metadata["usage"] = usage
-        else:
-          print(f"File '{slice_info_path}' not found in the archive.")
-          return {}
-
-        metadata["image"] = time.strftime('%Y%m%d%H%M%S') + ".png"
-
-        with z.open("Metadata/plate_"+metadata["plateID"]+".png") as source_file:
-          with open(os.path.join(os.getcwd(), 'static', 'prints', metadata["image"]), 'wb') as target_file:
-              target_file.write(source_file.read())
-
-        # Check for the Metadata/slice_info.config file
-        gcode_path = "Metadata/plate_"+metadata["plateID"]+".gcode"
-        if gcode_path in z.namelist():
-          with z.open(gcode_path) as gcode_file:
-            metadata["filamentOrder"] =  get_filament_order(gcode_file)
-
-        print(metadata)
-
-        return metadata
+      return read3mf(url, temp_file_name, identity, filament_order)
 
-  except requests.exceptions.RequestException as e:
+  except (requests.exceptions.RequestException, PrinterFTPError) as e:
     print(f"Error downloading file: {e}")
     return {}
   except zipfile.BadZipFile: